@@ -18,6 +18,7 @@ import os
 import six
 from six.moves import queue
 import socket
+import threading
 import time
 import traceback
 
@@ -31,6 +32,11 @@ EVENT_SERVE = 'serve'
 EVENT_RECONCILE = 'reconcile'
 EVENTS = [EVENT_SERVE, EVENT_RECONCILE]
 PAYLOAD_MAX_LEN = 1024
+# Separates the event from the roots it concerns in the payload. It can't be
+# part of an ACI name.
+ROOTS_SEPARATOR = '|'
+# Above this amount of roots, events concern all of them
+MAX_EVENT_ROOTS = 100
 SOCKET_RECONNECT_MAX_WAIT = 10
 
 
@@ -77,9 +83,10 @@ class SenderBase(object):
         """
 
     @abc.abstractmethod
-    def reconcile(self):
+    def reconcile(self, roots=None):
         """Send a reconcile event.
 
+        :param roots: roots that changed, None when unknown
         :return:
         """
 
@@ -87,6 +94,9 @@ class SenderBase(object):
 class EventHandler(EventHandlerBase):
 
     q = None
+    # Roots changed since the last get_roots call, None when unknown
+    roots = None
+    roots_lock = threading.Lock()
 
     def initialize(self, conf_manager):
         LOG.info("Initialize Event Handler")
@@ -141,8 +151,9 @@ class EventHandler(EventHandlerBase):
         event = self.sock.recv(PAYLOAD_MAX_LEN)
         event = event.decode('utf-8')
         LOG.debug("Received event %s" % event)
-        if event.lower() in EVENTS:
-            self._put_event(event)
+        event = event.split(ROOTS_SEPARATOR)
+        if event[0].lower() in EVENTS:
+            self._put_event(event[0], roots=event[1:] or None)
 
     def get_event(self, timeout=None):
         try:
@@ -151,16 +162,34 @@ class EventHandler(EventHandlerBase):
             # Timeout expired
             return None
 
+    @staticmethod
+    def get_roots():
+        """Return and forget the roots changed by the events received
+
+        :return: set of roots, or None if any root could have changed
+        """
+        with EventHandler.roots_lock:
+            roots = EventHandler.roots
+            EventHandler.roots = set()
+        return roots
+
     @staticmethod
     def serve():
         EventHandler._put_event(EVENT_SERVE)
 
     @staticmethod
-    def reconcile():
-        EventHandler._put_event(EVENT_RECONCILE)
+    def reconcile(roots=None):
+        EventHandler._put_event(EVENT_RECONCILE, roots=roots)
 
     @staticmethod
-    def _put_event(event):
+    def _put_event(event, roots=None):
+        with EventHandler.roots_lock:
+            if roots is None or event.lower() == EVENT_SERVE:
+                EventHandler.roots = None
+            elif EventHandler.roots is not None:
+                EventHandler.roots.update(roots)
+                if len(EventHandler.roots) > MAX_EVENT_ROOTS:
+                    EventHandler.roots = None
         try:
             EventHandler.q.put_nowait(event)
         except queue.Full:
@@ -192,10 +221,15 @@ class EventSender(SenderBase):
     def serve(self):
         self._send(EVENT_SERVE)
 
-    def reconcile(self):
-        self._send(EVENT_RECONCILE)
+    def reconcile(self, roots=None):
+        self._send(EVENT_RECONCILE, roots=roots)
 
-    def _send(self, event):
+    def _send(self, event, roots=None):
+        if roots and len(roots) <= MAX_EVENT_ROOTS:
+            payload = ROOTS_SEPARATOR.join([event] + sorted(roots))
+            # Too many roots for a datagram concern all of them
+            if len(payload.encode('utf-8')) <= PAYLOAD_MAX_LEN:
+                event = payload
         LOG.debug("Sending %s event" % event)
         try:
             self.sock.send(event.encode('utf-8'))
@@ -13,17 +13,91 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import threading
+import time
 import traceback
 
 from oslo_log import log as logging
 import oslo_messaging
 
+from aim.agent.aid import event_handler
 from aim.api import tree
 from aim import config as aim_cfg
 
 
 LOG = logging.getLogger(__name__)
 TOPIC_AID_EVENT = 'aid_event'
+EVENT_SERVE = 'serve'
+EVENT_RECONCILE = 'reconcile'
+
+
+class NotificationDebouncer(object):
+    """Coalesce the notifications sent to the same target
+
+    The first notification after an idle period is sent right away, the ones
+    following within the window are merged and sent once when it expires.
+    Serve implies a reconcile, and roots are merged unless any notification
+    concerns all of them.
+    """
+
+    def __init__(self, clock=None):
+        self._clock = clock or time.time
+        self._lock = threading.Lock()
+        # target -> end of the current window
+        self._windows = {}
+        # target -> [send, context, method, roots] waiting for the window end
+        self._pending = {}
+
+    def notify(self, send, context, method, server, roots=None, window=0):
+        if window <= 0:
+            return send(context, method, server, roots=roots)
+        with self._lock:
+            now = self._clock()
+            if self._windows.get(server, 0) <= now:
+                self._windows[server] = now + window
+            else:
+                pending = self._pending.get(server)
+                if pending is None:
+                    self._pending[server] = [send, context, method, roots]
+                    timer = threading.Timer(self._windows[server] - now,
+                                            self._flush, args=(server, window))
+                    timer.daemon = True
+                    timer.start()
+                else:
+                    self._merge(pending, method, roots)
+                return
+        return send(context, method, server, roots=roots)
+
+    @staticmethod
+    def _merge(pending, method, roots):
+        if method == EVENT_SERVE:
+            pending[2] = EVENT_SERVE
+        if pending[2] == EVENT_SERVE or roots is None or pending[3] is None:
+            pending[3] = None
+        else:
+            merged = sorted(set(pending[3]) | set(roots))
+            pending[3] = (merged if
+                          len(merged) <= event_handler.MAX_EVENT_ROOTS
+                          else None)
+
+    def _flush(self, server, window):
+        with self._lock:
+            pending = self._pending.pop(server, None)
+            if pending is None:
+                return
+            self._windows[server] = self._clock() + window
+        send, context, method, roots = pending
+        LOG.debug("Sending coalesced '%s' message", method)
+        try:
+            send(context, method, server, roots=roots)
+        except Exception as e:
+            LOG.debug(traceback.format_exc())
+            LOG.error("Failed to send coalesced '%s' message: %s",
+                      method, str(e))
+
+
+# Shared by all the clients of this process
+debouncer = NotificationDebouncer()
 
 
 class AIDEventRpcApi(object):
@@ -52,19 +126,29 @@ class AIDEventRpcApi(object):
 
     def serve(self, context, server=None):
         LOG.debug("Sending broadcast 'serve' message")
-        return self._cast(context, 'serve', server)
+        return self._notify(context, EVENT_SERVE, server)
 
-    def reconcile(self, context, server=None):
+    def reconcile(self, context, server=None, roots=None):
         LOG.debug("Sending broadcast 'reconcile' message")
-        return self._cast(context, 'reconcile', server)
+        return self._notify(context, EVENT_RECONCILE, server, roots=roots)
+
+    def _notify(self, context, method, server, roots=None):
+        return debouncer.notify(
+            self._send, context, method, server, roots=roots,
+            window=aim_cfg.CONF.aim.agent_event_notification_window)
+
+    def _send(self, context, method, server, roots=None):
+        if method == EVENT_SERVE:
+            return self._cast(context, method, server)
+        return self._cast(context, method, server, roots=roots)
 
-    def _cast(self, context, method, server):
+    def _cast(self, context, method, server, **kwargs):
         if self.client:
             if server:
                 cctxt = self.client.prepare(server=server)
             else:
                 cctxt = self.client
-            return cctxt.cast(context, method, fanout=True)
+            return cctxt.cast(context, method, fanout=True, **kwargs)
 
     def tree_creation_postcommit(self, added, updated, deleted):
         should_serve = any(isinstance(x, tree.TypeTreeBase)
@@ -76,7 +160,12 @@ class AIDEventRpcApi(object):
             self.serve({})
         elif should_reconcile:
             # Serve implies a reconcile
-            self.reconcile({})
+            roots = sorted(set(x.root_rn for x in added + updated
+                               if isinstance(x, (tree.TypeTreeBase,
+                                                 tree.ActionLog))))
+            self.reconcile(
+                {}, roots=(roots if len(roots) <= event_handler.MAX_EVENT_ROOTS
+                           else None))
 
 
 class AIDEventServerRpcCallback(object):
@@ -92,7 +181,7 @@ class AIDEventServerRpcCallback(object):
         return self.sender.serve()
 
     def reconcile(self, context, **kwargs):
-        return self.sender.reconcile()
+        return self.sender.reconcile(roots=kwargs.get('roots'))
 
 
 class Connection(object):
@@ -31,6 +31,7 @@ from aim.common import utils
 from aim import config as aim_cfg
 from aim import context
 from aim.db import api
+from aim import exceptions as exc
 from aim import tree_manager
 
 LOG = logging.getLogger(__name__)
@@ -107,8 +108,22 @@ class AID(object):
             self._change_report_interval, 'agent_report_interval', group='aim')
         self.squash_time = self.conf_manager.get_option_and_subscribe(
             self._change_squash_time, 'agent_event_squash_time', group='aim')
+        self.max_squash_time = self.conf_manager.get_option_and_subscribe(
+            self._change_max_squash_time, 'agent_event_squash_max_time',
+            group='aim')
+        # Moving average of the reconciliation cycle duration
+        self.cycle_time = 0
+        self.full_sweep_interval = self.conf_manager.get_option_and_subscribe(
+            self._change_full_sweep_interval, 'agent_full_sweep_interval',
+            group='aim')
+        self._next_full_sweep = 0
         self.deadlock_time = self.conf_manager.get_option_and_subscribe(
             self._change_deadlock_time, 'agent_deadlock_time', group='aim')
+        self.balance_factor = self.conf_manager.get_option_and_subscribe(
+            self._change_balance_factor, 'tenant_balance_factor',
+            group='aim')
+        # Tenant assignation state kept between serving cycles
+        self.ring = hashring.ConsistentHashRing()
         self._spawn_heartbeat_loop()
         self.events = event_handler.EventHandler().initialize(
             self.conf_manager)
@@ -135,24 +150,47 @@ class AID(object):
                     LOG.info("Stopping AID main loop.")
                     raise utils.StopLoop()
                 continue
-            if not first_event_time:
-                first_event_time = time.time()
+            now = time.time()
+            if first_event_time is None:
+                first_event_time = last_event_time = now
+                squash_window = self._get_squash_window()
             if event in event_handler.EVENTS + [None]:
-                # Set squash timeout
-                squash_time = (first_event_time + self.squash_time -
-                               time.time())
+                if event:
+                    last_event_time = now
+                # Set squash timeout: every event delays the cycle by the
+                # squash time, as long as the window allows it
+                squash_time = min(first_event_time + squash_window,
+                                  last_event_time + self.squash_time) - now
                 if event == event_handler.EVENT_SERVE:
                     # Serving tenants is required as well
                     serve = True
         start_time = time.time()
-        self._reconciliation_cycle(serve)
+        roots = self.events.get_roots()
+        if serve or start_time >= self._next_full_sweep:
+            # Periodically observe every root, in case some event was lost
+            roots = None
+        if roots is None:
+            self._next_full_sweep = start_time + self.full_sweep_interval
+        self._reconciliation_cycle(serve, roots=roots)
+        self.cycle_time = (self.cycle_time + time.time() - start_time) / 2.0
         utils.wait_for_next_cycle(start_time, self.polling_interval,
                                   LOG, readable_caller='AID',
                                   notify_exceeding_timeout=False)
 
+    def _get_squash_window(self):
+        """Maximum time events are squashed before a reconciliation cycle
+
+        Isolated events are only squashed for agent_event_squash_time, while
+        bursts of events are absorbed for as long as a cycle recently took,
+        up to agent_event_squash_max_time, so that cycles don't run back to
+        back on partial state.
+        """
+        return max(self.squash_time,
+                   min(self.max_squash_time, self.cycle_time))
+
     @utils.retry_loop(DAEMON_LOOP_MAX_WAIT, DAEMON_LOOP_MAX_RETRIES, 'AID-REC',
                       fail=False, return_=True)
-    def _reconciliation_cycle(self, serve=True):
+    def _reconciliation_cycle(self, serve=True, roots=None):
         # Regenerate context at each reconciliation cycle
         # TODO(ivar): set request-id so that oslo log can track it
         aim_ctx = context.AimContext(store=api.get_store())
@@ -171,9 +209,11 @@ class AID(object):
         # time for events to happen
 
         # Observe the two universes to fix their current state
+        if roots is not None:
+            LOG.debug("Observing roots %s" % sorted(roots))
         for pair in self.multiverse:
-            pair[DESIRED].observe(aim_ctx)
-            pair[CURRENT].observe(aim_ctx)
+            pair[DESIRED].observe(aim_ctx, roots=roots)
+            pair[CURRENT].observe(aim_ctx, roots=roots)
 
         delete_candidates = set()
         vetoes = set()
@@ -264,26 +304,64 @@ class AID(object):
             return result
 
     def _tenant_assignation_algorithm(self, aim_ctx, agents):
-        # TODO(ivar): just randomly hash each tenant to agents for now. This
-        # algorithm should be made way more optimal (through the use of
-        # consistent hashing) and possibly pluggable.
         result = []
         try:
             agents.index(self.agent)
         except ValueError:
             # This agent is down
             return result
-        # TODO(ivar): In future, for better resource usage, each agent
-        # could have a weight value in the DB definition
-        ring = hashring.ConsistentHashRing(dict([(x.id, None)
-                                                 for x in agents]))
+        self._update_ring(agents)
         # retrieve tenants
-        for tenant in self.tree_manager.get_roots(aim_ctx):
-            allocations = ring.assign_key(tenant)
+        tenants = self.tree_manager.get_roots(aim_ctx)
+        if len(agents) > 1 and self.balance_factor > 0:
+            allocations = self.ring.assign_weighted_keys(
+                self._get_tenant_weights(aim_ctx, tenants),
+                balance_factor=max(1, self.balance_factor))
+            mine = set(allocations.get(self.agent_id, []))
+            return [x for x in tenants if x in mine]
+        for tenant in tenants:
+            allocations = self.ring.assign_key(tenant)
             if self.agent_id in allocations:
                 result.append(tenant)
         return result
 
+    def _update_ring(self, agents):
+        # The ring is only changed when agents join, leave, or change their
+        # capacity, so that the same tenants keep hashing to the same agents
+        # across cycles.
+        nodes = dict((x.id, self._get_agent_capacity(x)) for x in agents)
+        current = self.ring.nodes
+        removed = set(current) - set(nodes)
+        if removed:
+            self.ring.remove_nodes(removed)
+        changed = dict((k, v) for k, v in nodes.items()
+                       if k not in current or current[k] != v)
+        if changed:
+            LOG.info("Updating hash ring with agents: %s" % changed)
+            self.ring.add_nodes(changed)
+
+    def _get_agent_capacity(self, agent):
+        try:
+            return max(1, self.conf_manager.get_option(
+                'agent_capacity', group='aim', host=agent.host) or 1)
+        except exc.ConfigurationUndefined:
+            return 1
+
+    def _get_tenant_weights(self, aim_ctx, tenants):
+        # Tenants are weighted by the stored size of their config tree, so
+        # that all the agents read their weights from the same source and
+        # agree on the assignment.
+        sizes = self.tree_manager.get_sizes(aim_ctx)
+        return dict((x, self._quantize_weight(sizes.get(x) or 0))
+                    for x in tenants)
+
+    def _quantize_weight(self, size):
+        # Round the size up to its 3 most significant bits, so that small
+        # changes in a tenant's size don't cause it to be moved around.
+        size = max(1, size)
+        shift = max(0, size.bit_length() - 3)
+        return (((size - 1) >> shift) + 1) << shift
+
     def _major_vercompare(self, x, y):
         return (semantic_version.Version(x).major -
                 semantic_version.Version(y).major)
@@ -306,10 +384,19 @@ class AID(object):
         # TODO(ivar): interrupt current sleep and restart with new value
         self.squash_time = new_conf['value']
 
+    def _change_full_sweep_interval(self, new_conf):
+        self.full_sweep_interval = new_conf['value']
+
+    def _change_max_squash_time(self, new_conf):
+        self.max_squash_time = new_conf['value']
+
     def _change_deadlock_time(self, new_conf):
         # REVISIT: interrupt current sleep and restart with new value
         self.deadlock_time = new_conf['value']
 
+    def _change_balance_factor(self, new_conf):
+        self.balance_factor = new_conf['value']
+
 
 def main():
     aim_cfg.init(sys.argv[1:])
@@ -17,10 +17,12 @@ import collections
 import random
 import time
 import traceback
+import zlib
 
 from acitoolkit import acitoolkit
 from apicapi import apic_client
 from oslo_log import log as logging
+from requests import adapters
 
 from aim.agent.aid.universes.aci import converter
 from aim.agent.aid.universes.aci import tenant as aci_tenant
@@ -74,8 +76,9 @@ class WebSocketContext(object):
     """Placeholder for websocket session"""
     EMPTY_URLS = ["empty/url"]
 
-    def __init__(self, apic_config, aim_manager):
+    def __init__(self, apic_config, aim_manager, shard=0):
         self.apic_config = apic_config
+        self.shard = shard
         self.session = None
         self.ws_urls = collections.deque()
         self.is_session_reconnected = False
@@ -185,7 +188,8 @@ class WebSocketContext(object):
             if purpose == BACKUP_PURPOSE or obj:
                 if self.session and self.session.session:
                     self.session.close()
-                    self.is_session_reconnected = True
+                    with utils.get_rlock(self._reconnected_lock_name):
+                        self.is_session_reconnected = True
                 self.session = valid_session
                 self._spawn_monitors()
                 if purpose == BACKUP_PURPOSE:
@@ -199,7 +203,10 @@ class WebSocketContext(object):
 
     def establish_ws_session(self, max_retries=None, recovery_mode=False):
         try:
-            with utils.get_rlock(lcon.ACI_WS_CONNECTION_LOCK, blocking=False):
+            lock_name = lcon.ACI_WS_CONNECTION_LOCK
+            if self.shard:
+                lock_name += '-%s' % self.shard
+            with utils.get_rlock(lock_name, blocking=False):
                 if not recovery_mode:
                     purpose = NORMAL_PURPOSE
                     self._reload_websocket_config()
@@ -329,6 +336,25 @@ class WebSocketContext(object):
             return False
         return any(self.session.has_events(url) for url in urls)
 
+    @property
+    def _reconnected_lock_name(self):
+        return '%s-%s' % (lcon.ACI_WS_RECONNECTED_LOCK, self.shard)
+
+    def get_shard(self, urls):
+        return self
+
+    def pop_reconnected(self):
+        """Clear the reconnection flag
+
+        Returns the list of contexts whose session was reconnected since
+        the last call.
+        """
+        with utils.get_rlock(self._reconnected_lock_name):
+            if not self.is_session_reconnected:
+                return []
+            self.is_session_reconnected = False
+            return [self]
+
     def _thread_monitor(self, flag):
         login_thread_name = 'login_thread'
         subscription_thread_name = 'subscription_thread'
@@ -406,12 +432,74 @@ class WebSocketContext(object):
             utils.perform_harakiri(LOG, msg)
 
 
+class ShardedWebSocketContext(object):
+    """Websocket subscriptions spread over multiple sessions
+
+    Each set of subscription URLs is consistently assigned to one of the
+    underlying WebSocketContexts, which log in, refresh their
+    subscriptions and reconnect independently from each other.
+    """
+    EMPTY_URLS = WebSocketContext.EMPTY_URLS
+
+    def __init__(self, apic_config, aim_manager, sessions):
+        self.shards = [WebSocketContext(apic_config, aim_manager, shard=x)
+                       for x in range(sessions)]
+
+    def get_shard(self, urls):
+        index = (zlib.crc32(urls[0]) & 0xffffffff) % len(self.shards)
+        return self.shards[index]
+
+    @property
+    def is_session_reconnected(self):
+        return any(x.is_session_reconnected for x in self.shards)
+
+    def pop_reconnected(self):
+        # Only the flags that are found set are cleared, so that a shard
+        # reconnecting meanwhile is handled on the next call
+        result = []
+        for shard in self.shards:
+            result.extend(shard.pop_reconnected())
+        return result
+
+    def establish_ws_session(self, max_retries=None, recovery_mode=False):
+        for shard in self.shards:
+            shard.establish_ws_session(max_retries=max_retries,
+                                       recovery_mode=recovery_mode)
+
+    def subscribe(self, urls):
+        if urls == self.EMPTY_URLS:
+            raise WebSocketSubscriptionFailed(urls=urls,
+                                              code=400,
+                                              text="Empty URLS")
+        return self.get_shard(urls).subscribe(urls)
+
+    def unsubscribe(self, urls):
+        if urls == self.EMPTY_URLS:
+            return
+        return self.get_shard(urls).unsubscribe(urls)
+
+    def get_event_data(self, urls):
+        if urls == self.EMPTY_URLS:
+            return []
+        return self.get_shard(urls).get_event_data(urls)
+
+    def has_event(self, urls):
+        if urls == self.EMPTY_URLS:
+            return False
+        return self.get_shard(urls).has_event(urls)
+
+
 # REVIST: see if there is a way that we don't have to pass aim_manager in
 # to get the WebSocketContext object initialized.
 def get_websocket_context(apic_config, aim_manager):
     global ws_context
     if not ws_context:
-        ws_context = WebSocketContext(apic_config, aim_manager)
+        sessions = apic_config.get_option('websocket_sessions', 'aim')
+        if sessions > 1:
+            ws_context = ShardedWebSocketContext(apic_config, aim_manager,
+                                                 sessions)
+        else:
+            ws_context = WebSocketContext(apic_config, aim_manager)
     return ws_context
 
 
@@ -425,15 +513,23 @@ class AciUniverse(base.HashTreeStoredUniverse):
     def initialize(self, conf_mgr, multiverse):
         super(AciUniverse, self).initialize(conf_mgr, multiverse)
         self._aim_converter = converter.AciToAimModelConverter()
+        self._observed_state = {}
         self.aci_session = self.establish_aci_session(self.conf_manager)
         # Initialize children MOS here so that it globally fails if there's
         # any bug or network partition.
+        if (aci_tenant.CHILDREN_MOS_UNI is None or
+                aci_tenant.CHILDREN_MOS_TOPOLOGY is None):
+            aci_tenant.load_children_mos(self.aci_session, self.conf_manager)
         aci_tenant.get_children_mos(self.aci_session, 'tn-common')
         aci_tenant.get_children_mos(self.aci_session, 'pod-1')
         self.ws_context = get_websocket_context(self.conf_manager,
                                                 self.manager)
         self.aim_system_id = self.conf_manager.get_option('aim_system_id',
                                                           'aim')
+        self.worker_pool = None
+        if self.conf_manager.get_option('aci_tenant_execution_model',
+                                        'aim') == 'pool':
+            self.worker_pool = aci_tenant.get_worker_pool(self.conf_manager)
         return self
 
     def get_state_by_type(self, type):
@@ -460,12 +556,24 @@ class AciUniverse(base.HashTreeStoredUniverse):
         global serving_tenants
         return serving_tenants
 
+    def is_read_only(self, root):
+        # Tenants warmed up from a snapshot are read only until verified
+        global serving_tenants
+        manager = serving_tenants.get(root)
+        return bool(manager and manager.is_warm_pending())
+
     def serve(self, context, tenants):
         # Verify differences
         global serving_tenants
-        if self.ws_context.is_session_reconnected is True:
-            self.reset(context, serving_tenants)
-            self.ws_context.is_session_reconnected = False
+        reconnected_shards = self.ws_context.pop_reconnected()
+        if reconnected_shards:
+            # Only the tenants subscribed through the reconnected sessions
+            # need to be reset
+            reconnected = [
+                x for x, manager in serving_tenants.items()
+                if self.ws_context.get_shard(
+                    manager.tenant.urls) in reconnected_shards]
+            self.reset(context, reconnected)
             return
         try:
             serving_tenant_copy = serving_tenants
@@ -476,6 +584,7 @@ class AciUniverse(base.HashTreeStoredUniverse):
                 # caller will not asynchronously use the 'observe' method so we
                 # are gonna be fine. Make it Thread safe if required
                 self._state.pop(removed, None)
+                self._observed_state.pop(removed, None)
                 try:
                     serving_tenant_copy[removed].kill()
                 except Exception as e:
@@ -511,7 +620,7 @@ class AciUniverse(base.HashTreeStoredUniverse):
                         added, self.conf_manager, self.aci_session,
                         self.ws_context, self.creation_succeeded,
                         self.tenant_creation_failed, self.aim_system_id,
-                        self.get_resources)
+                        self.get_resources, worker_pool=self.worker_pool)
                     # A subscription might be leaking here
                     serving_tenants[added]._unsubscribe_tenant()
                     serving_tenants[added].start()
@@ -529,7 +638,7 @@ class AciUniverse(base.HashTreeStoredUniverse):
         context = aim_ctx.AimContext(store=store)
         self.creation_failed(context, aim_object, reason=reason, error=error)
 
-    def observe(self, context):
+    def observe(self, context, roots=None):
         # Copy state accumulated so far
         global serving_tenants
         new_state = {}
@@ -537,17 +646,27 @@ class AciUniverse(base.HashTreeStoredUniverse):
             # Only copy state if the tenant is warm
             with utils.get_rlock(lcon.ACI_TREE_LOCK_NAME_PREFIX + tenant):
                 if serving_tenants[tenant].is_warm():
-                    new_state[tenant] = self._get_state_copy(tenant)
-        self._state = new_state
+                    # The copy of unchanged roots is still current
+                    if (roots is None or tenant in roots or
+                            tenant not in self._observed_state):
+                        new_state[tenant] = self._get_state_copy(tenant)
+                    else:
+                        new_state[tenant] = self._observed_state[tenant]
+        # Reconciliation can replace the trees in the state
+        self._observed_state = new_state
+        self._state = dict(new_state)
 
     def reset(self, context, tenants):
         # Reset can only be called during reconciliation. serving_tenants
         # can't be modified meanwhile
         global serving_tenants
         LOG.warn('Reset called for roots %s' % tenants)
+        scheduler = aci_tenant.get_reset_scheduler(self.conf_manager)
         for root in tenants:
             if root in serving_tenants:
                 try:
+                    # Counts against the periodic resets
+                    scheduler.acquire(root, urgent=True)
                     serving_tenants[root].kill()
                 except Exception:
                     LOG.error(traceback.format_exc())
@@ -700,7 +819,7 @@ class AciUniverse(base.HashTreeStoredUniverse):
 
     @staticmethod
     def establish_aci_session(apic_config):
-        return apic_client.RestClient(
+        session = apic_client.RestClient(
             logging, '',
             apic_config.get_option('apic_hosts', group='apic'),
             apic_config.get_option('apic_username', group='apic'),
@@ -719,6 +838,13 @@ class AciUniverse(base.HashTreeStoredUniverse):
                 'signature_verification_algorithm', group='apic'),
             sign_hash=apic_config.get_option(
                 'signature_hash_type', group='apic'))
+        # Keep alive enough connections for concurrent pushes
+        adapter = adapters.HTTPAdapter(
+            pool_maxsize=apic_config.get_option('apic_push_concurrency',
+                                                'aim'))
+        session.session.mount('http://', adapter)
+        session.session.mount('https://', adapter)
+        return session
 
     def update_status_objects(self, context, my_state, raw_diff, skip_keys):
         pass
@@ -1217,6 +1217,25 @@ for item in reverse_resource_map[resource.L3OutInterfaceBgpPeerP]:
         item['resource'] = 'bgpAsP__Peer'
 
 
+def _compile_conversion_plan(helpers):
+    return [(helper, helper.get('converter'),
+             helper.get('convert_pre_existing', False),
+             helper.get('convert_monitored', True)) for helper in helpers]
+
+
+def _get_conversion_plan(mapping, otype):
+    """Return the conversion steps of a type, compiled on first use.
+
+    Each step is a tuple of (helper, converter, convert_pre_existing,
+    convert_monitored), the converter being None when the default one
+    applies. Returns None for unmanaged types.
+    """
+    helpers = mapping.get(otype)
+    if helpers is None:
+        return None
+    return utils.get_cached_plan(helpers, 'steps', _compile_conversion_plan)
+
+
 class BaseConverter(object):
 
     def __init__(self):
@@ -1248,40 +1267,39 @@ class AciToAimModelConverter(BaseConverter):
         :return: list of AIM resources
         """
         result = []
+        default_converter = self._default_converter
         for object in aci_objects:
             try:
-                if list(object.keys())[0] not in resource_map:
+                aci_type = next(iter(object))
+                plan = _get_conversion_plan(resource_map, aci_type)
+                if plan is None:
                     # Ignore unmanaged object
                     continue
-                resource = object[list(object.keys())[0]]['attributes']
+                resource = object[aci_type]['attributes']
                 # Change nameAlias to allow automatic conversion
                 if 'nameAlias' in resource:
-                    resource['displayName'] = resource['nameAlias']
-                    del resource['nameAlias']
-                for helper in resource_map[list(object.keys())[0]]:
+                    resource = dict(resource)
+                    resource['displayName'] = resource.pop('nameAlias')
+                deleted = resource.get('status') == DELETED_STATUS
+                for helper, conv, _, _ in plan:
                     # Use the custom converter, fallback to the default one
-                    converted = (
-                        helper.get('converter') or self._default_converter)(
-                        resource, list(object.keys())[0], helper,
+                    converted = (conv or default_converter)(
+                        resource, aci_type, helper,
                         ['dn'], helper['resource'].identity_attributes,
                         to_aim=True)
-                    if resource.get('status') == DELETED_STATUS:
+                    if deleted:
                         for x in converted:
                             # Set deleted status for updating the tree
                             # correctly
                             x.__dict__['_status'] = 'deleted'
                     result.extend(converted)
-                # Change displayName back to original
-                if 'displayName' in resource:
-                    resource['nameAlias'] = resource['displayName']
-                    del resource['displayName']
             except Exception as e:
                 LOG.warn("Could not convert object"
                          "%s with error %s" % (object, str(e)))
                 LOG.debug(traceback.format_exc())
         squashed = self._squash(result)
         if aci_objects:
-            LOG.debug("Converted: %s into: %s" % (aci_objects, squashed))
+            LOG.debug("Converted: %s into: %s", aci_objects, squashed)
         return squashed
 
     def _squash(self, converted_list):
@@ -1296,9 +1314,10 @@ class AciToAimModelConverter(BaseConverter):
         for res in converted_list:
             # Base for squashing is the Resource with all its defaults
             klass = type(res)
+            identity = res.identity
             current = res_map.setdefault(
-                (res._aci_mo_name,) + tuple(res.identity),
-                klass(**dict([(y, res.identity[x]) for x, y in
+                (res._aci_mo_name,) + tuple(identity),
+                klass(**dict([(y, identity[x]) for x, y in
                               enumerate(klass.identity_attributes)])))
             for k, v in res.__dict__.items():
                 if isinstance(v, list):
@@ -1327,28 +1346,30 @@ class AimToAciModelConverter(BaseConverter):
         :return: list of AIM resources
         """
         result = []
+        default_converter = self._default_converter
         in_objects = copy.copy(aim_objects)
         for object in in_objects:
             try:
                 klass = type(object)
-                if klass not in reverse_resource_map:
+                plan = _get_conversion_plan(reverse_resource_map, klass)
+                if plan is None:
                     # Ignore unmanaged object
                     continue
                 is_pre = getattr(object, 'pre_existing', False)
                 is_mon = getattr(object, 'monitored', False)
-                if 'display_name' in object.__dict__:
-                    object.__dict__['name_alias'] = object.display_name
-                    del object.__dict__['display_name']
-                for helper in reverse_resource_map[klass]:
-                    if is_pre and not helper.get('convert_pre_existing',
-                                                 False):
+                object_dict = object.__dict__
+                if 'display_name' in object_dict:
+                    object_dict = dict(object_dict)
+                    object_dict['name_alias'] = object_dict.pop(
+                        'display_name')
+                for helper, conv, convert_pre, convert_mon in plan:
+                    if is_pre and not convert_pre:
                         continue
-                    if is_mon and not helper.get('convert_monitored', True):
+                    if is_mon and not convert_mon:
                         continue
                     # Use the custom converter, fallback to the default one
-                    converted = (
-                        helper.get('converter') or self._default_converter)(
-                        object.__dict__, klass, helper,
+                    converted = (conv or default_converter)(
+                        object_dict, klass, helper,
                         klass.identity_attributes,
                         ['dn'], to_aim=False)
                     for c in converted:
@@ -1358,10 +1379,6 @@ class AimToAciModelConverter(BaseConverter):
                             in_objects.append(c)
                         else:
                             result.append(c)
-                # Set name alias back to original
-                if 'name_alias' in object.__dict__:
-                    object.__dict__['display_name'] = object.name_alias
-                    del object.__dict__['name_alias']
             except Exception as e:
                 LOG.warn("Could not convert object"
                          "%s with error %s" % (object.__dict__, str(e)))
@@ -1369,7 +1386,7 @@ class AimToAciModelConverter(BaseConverter):
 
         squashed = self._squash(result)
         if aim_objects:
-            LOG.debug("Converted: %s into: %s" % (aim_objects, squashed))
+            LOG.debug("Converted: %s into: %s", aim_objects, squashed)
         return squashed
 
     def _squash(self, converted_list):
@@ -1381,6 +1398,6 @@ class AimToAciModelConverter(BaseConverter):
         res_map = collections.OrderedDict()
         for res in converted_list:
             current = res_map.setdefault(
-                res[list(res.keys())[0]]['attributes']['dn'], res)
+                res[next(iter(res))]['attributes']['dn'], res)
             current.update(res)
         return list(res_map.values())
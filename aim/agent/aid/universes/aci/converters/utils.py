@@ -21,6 +21,14 @@ from apicapi import apic_client
 
 LOG = logging.getLogger(__name__)
 IGNORE = object()
+# Cap on the number of cached conversion plans, only reached if helpers are
+# built on the fly rather than taken from the resource maps.
+MAX_CONVERSION_PLANS = 4096
+
+_attribute_names = {}
+_conversion_plans = {}
+_resource_attributes = {}
+_mo_classes = {}
 
 
 def boolean(resource, attribute, to_aim=True):
@@ -51,6 +59,10 @@ def convert_attribute(aim_attribute, to_aim=True):
     :param aim_attribute:
     :return:
     """
+    try:
+        return _attribute_names[(aim_attribute, to_aim)]
+    except KeyError:
+        pass
     if to_aim:
         # Camel to _ (APIC to AIM)
         result = []
@@ -58,14 +70,15 @@ def convert_attribute(aim_attribute, to_aim=True):
             if x.isupper():
                 result.append('_')
             result.append(x.lower())
-        return ''.join(result)
+        result = ''.join(result)
     else:
         # _ to Camel (AIM to APIC)
         parts = aim_attribute.split('_')
         result = parts[0]
         for part in parts[1:]:
             result += part[0].upper() + part[1:]
-        return result
+    _attribute_names[(aim_attribute, to_aim)] = result
+    return result
 
 
 def mapped_attribute(value_map):
@@ -85,6 +98,40 @@ def default_attribute_converter(object_dict, attribute,
     return object_dict[attribute]
 
 
+def get_resource_attributes(klass):
+    """Return the set of attributes of an AIM resource class."""
+    try:
+        return _resource_attributes[klass]
+    except KeyError:
+        attributes = frozenset(klass.attributes())
+        _resource_attributes[klass] = attributes
+        return attributes
+
+
+def get_mo_class(mo_type):
+    """Return the ManagedObjectClass for an ACI type.
+
+    ManagedObjectClass reuses its instances but re-runs the initializer on
+    every instantiation, so keep our own lookup.
+    """
+    try:
+        return _mo_classes[mo_type]
+    except KeyError:
+        mo_class = apic_client.ManagedObjectClass(mo_type)
+        _mo_classes[mo_type] = mo_class
+        return mo_class
+
+
+def filter_rns(mos_and_rns):
+    """Same as DNManager.filter_rns, using the ManagedObjectClass lookup."""
+    rns = []
+    for mo_type, rn in mos_and_rns:
+        if (mo_type not in apic_client.ManagedObjectClass.supported_mos or
+                get_mo_class(mo_type).rn_param_count):
+            rns.extend(rn.split(','))
+    return rns
+
+
 def default_to_resource(converted, helper, to_aim=True):
     klass = helper['resource']
     default_skip = ['preExisting', 'monitored', 'Error', 'Pending',
@@ -92,10 +139,11 @@ def default_to_resource(converted, helper, to_aim=True):
     skip = helper.get('skip', [])
     if to_aim:
         # APIC to AIM
+        attributes = get_resource_attributes(klass)
         return klass(
             _set_default=False,
             **dict([(k, v) for k, v in converted.items() if k in
-                    klass.attributes() and k not in skip]))
+                    attributes and k not in skip]))
     else:
         for s in default_skip + skip:
             converted.pop(s, None)
@@ -154,14 +202,14 @@ def default_identity_converter(object_dict, otype, helper,
         aci_type = aci_mo_type or otype
         mos_and_rns = dn_mgr.aci_decompose_with_type(object_dict['dn'],
                                                      aci_type)
-        return dn_mgr.filter_rns(mos_and_rns)
+        return filter_rns(mos_and_rns)
     else:
         attr = [object_dict[x] for x in otype.identity_attributes]
         if extra_attributes:
             attr.extend(extra_attributes)
         mo_type = aci_mo_type or helper['resource']
         try:
-            return [apic_client.ManagedObjectClass(mo_type).dn(*attr)]
+            return [get_mo_class(mo_type).dn(*attr)]
         except Exception as e:
             LOG.error('Failed to make DN for %s with %s: %s',
                       mo_type, attr, e)
@@ -189,6 +237,76 @@ def do_attribute_conversion(input_dict, input_attr, mapping_info, to_aim=True):
     return others
 
 
+class ConversionPlan(object):
+    """Conversion steps of a mapping helper, compiled on first use.
+
+    Attribute names are translated once per attribute and the converters of
+    the helper are resolved upfront, so that converting an object is a
+    sequence of dictionary lookups.
+    """
+
+    def __init__(self, helper, to_aim=True):
+        self.helper = helper
+        self.to_aim = to_aim
+        self.mapping_info = helper.get('exceptions', {})
+        self.identity_converter = (helper.get('identity_converter') or
+                                   default_identity_converter)
+        self.to_resource = helper.get('to_resource') or default_to_resource
+        self._steps = {}
+
+    def _compile(self, attribute):
+        if attribute in self.mapping_info:
+            info = self.mapping_info[attribute]
+            other = info.get('other',
+                             convert_attribute(attribute, to_aim=self.to_aim))
+            step = (other,
+                    info.get('converter') or default_attribute_converter)
+        else:
+            step = (convert_attribute(attribute, to_aim=self.to_aim), None)
+        self._steps[attribute] = step
+        return step
+
+    def convert_attribute(self, input_dict, attribute):
+        """Same as do_attribute_conversion with this plan's mapping info."""
+        try:
+            other, conv = self._steps[attribute]
+        except KeyError:
+            other, conv = self._compile(attribute)
+        if conv is None:
+            converted = input_dict.get(attribute)
+        else:
+            converted = conv(input_dict, attribute, to_aim=self.to_aim)
+        if isinstance(converted, dict):
+            return converted
+        return {other: converted}
+
+
+def get_cached_plan(source, variant, build):
+    """Return the plan compiled by build(source), compiled on first use.
+
+    Plans are cached by the identity of their source, a mapping helper or
+    the list of helpers of a type, and by variant. Entries keep a reference
+    to their source, so that its id can't be reused while cached.
+    """
+    key = (id(source), variant)
+    try:
+        cached_source, plan = _conversion_plans[key]
+        if cached_source is source:
+            return plan
+    except KeyError:
+        pass
+    if len(_conversion_plans) >= MAX_CONVERSION_PLANS:
+        _conversion_plans.clear()
+    plan = build(source)
+    _conversion_plans[key] = (source, plan)
+    return plan
+
+
+def get_conversion_plan(helper, to_aim=True):
+    return get_cached_plan(
+        helper, to_aim, lambda x: ConversionPlan(x, to_aim=to_aim))
+
+
 def default_converter(object_dict, otype, helper,
                       source_identity_attributes,
                       destination_identity_attributes, to_aim=True):
@@ -205,25 +323,22 @@ def default_converter(object_dict, otype, helper,
                        ACI/AIM (True) or AIM/ACI (False)
         :return: list containing the resulting objects
         """
+        plan = get_conversion_plan(helper, to_aim=to_aim)
         # translate identity
         res_dict = {}
-        identity = (helper.get('identity_converter') or
-                    default_identity_converter)(object_dict, otype, helper,
-                                                to_aim=to_aim)
+        identity = plan.identity_converter(object_dict, otype, helper,
+                                           to_aim=to_aim)
         for index, part in enumerate(destination_identity_attributes):
             res_dict[part] = identity[index]
         for attribute in object_dict:
             if attribute in source_identity_attributes:
                 continue
-            others = do_attribute_conversion(object_dict, attribute,
-                                             helper.get('exceptions', {}),
-                                             to_aim=to_aim)
+            others = plan.convert_attribute(object_dict, attribute)
             for other_k, other_v in others.items():
                 # Identity was already converted
                 if other_k not in destination_identity_attributes:
                     res_dict[other_k] = other_v
-        result = (helper.get('to_resource') or default_to_resource)(
-            res_dict, helper, to_aim=to_aim)
+        result = plan.to_resource(res_dict, helper, to_aim=to_aim)
         return [result] if result else []
 
 
@@ -348,7 +463,7 @@ def dn_decomposer(aim_attr_list, aci_mo):
             if dn:
                 dnm = apic_client.DNManager()
                 mos_and_rns = dnm.aci_decompose_with_type(dn, aci_mo)
-                rns = dnm.filter_rns(mos_and_rns)
+                rns = filter_rns(mos_and_rns)
                 return dict(zip(aim_attr_list, rns))
             else:
                 return {}
@@ -356,7 +471,7 @@ def dn_decomposer(aim_attr_list, aci_mo):
             dn_attrs = [object_dict[a] for a in aim_attr_list
                         if object_dict.get(a)]
             if len(dn_attrs) == len(aim_attr_list):
-                dn = apic_client.ManagedObjectClass(aci_mo).dn(*dn_attrs)
+                dn = get_mo_class(aci_mo).dn(*dn_attrs)
             else:
                 dn = ''
             return dn
@@ -382,7 +497,7 @@ def tdn_rs_converter(aim_attr_list, aci_mo):
             if tdn:
                 dnm = apic_client.DNManager()
                 mos_and_rns = dnm.aci_decompose_with_type(tdn, aci_mo)
-                rns = dnm.filter_rns(mos_and_rns)
+                rns = filter_rns(mos_and_rns)
                 res_dict.update(dict(zip(aim_attr_list, rns)))
             to_res = helper.get('to_resource', default_to_resource)
             result.append(to_res(res_dict, helper, to_aim=True))
@@ -392,7 +507,7 @@ def tdn_rs_converter(aim_attr_list, aci_mo):
             dn_attrs = [object_dict[a] for a in aim_attr_list
                         if object_dict.get(a)]
             if len(dn_attrs) == len(aim_attr_list):
-                tdn = apic_client.ManagedObjectClass(aci_mo).dn(*dn_attrs)
+                tdn = get_mo_class(aci_mo).dn(*dn_attrs)
                 result.append(
                     {helper['resource']: {'attributes': {'dn': dn,
                                                          'tDn': tdn}}})
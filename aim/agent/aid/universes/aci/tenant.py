@@ -13,8 +13,14 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import copy
+import functools
+import json
+import os
+import random
 from six.moves import queue as Queue
+import threading
 import time
 import traceback
 
@@ -47,13 +53,186 @@ CHILDREN_MOS_UNI = None
 CHILDREN_MOS_TOPOLOGY = None
 SUPPORTS_ANNOTATIONS = None
 RESET_INTERVAL = 3600
+RESET_DEVIATION = 0.2
 DEFAULT_WS_TO = '900'
+# Trees stored in a tenant snapshot, in this order
+SNAPSHOT_TREES = ['config', 'operational', 'monitored']
+worker_pool = None
+push_semaphore = None
+reset_scheduler = None
 
 
 class ScheduledReset(Exception):
     pass
 
 
+# Candidate children classes of each root type, and the URL used to verify
+# their support on APIC
+CHILDREN_PROBES = {
+    'uni': (CHILDREN_LIST, '/mo/uni/tn-common.json?target-subtree-class=%s'),
+    'topology': (TOPOLOGY_CHILDREN_LIST, '/node/class/%s.json?'),
+}
+
+
+def probe_children_mos(apic_session, root_type, concurrency=1):
+    """Verify which candidate children classes APIC supports
+
+    :param apic_session: APIC session used for the probes
+    :param root_type: root type as in CHILDREN_PROBES
+    :param concurrency: number of probes running at the same time
+    :return: set of supported class names
+    """
+    candidates, url = CHILDREN_PROBES[root_type]
+
+    def probe(mo_name):
+        try:
+            apic_session.GET(url % mo_name)
+        except apic_exc.ApicResponseNotOk as e:
+            if int(e.err_status) == 400 and int(e.err_code) == 12:
+                return None
+            raise e
+        return mo_name
+
+    tasks = []
+    for mo in candidates:
+        if mo in apic_client.ManagedObjectClass.supported_mos:
+            mo_name = apic_client.ManagedObjectClass(mo).klass_name
+        else:
+            mo_name = mo
+        tasks.append(functools.partial(probe, mo_name))
+    return set(x for x in utils.run_in_parallel(tasks, concurrency) if x)
+
+
+def _set_children_mos(children_mos):
+    global CHILDREN_MOS_UNI
+    global CHILDREN_MOS_TOPOLOGY
+    CHILDREN_MOS_UNI = children_mos['uni']
+    CHILDREN_MOS_TOPOLOGY = children_mos['topology']
+
+
+def get_apic_version(apic_session):
+    """Return the software version of the APIC cluster, or None"""
+    try:
+        controllers = apic_session.GET(
+            '/node/class/firmwareCtrlrRunning.json')
+        versions = set(x['firmwareCtrlrRunning']['attributes']['version']
+                       for x in controllers)
+    except Exception as e:
+        LOG.debug("Failed to retrieve APIC version: %s" % str(e))
+        return None
+    return ','.join(sorted(versions)) or None
+
+
+def _load_children_mos_cache(path):
+    try:
+        with open(path) as cache:
+            content = json.load(cache)
+        return content['version'], dict(
+            (k, set(v)) for k, v in content['children_mos'].items())
+    except (IOError, ValueError, KeyError, AttributeError, TypeError):
+        return None, None
+
+
+def _save_children_mos_cache(path, version, children_mos):
+    try:
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as cache:
+            json.dump({'version': version,
+                       'children_mos': dict(
+                           (k, sorted(v)) for k, v in children_mos.items())},
+                      cache)
+        os.rename(tmp, path)
+    except (IOError, OSError) as e:
+        LOG.warn("Failed to store APIC classes in %s: %s" % (path, str(e)))
+
+
+def _probe_all_children_mos(apic_session, concurrency):
+    return dict((x, probe_children_mos(apic_session, x,
+                                       concurrency=concurrency))
+                for x in CHILDREN_PROBES)
+
+
+def load_children_mos(apic_session, apic_config):
+    """Initialize the supported children classes at startup
+
+    Classes are probed concurrently and stored in a local cache file along
+    with the APIC version. When the cache matches the running APIC version
+    no probe is needed. When it doesn't, the cached classes are used until
+    they are probed again in background.
+
+    :return: the background probing thread, if any
+    """
+    path = apic_config.get_option('apic_class_cache_file', 'aim')
+    concurrency = apic_config.get_option('apic_class_probe_concurrency',
+                                         'aim')
+    version = get_apic_version(apic_session) if path else None
+    if not version:
+        _set_children_mos(_probe_all_children_mos(apic_session, concurrency))
+        return None
+    cached_version, children_mos = _load_children_mos_cache(path)
+    if children_mos is None:
+        children_mos = _probe_all_children_mos(apic_session, concurrency)
+        _save_children_mos_cache(path, version, children_mos)
+        _set_children_mos(children_mos)
+        return None
+    _set_children_mos(children_mos)
+    if cached_version == version:
+        return None
+    LOG.info("APIC version changed from %s to %s, probing supported classes "
+             "in background" % (cached_version, version))
+
+    def reprobe():
+        try:
+            children_mos = _probe_all_children_mos(apic_session, concurrency)
+        except Exception as e:
+            LOG.error("Failed to probe APIC classes: %s" % str(e))
+            return
+        _save_children_mos_cache(path, version, children_mos)
+        _set_children_mos(children_mos)
+    return utils.spawn_thread(reprobe)
+
+
+def _load_tenant_snapshot(path, max_age):
+    try:
+        with open(path) as snapshot:
+            content = json.load(snapshot)
+        if time.time() - content['timestamp'] > max_age:
+            return None
+        trees = []
+        for name in SNAPSHOT_TREES:
+            tree = content['trees'][name]
+            trees.append(structured_tree.StructuredHashTree.from_string(
+                tree['tree'], root_key=tuple(tree['root_key'] or ()) or None,
+                has_populated=tree['has_populated']))
+        return content['timestamp'], content['subscribed_at'], trees
+    except (IOError, ValueError, KeyError, AttributeError, TypeError):
+        return None
+
+
+def _save_tenant_snapshot(path, timestamp, subscribed_at, trees):
+    content = {'timestamp': timestamp,
+               'subscribed_at': subscribed_at,
+               'trees': dict(
+                   (name, {'tree': str(tree),
+                           'root_key': tree.root_key,
+                           'has_populated': tree.has_populated})
+                   for name, tree in zip(SNAPSHOT_TREES, trees))}
+    try:
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as snapshot:
+            json.dump(content, snapshot)
+        os.rename(tmp, path)
+    except (IOError, OSError) as e:
+        LOG.warn("Failed to store tenant snapshot in %s: %s" %
+                 (path, str(e)))
+
+
 def get_children_mos(apic_session, root):
     root_type = 'uni'
     try:
@@ -64,37 +243,12 @@ def get_children_mos(apic_session, root):
     global CHILDREN_MOS_TOPOLOGY
     if root_type in ['uni']:
         if CHILDREN_MOS_UNI is None:
-            CHILDREN_MOS_UNI = set()
-            for mo in CHILDREN_LIST:
-                if mo in apic_client.ManagedObjectClass.supported_mos:
-                    mo_name = apic_client.ManagedObjectClass(mo).klass_name
-                else:
-                    mo_name = mo
-                try:
-                    # Verify class support
-                    apic_session.GET('/mo/uni/tn-common.json?'
-                                     'target-subtree-class=%s' % mo_name)
-                except apic_exc.ApicResponseNotOk as e:
-                    if int(e.err_status) == 400 and int(e.err_code) == 12:
-                        continue
-                    raise e
-                CHILDREN_MOS_UNI.add(mo_name)
+            CHILDREN_MOS_UNI = probe_children_mos(apic_session, 'uni')
         return CHILDREN_MOS_UNI
     elif root_type in ['topology']:
         if CHILDREN_MOS_TOPOLOGY is None:
-            CHILDREN_MOS_TOPOLOGY = set()
-            for mo in TOPOLOGY_CHILDREN_LIST:
-                if mo in apic_client.ManagedObjectClass.supported_mos:
-                    mo_name = apic_client.ManagedObjectClass(mo).klass_name
-                else:
-                    mo_name = mo
-                try:
-                    apic_session.GET('/node/class/%s.json?' % mo_name)
-                except apic_exc.ApicResponseNotOk as e:
-                    if int(e.err_status) == 400 and int(e.err_code) == 12:
-                        continue
-                    raise e
-                CHILDREN_MOS_TOPOLOGY.add(mo_name)
+            CHILDREN_MOS_TOPOLOGY = probe_children_mos(apic_session,
+                                                       'topology')
         return CHILDREN_MOS_TOPOLOGY
 
 
@@ -296,11 +450,299 @@ class OwnershipManager(object):
         self.owned_by_tag = set()
 
 
+def get_backlog_key(op, obj):
+    if op == base_universe.CREATE:
+        return op, obj.dn
+    # Delete items are in ACI format
+    return op, list(obj.values())[0]['attributes']['dn']
+
+
+class ObjectBacklog(Queue.Queue):
+    """Queue of push requests, indexed by operation and DN.
+
+    The index allows to squash a new object into the queued request
+    holding the same DN in constant time.
+    """
+
+    def _init(self, maxsize):
+        Queue.Queue._init(self, maxsize)
+        self.index = {}
+
+    def _put(self, request):
+        Queue.Queue._put(self, request)
+        for op, objects in request.items():
+            for i, obj in enumerate(objects):
+                self.index[get_backlog_key(op, obj)] = (request, i)
+
+    def _get(self):
+        request = Queue.Queue._get(self)
+        for op, objects in request.items():
+            for obj in objects:
+                key = get_backlog_key(op, obj)
+                if self.index.get(key, (None,))[0] is request:
+                    del self.index[key]
+        return request
+
+    def replace(self, key, obj):
+        """Replace the queued object identified by key, if any."""
+        with self.mutex:
+            if key not in self.index:
+                return False
+            request, i = self.index[key]
+            request[key[0]][i] = obj
+            return True
+
+
+def coalesce_events(pending, index, events):
+    """Merge flat ACI events into the pending ones, by DN.
+
+    Modifications are merged in order into the pending event of their DN,
+    and a complete object stays complete when modifications are merged
+    into it. A deletion drops the pending events of its DN and is appended
+    to the others. It also stops later events, of any DN, from being
+    merged into events received before it, so that nothing is moved ahead
+    of a deletion: a deletion followed by a re-creation of the same DN
+    results in both events, in order.
+
+    :param pending: list of pending events, updated in place. Dropped
+    events are replaced by None.
+    :param index: dictionary with the position in pending of the last event
+    each DN can be merged into, updated in place
+    :param events: list of flat ACI events
+    """
+    for event in events:
+        res_type = list(event.keys())[0]
+        attrs = event[res_type]['attributes']
+        dn = attrs.get('dn')
+        status = (attrs.get(STATUS_FIELD) or '').lower()
+        if status == converter.DELETED_STATUS:
+            if dn in index:
+                pending[index[dn]] = None
+            index.clear()
+            pending.append(event)
+            continue
+        position = index.get(dn)
+        current = pending[position] if position is not None else None
+        if current is None or list(current.keys())[0] != res_type:
+            if dn is not None:
+                index[dn] = len(pending)
+            pending.append(event)
+            continue
+        cur_attrs = current[res_type]['attributes']
+        cur_status = (cur_attrs.get(STATUS_FIELD) or '').lower()
+        merged = dict(cur_attrs)
+        merged.update(attrs)
+        if cur_status != converter.MODIFIED_STATUS:
+            # Keep the complete object, with or without status
+            if cur_status:
+                merged[STATUS_FIELD] = cur_attrs[STATUS_FIELD]
+            else:
+                merged.pop(STATUS_FIELD, None)
+        pending[position] = {res_type: {'attributes': merged}}
+
+
+class AciTenantWorkerPool(object):
+    """Serves tenant managers with a bounded set of worker threads.
+
+    Rather than having each AciTenantManager polling its own websocket
+    queue in a dedicated thread, a single dispatcher looks for the tenants
+    that have pending events, pushes or subscriptions, and hands them over
+    to the workers. A tenant is never served by more than one worker at a
+    time, so the per tenant ordering is preserved.
+    """
+
+    def __init__(self, workers, polling_yield):
+        self.workers = max(1, workers)
+        self.polling_yield = polling_yield
+        self.managers = {}
+        self.ready = Queue.Queue()
+        self.scheduled = set()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        if not self._threads:
+            self._threads.append(utils.spawn_thread(self._dispatch_loop))
+            for _ in range(self.workers):
+                self._threads.append(utils.spawn_thread(self._worker_loop))
+        return self
+
+    def register(self, manager):
+        with self._lock:
+            self.managers[manager.tenant_name] = manager
+        self.notify(manager)
+
+    def unregister(self, manager):
+        with self._lock:
+            if self.managers.get(manager.tenant_name) is manager:
+                del self.managers[manager.tenant_name]
+
+    def notify(self, manager):
+        """Schedule a tenant manager, unless it's already scheduled."""
+        with self._lock:
+            if (manager in self.scheduled or
+                    self.managers.get(manager.tenant_name) is not manager):
+                return
+            self.scheduled.add(manager)
+        self.ready.put(manager)
+
+    def dispatch(self):
+        with self._lock:
+            managers = [x for x in self.managers.values()
+                        if x not in self.scheduled]
+        for manager in managers:
+            if manager.needs_service():
+                self.notify(manager)
+
+    def serve_next(self, block=True):
+        manager = self.ready.get(block)
+        try:
+            manager.run_once()
+        finally:
+            with self._lock:
+                self.scheduled.discard(manager)
+
+    def _dispatch_loop(self):
+        while True:
+            start_time = time.time()
+            try:
+                self.dispatch()
+            except Exception as e:
+                LOG.error(traceback.format_exc())
+                LOG.error("An exception has occurred while dispatching "
+                          "tenant events: %s" % str(e))
+            time.sleep(max(0, self.polling_yield -
+                           (time.time() - start_time)))
+
+    def _worker_loop(self):
+        while True:
+            try:
+                self.serve_next()
+            except Exception as e:
+                LOG.error(traceback.format_exc())
+                LOG.error("An exception has occurred in tenant worker: "
+                          "%s" % str(e))
+
+
+class ResetScheduler(object):
+    """Process-wide scheduler of the periodic tenant resets
+
+    Periodic resets are spread evenly over slots of SLOT_SIZE seconds
+    within their allowed window. When a reset is due, it is performed only
+    if a token is available: the bucket is refilled at max_per_minute
+    tokens per minute, and at most max_concurrent tenants can be
+    resubscribing at the same time. Resets that don't get a token are
+    deferred. Urgent resets are always allowed, but still use a token.
+    """
+
+    SLOT_SIZE = 60
+    # Resets not released within this many seconds are forgotten
+    RESET_TIMEOUT = 600
+
+    def __init__(self, interval, deviation, max_concurrent, max_per_minute,
+                 clock=None):
+        self.interval = interval
+        self.deviation = deviation
+        self.max_concurrent = max(1, max_concurrent)
+        self.rate = max(1, max_per_minute) / 60.0
+        self.clock = clock or utils.get_time
+        self.tokens = float(self.max_concurrent)
+        self.last_refill = self.clock()
+        # Number of resets scheduled in each slot, and slot of each tenant
+        self.slots = {}
+        self.scheduled = {}
+        # Tenants resetting, with the time their reset started
+        self.in_progress = {}
+        self._lock = threading.Lock()
+
+    def schedule(self, tenant):
+        """Return the time of the next periodic reset of a tenant."""
+        with self._lock:
+            self._unschedule(tenant)
+            now = self.clock()
+            low = now + self.interval * (1 - self.deviation)
+            high = now + self.interval * (1 + self.deviation)
+            slot = min(range(int(low // self.SLOT_SIZE),
+                             int(high // self.SLOT_SIZE) + 1),
+                       key=lambda x: self.slots.get(x, 0))
+            self.slots[slot] = self.slots.get(slot, 0) + 1
+            self.scheduled[tenant] = slot
+            return min(high, max(low, (slot + random.random()) *
+                                 self.SLOT_SIZE))
+
+    def acquire(self, tenant, urgent=False):
+        """Whether a tenant can be reset now."""
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(float(self.max_concurrent),
+                              self.tokens +
+                              (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            for resetting, start in list(self.in_progress.items()):
+                if now - start > self.RESET_TIMEOUT:
+                    del self.in_progress[resetting]
+            if not urgent and (self.tokens < 1 or len(self.in_progress) >=
+                               self.max_concurrent):
+                return False
+            # Urgent resets can leave the bucket in debt
+            self.tokens -= 1
+            self._unschedule(tenant)
+            if not urgent:
+                self.in_progress[tenant] = now
+            return True
+
+    def release(self, tenant):
+        """The reset of a tenant is over."""
+        with self._lock:
+            self.in_progress.pop(tenant, None)
+
+    def cancel(self, tenant):
+        """A tenant is not served anymore."""
+        with self._lock:
+            self.in_progress.pop(tenant, None)
+            self._unschedule(tenant)
+
+    def _unschedule(self, tenant):
+        slot = self.scheduled.pop(tenant, None)
+        if slot is not None:
+            self.slots[slot] -= 1
+            if not self.slots[slot]:
+                del self.slots[slot]
+
+
+def get_reset_scheduler(apic_config):
+    global reset_scheduler
+    if not reset_scheduler:
+        reset_scheduler = ResetScheduler(
+            RESET_INTERVAL, RESET_DEVIATION,
+            apic_config.get_option('aci_tenant_max_concurrent_resets', 'aim'),
+            apic_config.get_option('aci_tenant_max_resets_per_minute', 'aim'))
+    return reset_scheduler
+
+
+def get_push_semaphore(apic_config):
+    global push_semaphore
+    if not push_semaphore:
+        push_semaphore = threading.BoundedSemaphore(
+            max(1, apic_config.get_option('apic_push_concurrency', 'aim')))
+    return push_semaphore
+
+
+def get_worker_pool(apic_config):
+    global worker_pool
+    if not worker_pool:
+        worker_pool = AciTenantWorkerPool(
+            apic_config.get_option('aci_tenant_workers', 'aim'),
+            apic_config.get_option('aci_tenant_polling_yield', 'aim')).start()
+    return worker_pool
+
+
 class AciTenantManager(utils.AIMThread):
 
     def __init__(self, tenant_name, apic_config, apic_session, ws_context,
                  creation_succeeded=None, creation_failed=None,
-                 aim_system_id=None, get_resources=None, *args, **kwargs):
+                 aim_system_id=None, get_resources=None, worker_pool=None,
+                 *args, **kwargs):
         super(AciTenantManager, self).__init__(*args, **kwargs)
         LOG.info("Init manager for tenant %s" % tenant_name)
         self.get_resources = get_resources
@@ -320,6 +762,32 @@ class AciTenantManager(utils.AIMThread):
         self._monitored_state = structured_tree.StructuredHashTree()
         self.polling_yield = self.apic_config.get_option(
             'aci_tenant_polling_yield', 'aim')
+        self.push_batch_size = self.apic_config.get_option(
+            'apic_push_batch_size', 'aim')
+        self.push_batch_max_bytes = self.apic_config.get_option(
+            'apic_push_batch_max_bytes', 'aim')
+        self.push_concurrency = self.apic_config.get_option(
+            'aci_tenant_push_concurrency', 'aim')
+        self.event_coalesce_window = self.apic_config.get_option(
+            'aci_event_coalesce_window', 'aim')
+        self._reset_pending_events()
+        snapshot_dir = self.apic_config.get_option(
+            'aci_tenant_snapshot_dir', 'aim')
+        self.snapshot_path = (
+            os.path.join(snapshot_dir, '%s.json' % self.tenant_name) if
+            snapshot_dir else None)
+        self.snapshot_interval = self.apic_config.get_option(
+            'aci_tenant_snapshot_interval', 'aim')
+        self.snapshot_max_age = self.apic_config.get_option(
+            'aci_tenant_snapshot_max_age', 'aim')
+        self._snapshot_loaded = False
+        self._snapshot_dirty = False
+        self._snapshot_time = 0
+        self._subscribed_at = None
+        # Subscription running in the background while the snapshot is
+        # served, and its failure if any
+        self._subscription = None
+        self._subscription_error = None
         self.to_aim_converter = converter.AciToAimModelConverter()
         self.to_aci_converter = converter.AimToAciModelConverter()
         self._reset_object_backlog()
@@ -333,6 +801,9 @@ class AciTenantManager(utils.AIMThread):
         # Warm bit to avoid rushed synchronization before receiving the first
         # batch of APIC events
         self._warm = False
+        # Set while the trees come from a snapshot not yet verified by APIC:
+        # they can be observed, but not acted upon
+        self._warm_pending = False
         self.ws_context = ws_context
         self.recovery_retries = None
         self.max_retries = 5
@@ -341,26 +812,55 @@ class AciTenantManager(utils.AIMThread):
         self.num_loop_runs = float('inf')
         self.ownership_mgr = OwnershipManager(apic_session, apic_config,
                                               aim_system_id)
+        # When set, the manager is served by the pool instead of its own
+        # thread
+        self.worker_pool = worker_pool
+        self._subscribed = False
+        self._recovery_time = 0
+        self.reset_scheduler = get_reset_scheduler(apic_config)
+        self._reset_granted = False
         # Initialize tenant tree
 
     def _reset_object_backlog(self):
-        self.object_backlog = Queue.Queue()
+        self.object_backlog = ObjectBacklog()
+
+    def _reset_pending_events(self):
+        # Events received within the coalescing window
+        self.pending_events = []
+        self._pending_events_index = {}
+        self._pending_events_deadline = None
+
+    def start(self):
+        if self.worker_pool:
+            self.worker_pool.register(self)
+            return self
+        return super(AciTenantManager, self).start()
 
     def kill(self, *args, **kwargs):
+        self.reset_scheduler.cancel(self.tenant_name)
         try:
             self._unsubscribe_tenant(kill=True)
         except Exception as e:
             LOG.warn("Failed to unsubscribe tenant during kill "
                      "procedure: %s %s" % (self.tenant_name, str(e)))
         finally:
-            super(AciTenantManager, self).kill(*args, **kwargs)
+            if self.worker_pool:
+                self._stop = True
+                self.worker_pool.unregister(self)
+            else:
+                super(AciTenantManager, self).kill(*args, **kwargs)
 
     def is_dead(self):
         # Wrapping the greenlet property for easier testing
+        if self.worker_pool:
+            return self._stop
         return self.dead
 
     def is_warm(self):
-        return self._warm
+        return self._warm or self._warm_pending
+
+    def is_warm_pending(self):
+        return self._warm_pending
 
     def get_state_copy(self):
         return structured_tree.StructuredHashTree.from_string(
@@ -406,7 +906,7 @@ class AciTenantManager(utils.AIMThread):
             epsilon = 0.5
             while not self._stop and self.num_loop_runs > 0:
                 start = time.time()
-                if start > self.scheduled_reset:
+                if self._reset_due():
                     raise ScheduledReset()
                 self._event_loop()
                 curr_time = time.time() - start
@@ -437,8 +937,91 @@ class AciTenantManager(utils.AIMThread):
                           self.tenant_name)
                 self.kill()
 
-    def _event_loop(self):
+    def needs_service(self):
+        """Whether the worker pool should run this manager."""
+        if self._stop:
+            return False
+        if not self._subscribed:
+            return time.time() >= self._recovery_time
+        if self._reset_due():
+            return True
+        if (self._subscription is not None and
+                not self._subscription.is_alive()):
+            return True
+        if not self.object_backlog.empty():
+            return True
+        if (self.pending_events and
+                time.time() >= self._pending_events_deadline):
+            return True
+        try:
+            return self.ws_context.has_event(self.tenant.urls)
+        except Exception:
+            # Let run_once deal with the failure
+            return True
+
+    def run_once(self):
+        """Serve a single round of events for this tenant.
+
+        This is what _main_loop does on every iteration when the tenant is
+        served by a worker pool, with the difference that it never blocks.
+        """
+        if self._stop:
+            return
+        try:
+            try:
+                if not self._subscribed:
+                    self._subscribe_tenant()
+                elif self._reset_due():
+                    raise ScheduledReset()
+                else:
+                    self._handle_events()
+                self.recovery_retries = None
+            except ScheduledReset:
+                LOG.info("Scheduled tree reset for root %s" %
+                         self.tenant_name)
+                self._unsubscribe_tenant()
+            except Exception as e:
+                LOG.error("An exception has occurred while serving tenant "
+                          "%s, error: %s" % (self.tenant_name, str(e)))
+                LOG.error(traceback.format_exc())
+                self._unsubscribe_tenant()
+                # Back off without holding the worker
+                self.recovery_retries = (self.recovery_retries or
+                                         utils.Counter())
+                self._recovery_time = time.time() + utils.get_backoff_time(
+                    TENANT_FAILURE_MAX_WAIT, self.recovery_retries.get())
+                self.recovery_retries.increment()
+                if self.recovery_retries.get() >= self.max_retries:
+                    LOG.error("Exceeded max recovery retries for tenant %s. "
+                              "Destroying the manager." % self.tenant_name)
+                    self.kill()
+        except Exception as e:
+            LOG.error(traceback.format_exc())
+            LOG.error("Stopping manager for tenant %s: %s" %
+                      (self.tenant_name, str(e)))
+            self._stop = True
+            self.worker_pool.unregister(self)
+
+    def _reset_due(self):
+        # Periodic resets are deferred until the scheduler allows them
+        if not self._reset_granted and time.time() > self.scheduled_reset:
+            self._reset_granted = self.reset_scheduler.acquire(
+                self.tenant_name)
+        return self._reset_granted
+
+    def _event_loop(self, flush=False):
         start_time = time.time()
+        self._handle_events(flush=flush)
+        time.sleep(max(0, self.polling_yield - (time.time() - start_time)))
+
+    def _handle_events(self, flush=False):
+        full_state = False
+        if self._subscription is not None:
+            if not self._subscription_done():
+                # Keep serving the snapshot
+                return
+            # All the events of the full state are queued by now
+            full_state = flush = True
         # Push the backlog at right before the event loop, so that
         # all the events we generate here are likely caught in this
         # iteration.
@@ -447,6 +1030,30 @@ class AciTenantManager(utils.AIMThread):
             with utils.get_rlock(lcon.ACI_TREE_LOCK_NAME_PREFIX +
                                  self.tenant_name):
                 events = self.ws_context.get_event_data(self.tenant.urls)
+                # REVISIT(ivar): there's already a debug log in acitoolkit
+                # listing all the events received one by one. The following
+                # would be more compact, we need to choose which to keep.
+                # LOG.debug("received events for root %s: %s" %
+                #           (self.tenant_name, events))
+                # Make events list flat
+                self.flat_events(events)
+                if not self.pending_events:
+                    self._pending_events_deadline = (
+                        time.time() + self.event_coalesce_window)
+                if self.event_coalesce_window > 0:
+                    # Events for the same DN are squashed until the
+                    # coalescing window expires
+                    coalesce_events(self.pending_events,
+                                    self._pending_events_index, events)
+                else:
+                    self.pending_events.extend(events)
+        if (self.pending_events or full_state) and (
+                flush or time.time() >= self._pending_events_deadline):
+            events = [x for x in self.pending_events if x is not None]
+            self._reset_pending_events()
+            reset = False
+            with utils.get_rlock(lcon.ACI_TREE_LOCK_NAME_PREFIX +
+                                 self.tenant_name):
                 for event in events:
                     # REVISIT(ivar): remove vmmDomP once websocket ACI bug is
                     # fixed
@@ -463,6 +1070,9 @@ class AciTenantManager(utils.AIMThread):
                             LOG.debug('Faking vmmProvP %s' % self.tenant_name)
                             events.append({'vmmProvP': {
                                 'attributes': {'dn': self.tenant.dn}}})
+                        if full_state:
+                            # Verified against the snapshot trees below
+                            break
                         # This is a full resync, trees need to be reset
                         self._state = structured_tree.StructuredHashTree()
                         self._operational_state = (
@@ -470,20 +1080,104 @@ class AciTenantManager(utils.AIMThread):
                         self._monitored_state = (
                             structured_tree.StructuredHashTree())
                         self.tag_set = set()
+                        reset = True
                         break
-                # REVISIT(ivar): there's already a debug log in acitoolkit
-                # listing all the events received one by one. The following
-                # would be more compact, we need to choose which to keep.
-                # LOG.debug("received events for root %s: %s" %
-                #           (self.tenant_name, events))
-                # Make events list flat
-                self.flat_events(events)
                 # Pull incomplete objects
                 events = self._fill_events(events)
                 # Manage Tags
                 events = self.ownership_mgr.filter_ownership(events)
-                self._event_to_tree(events)
-        time.sleep(max(0, self.polling_yield - (time.time() - start_time)))
+                if full_state:
+                    self._verify_snapshot(events)
+                elif self._event_to_tree(events) or reset:
+                    self._snapshot_dirty = True
+        self._save_snapshot()
+
+    def _subscription_done(self):
+        if self._subscription.is_alive():
+            return False
+        self._subscription = None
+        if self._subscription_error:
+            error, self._subscription_error = self._subscription_error, None
+            raise error
+        return True
+
+    def _load_snapshot(self):
+        """Warm the trees up from the local snapshot, if any
+
+        The tenant is warm pending right away, so that its state can be
+        diffed while the full state is retrieved from APIC in the
+        background, but nothing is pushed or deleted based on it. The
+        tenant is promoted to warm once the full state verifies the
+        snapshot.
+        """
+        self._snapshot_loaded = True
+        if not self.snapshot_path:
+            return
+        snapshot = _load_tenant_snapshot(self.snapshot_path,
+                                         self.snapshot_max_age)
+        if not snapshot:
+            return
+        timestamp, subscribed_at, trees = snapshot
+        # Only trees stored after the full state of a subscription was
+        # received are complete
+        if subscribed_at is None or subscribed_at > timestamp:
+            LOG.info("Ignoring incomplete snapshot of tenant %s" %
+                     self.tenant_name)
+            return
+        with utils.get_rlock(lcon.ACI_TREE_LOCK_NAME_PREFIX +
+                             self.tenant_name):
+            (self._state, self._operational_state,
+             self._monitored_state) = trees
+            self._warm_pending = True
+        self._snapshot_time = timestamp
+        LOG.info("Loaded snapshot of tenant %s taken %s seconds ago" %
+                 (self.tenant_name, int(time.time() - timestamp)))
+
+    def _verify_snapshot(self, events):
+        """Verify the snapshot trees against the full state of APIC
+
+        The full state is built aside, and only replaces the snapshot trees
+        when their hashes differ, so that an up to date snapshot is neither
+        reset nor reconciled again.
+        """
+        trees = [structured_tree.StructuredHashTree() for x in SNAPSHOT_TREES]
+        self._build_trees(events, *trees)
+        current = [self._state, self._operational_state,
+                   self._monitored_state]
+        if [x.root_full_hash for x in trees] == [
+                x.root_full_hash for x in current]:
+            LOG.info("Snapshot of tenant %s is up to date" % self.tenant_name)
+        else:
+            LOG.info("Snapshot of tenant %s is outdated, trees refreshed "
+                     "from APIC" % self.tenant_name)
+            (self._state, self._operational_state,
+             self._monitored_state) = trees
+            self._snapshot_dirty = True
+            event_handler.EventHandler.reconcile(roots=[self.tenant_name])
+        self._warm_pending = False
+        self._warm = True
+        self.reset_scheduler.release(self.tenant_name)
+
+    def _save_snapshot(self, force=False):
+        if not self.snapshot_path or self._warm_pending:
+            # Don't refresh a snapshot that hasn't been verified yet
+            return
+        now = time.time()
+        if not force:
+            if now < self._snapshot_time + self.snapshot_interval:
+                return
+            # Unchanged trees are only stored again before the snapshot
+            # expires
+            if (not self._snapshot_dirty and
+                    now < self._snapshot_time + self.snapshot_max_age / 2):
+                return
+        # The trees are only modified by this manager's own loop, so there's
+        # no need to hold the tree lock while serializing them
+        trees = [self._state, self._operational_state, self._monitored_state]
+        _save_tenant_snapshot(self.snapshot_path, now, self._subscribed_at,
+                              trees)
+        self._snapshot_dirty = False
+        self._snapshot_time = now
 
     def push_aim_resources(self, resources):
         """Given a map of AIM resources for this tenant, push them into APIC
@@ -500,39 +1194,25 @@ class AciTenantManager(utils.AIMThread):
         try:
             with utils.get_rlock(lcon.ACI_BACKLOG_LOCK_NAME_PREFIX +
                                  self.tenant_name, blocking=False):
-                backlock = Queue.Queue()
-                while not self.object_backlog.empty():
-                    requests = self.object_backlog.get()
-                    # check if there's an event to squash
-                    for op in ['create', 'delete']:
-                        for i, req in enumerate(requests.get(op, [])):
-                            for j, new in enumerate(resources.get(op, [])):
-                                if op is 'create':
-                                    req_dn = req.dn
-                                    new_dn = new.dn
-                                else:
-                                    # Delete items are in ACI format
-                                    req_dn = list(req.values())[0][
-                                        'attributes']['dn']
-                                    new_dn = list(new.values())[0][
-                                        'attributes']['dn']
-                                if req_dn == new_dn:
-                                    # Replace old with new
-                                    requests[op][i] = new
-                                    break
-                            else:
-                                # No colliding item found
-                                continue
-                            # new can be removed from resources
-                            resources[op].pop(j)
-                    backlock.put(requests)
-                if any(resources.values()):
-                    backlock.put(resources)
-                self.object_backlog = backlock
+                request = {}
+                for op, objects in resources.items():
+                    # Squash into the queued requests first, last writer
+                    # wins also within this request
+                    new = collections.OrderedDict()
+                    for obj in objects:
+                        key = get_backlog_key(op, obj)
+                        if not self.object_backlog.replace(key, obj):
+                            new[key] = obj
+                    request[op] = list(new.values())
+                if any(request.values()):
+                    self.object_backlog.put(request)
         except utils.LockNotAcquired:
             # If changes need to be pushed, AID will do it on the next
             # iteration
             pass
+        else:
+            if self.worker_pool:
+                self.worker_pool.notify(self)
 
     def _post_with_transaction(self, to_push, modified=False):
         if not to_push:
@@ -552,101 +1232,315 @@ class AciTenantManager(utils.AIMThread):
                                                      **attr)
 
     def _push_aim_resources(self):
-        dn_mgr = apic_client.DNManager()
-        decompose = dn_mgr.aci_decompose_dn_guess
         with utils.get_rlock(lcon.ACI_BACKLOG_LOCK_NAME_PREFIX +
                              self.tenant_name):
             while not self.object_backlog.empty():
                 request = self.object_backlog.get()
                 for method, aim_objects in request.items():
                     # Method will be either "create" or "delete"
-                    # sort the aim_objects based on DN first for DELETE method
-                    sorted_aim_objs = aim_objects
                     if method == base_universe.DELETE:
-                        sorted_aim_objs = sorted(
-                            aim_objects,
-                            key=lambda x: list(
-                                x.values())[0]['attributes']['dn'])
-                    potential_parent_dn = ' '
-                    for aim_object in sorted_aim_objs:
-                        # get MO from ACI client, identify it via its DN parts
-                        # and push the new body
-                        if method == base_universe.DELETE:
-                            # If a parent is also being deleted then we don't
-                            # have to send those children requests to APIC
-                            dn = list(aim_object.values())[
-                                0]['attributes']['dn']
-                            res_type = list(aim_object.keys())[0]
-                            decomposed = decompose(dn, res_type)
-                            parent_dn = dn_mgr.build(decomposed[1][:-1])
-                            if parent_dn.startswith(potential_parent_dn):
-                                continue
-                            else:
-                                potential_parent_dn = dn
-                            to_push = [copy.deepcopy(aim_object)]
-                        else:
-                            if getattr(aim_object, 'monitored', False):
-                                # When pushing to APIC, treat monitored
-                                # objects as pre-existing
-                                aim_object.monitored = False
-                                aim_object.pre_existing = True
-                            to_push = self.to_aci_converter.convert(
-                                [aim_object])
-                        LOG.debug('%s AIM object %s in APIC' % (
-                                  method, repr(aim_object)))
-                        try:
-                            if method == base_universe.CREATE:
-                                # Set ownership before pushing the request
-                                to_push = self.ownership_mgr.set_ownership_key(
-                                    to_push)
-                                LOG.debug("POSTING into APIC: %s" % to_push)
-                                self._post_with_transaction(to_push)
-                                self.creation_succeeded(aim_object)
-                            else:
-                                to_delete, to_update = (
-                                    self.ownership_mgr.set_ownership_change(
-                                        to_push))
-                                LOG.debug("DELETING from APIC: %s" % to_delete)
-                                for obj in to_delete:
-                                    attr = list(obj.values())[0]['attributes']
-                                    self.aci_session.DELETE(
-                                        '/mo/%s.json' % attr.pop('dn'))
-                                LOG.debug("UPDATING in APIC: %s" % to_update)
-                                # Update object ownership
-                                self._post_with_transaction(to_update,
-                                                            modified=True)
-                                if to_update:
-                                    self.creation_succeeded(aim_object)
-                        except Exception as e:
-                            LOG.debug(traceback.format_exc())
-                            LOG.error("An error has occurred during %s for "
-                                      "object %s: %s" % (method, aim_object,
-                                                         str(e)))
-                            if method == base_universe.CREATE:
-                                err_type = (
-                                    self.error_handler.analyze_exception(e))
-                                # REVISIT(ivar): for now, treat UNKNOWN errors
-                                # the same way as OPERATION_TRANSIENT.
-                                # Investigate a way to understand when such
-                                # errors might require agent restart.
-                                self.creation_failed(aim_object, str(e),
-                                                     err_type)
+                        self._push_deletes(aim_objects)
+                    else:
+                        self._push_creates(aim_objects)
+
+    def _push_creates(self, aim_objects):
+        batch = []
+        for aim_object in aim_objects:
+            if getattr(aim_object, 'monitored', False):
+                # When pushing to APIC, treat monitored
+                # objects as pre-existing
+                aim_object.monitored = False
+                aim_object.pre_existing = True
+            to_push = self.to_aci_converter.convert([aim_object])
+            LOG.debug('%s AIM object %s in APIC' % (
+                      base_universe.CREATE, repr(aim_object)))
+            try:
+                # Set ownership before pushing the request
+                to_push = self.ownership_mgr.set_ownership_key(to_push)
+            except Exception as e:
+                self._push_failed(base_universe.CREATE, aim_object, e)
+                continue
+            if self.push_batch_size > 1:
+                batch.append((aim_object, to_push))
+            else:
+                self._push_create(aim_object, to_push)
+        failed = self._post_in_batches(
+            [(i, x[1]) for i, x in enumerate(batch)])
+        for i, (aim_object, to_push) in enumerate(batch):
+            if i in failed:
+                # Retry on its own to find out which object is failing
+                self._push_create(aim_object, to_push)
+            else:
+                self.creation_succeeded(aim_object)
+
+    def _push_create(self, aim_object, to_push):
+        try:
+            LOG.debug("POSTING into APIC: %s" % to_push)
+            self._post_with_transaction(to_push)
+            self.creation_succeeded(aim_object)
+        except Exception as e:
+            self._push_failed(base_universe.CREATE, aim_object, e)
+
+    def _push_deletes(self, aim_objects):
+        dn_mgr = apic_client.DNManager()
+        decompose = dn_mgr.aci_decompose_dn_guess
+        # sort the aim_objects based on DN first for DELETE method
+        sorted_aim_objs = sorted(
+            aim_objects, key=lambda x: list(x.values())[0]['attributes']['dn'])
+        potential_parent_dn = ' '
+        batch = []
+        for aim_object in sorted_aim_objs:
+            # If a parent is also being deleted then we don't
+            # have to send those children requests to APIC
+            dn = list(aim_object.values())[0]['attributes']['dn']
+            res_type = list(aim_object.keys())[0]
+            decomposed = decompose(dn, res_type)
+            parent_dn = dn_mgr.build(decomposed[1][:-1])
+            if parent_dn.startswith(potential_parent_dn):
+                continue
+            else:
+                potential_parent_dn = dn
+            to_push = [copy.deepcopy(aim_object)]
+            LOG.debug('%s AIM object %s in APIC' % (
+                      base_universe.DELETE, repr(aim_object)))
+            try:
+                to_delete, to_update = (
+                    self.ownership_mgr.set_ownership_change(to_push))
+            except Exception as e:
+                self._push_failed(base_universe.DELETE, aim_object, e)
+                continue
+            if self.push_batch_size > 1:
+                batch.append((aim_object, to_delete, to_update))
+            else:
+                self._push_delete(aim_object, to_delete, to_update)
+        failed = self._post_in_batches(
+            [(i, x[1]) for i, x in enumerate(batch)],
+            status=converter.DELETED_STATUS)
+        for i, (aim_object, to_delete, to_update) in enumerate(batch):
+            if i not in failed:
+                # Already deleted, only ownership is left to update
+                to_delete = []
+            self._push_delete(aim_object, to_delete, to_update)
+
+    def _push_delete(self, aim_object, to_delete, to_update):
+        try:
+            LOG.debug("DELETING from APIC: %s" % to_delete)
+            for obj in to_delete:
+                attr = list(obj.values())[0]['attributes']
+                self.aci_session.DELETE('/mo/%s.json' % attr.pop('dn'))
+            LOG.debug("UPDATING in APIC: %s" % to_update)
+            # Update object ownership
+            self._post_with_transaction(to_update, modified=True)
+            if to_update:
+                self.creation_succeeded(aim_object)
+        except Exception as e:
+            self._push_failed(base_universe.DELETE, aim_object, e)
+
+    def _push_failed(self, method, aim_object, e):
+        LOG.debug(traceback.format_exc())
+        LOG.error("An error has occurred during %s for "
+                  "object %s: %s" % (method, aim_object, str(e)))
+        if method == base_universe.CREATE:
+            err_type = self.error_handler.analyze_exception(e)
+            # REVISIT(ivar): for now, treat UNKNOWN errors
+            # the same way as OPERATION_TRANSIENT.
+            # Investigate a way to understand when such
+            # errors might require agent restart.
+            self.creation_failed(aim_object, str(e), err_type)
+
+    def _post_in_batches(self, items, status=None):
+        """Post ACI objects to APIC with as few requests as possible
+
+        Objects are nested into their parents when those are posted as
+        well, and the resulting subtrees are posted together under their
+        common parent, within the push_batch_size and push_batch_max_bytes
+        limits. APIC applies each request atomically.
+
+        :param items: list of (key, ACI objects) tuples
+        :param status: status to set on all the objects
+        :return: set of keys for which some object failed to be posted, or
+        couldn't be prepared for posting
+        """
+        if not items:
+            return set()
+        failed = set()
+        nodes = {}
+        for key, objects in items:
+            try:
+                item_nodes = self._get_batch_nodes(objects, status)
+            except Exception as e:
+                LOG.debug(traceback.format_exc())
+                LOG.info("Failed to batch objects %s, falling back to "
+                         "single object requests: %s" % (objects, str(e)))
+                failed.add(key)
+                continue
+            for node in item_nodes:
+                curr = nodes.get(node['dn'])
+                if curr:
+                    curr['body'].update_attributes(
+                        **node['body'].attributes)
+                    curr['keys'].add(key)
+                else:
+                    node['keys'] = set([key])
+                    nodes[node['dn']] = node
+        groups = {}
+        for dn, node in nodes.items():
+            if node['parent_dn'] in nodes:
+                parent = nodes[node['parent_dn']]
+                parent['children'].append(node)
+                parent['body'].children.append(node['body'])
+            else:
+                groups.setdefault(node['parent_dn'], []).append(node)
+        levels = {}
+        for parent_dn, group in groups.items():
+            chunks = levels.setdefault(len(group[0]['rns']), [])
+            chunk, size, length = [], 0, 0
+            for node in group:
+                body = node['body']
+                node_size = self._get_batch_node_size(node)
+                node_length = len(utils.json_dumps(body))
+                if chunk and (
+                        size + node_size > self.push_batch_size or
+                        length + node_length > self.push_batch_max_bytes):
+                    chunks.append((parent_dn, chunk))
+                    chunk, size, length = [], 0, 0
+                chunk.append((node, body))
+                size += node_size
+                length += node_length
+            chunks.append((parent_dn, chunk))
+        # Parents go first, they might be needed by the deeper levels.
+        # Requests within the same level are independent and can be posted
+        # concurrently.
+        for depth in sorted(levels):
+            for result in utils.run_in_parallel(
+                    [functools.partial(self._post_batch, *x)
+                     for x in levels[depth]],
+                    self.push_concurrency,
+                    semaphore=get_push_semaphore(self.apic_config)):
+                failed |= result
+        return failed
+
+    def _get_batch_nodes(self, objects, status):
+        dn_mgr = apic_client.DNManager()
+        result = []
+        for obj in objects:
+            res_type = list(obj.keys())[0]
+            attr = dict(list(obj.values())[0]['attributes'])
+            dn = attr.pop('dn')
+            if status:
+                attr['status'] = status
+            mo, rns = dn_mgr.aci_decompose_dn_guess(dn, res_type)
+            parent_dn = dn_mgr.build(rns[:-1])
+            attr['rn'] = dn[len(parent_dn) + 1:]
+            # Attributes are coerced the same way APIC transactions do
+            body = apic_client.TransactionNode(
+                apic_client.ManagedObjectClass(mo).klass_name, attr['rn'],
+                **attr)
+            result.append({'dn': dn, 'mo': mo, 'rns': rns,
+                           'parent_dn': parent_dn, 'body': body,
+                           'children': []})
+        return result
+
+    def _post_batch(self, parent_dn, chunk):
+        dn_mgr = apic_client.DNManager()
+        if len(chunk) > 1 and len(chunk[0][0]['rns']) < 2:
+            # Top level objects have no parent to be posted to
+            failed = set()
+            for item in chunk:
+                failed |= self._post_batch(parent_dn, [item])
+            return failed
+        try:
+            if len(chunk) == 1:
+                node, body = chunk[0]
+                mo = apic_client.ManagedObjectClass(node['mo'])
+                rns = node['rns']
+            else:
+                # Post all the subtrees under their parent, which APIC
+                # must already have. Its class comes from the DN, as some
+                # objects have multiple possible containers.
+                node = chunk[0][0]
+                rns = node['rns'][:-1]
+                mo = apic_client.ManagedObjectClass(rns[-1][0])
+                grandparent_dn = dn_mgr.build(rns[:-1])
+                body = {mo.klass_name: {
+                    'attributes': {
+                        'rn': parent_dn[len(grandparent_dn) + 1:],
+                        'status': converter.MODIFIED_STATUS},
+                    'children': [x[1] for x in chunk]}}
+            LOG.debug("POSTING batch into APIC under %s: %s" %
+                      (parent_dn, body))
+            params = dn_mgr.filter_rns(rns)
+            self.aci_session.renew(mo, *params)
+            self.aci_session.post_body_dict(mo, body, *params)
+            return set()
+        except Exception as e:
+            LOG.debug(traceback.format_exc())
+            LOG.info("Failed to post batch of %s objects under %s, falling "
+                     "back to single object requests: %s" %
+                     (len(chunk), parent_dn, str(e)))
+            failed = set()
+            for node, _ in chunk:
+                failed |= self._get_batch_node_keys(node)
+            return failed
+
+    def _get_batch_node_size(self, node):
+        return 1 + sum(self._get_batch_node_size(x)
+                       for x in node['children'])
+
+    def _get_batch_node_keys(self, node):
+        keys = set(node['keys'])
+        for child in node['children']:
+            keys |= self._get_batch_node_keys(child)
+        return keys
 
     def _unsubscribe_tenant(self, kill=False):
         LOG.info("Unsubscribing tenant websocket %s" % self.tenant_name)
         self._warm = False
+        # An unverified snapshot is rebuilt by the next full state
+        self._warm_pending = False
+        self._subscribed = False
+        if self._subscription is not None:
+            # Don't let the background subscription outlive this call
+            self._subscription.join()
+            self._subscription = None
+            self._subscription_error = None
         urls = self.tenant.urls
         if kill:
             # Make sure this thread cannot use websocket anymore
             self.tenant.urls = self.ws_context.EMPTY_URLS
         self.ws_context.unsubscribe(urls)
         self._reset_object_backlog()
+        self._reset_pending_events()
 
     def _subscribe_tenant(self):
+        if not self._snapshot_loaded:
+            self._load_snapshot()
+        self.scheduled_reset = self.reset_scheduler.schedule(self.tenant_name)
+        self._reset_granted = False
+        if self._warm_pending:
+            # Retrieve the full state in the background, the snapshot is
+            # served in the meantime
+            self._subscription = utils.spawn_thread(
+                self._subscribe_in_background)
+            self._subscribed = True
+            return
         self.ws_context.subscribe(self.tenant.urls)
-        self.scheduled_reset = utils.schedule_next_event(RESET_INTERVAL, 0.2)
-        self._event_loop()
+        self._subscribed_at = time.time()
+        # Build the initial state right away
+        if self.worker_pool:
+            self._handle_events(flush=True)
+        else:
+            self._event_loop(flush=True)
+        self._subscribed = True
         self._warm = True
+        self.reset_scheduler.release(self.tenant_name)
+
+    def _subscribe_in_background(self):
+        try:
+            self.ws_context.subscribe(self.tenant.urls)
+            self._subscribed_at = time.time()
+        except Exception as e:
+            self._subscription_error = e
 
     def _event_to_tree(self, events):
         """Parse the event and push it into the tree
@@ -654,8 +1548,16 @@ class AciTenantManager(utils.AIMThread):
         This method requires translation between ACI and AIM model in order
         to  honor the Universe contract.
         :param events: an ACI event in the form of a list of objects
-        :return:
+        :return: whether the trees were modified
         """
+        modified = self._build_trees(events, self._state,
+                                     self._operational_state,
+                                     self._monitored_state)
+        if modified:
+            event_handler.EventHandler.reconcile(roots=[self.tenant_name])
+        return modified
+
+    def _build_trees(self, events, state, operational_state, monitored_state):
         removed, updated = [], []
         removing_dns = set()
         filtered_events = []
@@ -707,24 +1609,20 @@ class AciTenantManager(utils.AIMThread):
                 updated.append(event)
         upd_trees, upd_op_trees, upd_mon_trees = self.tree_builder.build(
             [], updated, removed,
-            {self.tree_builder.CONFIG: {self.tenant_name: self._state},
-             self.tree_builder.MONITOR:
-                 {self.tenant_name: self._monitored_state},
-             self.tree_builder.OPER:
-                 {self.tenant_name: self._operational_state}})
+            {self.tree_builder.CONFIG: {self.tenant_name: state},
+             self.tree_builder.MONITOR: {self.tenant_name: monitored_state},
+             self.tree_builder.OPER: {self.tenant_name: operational_state}})
 
-        # Send events on update
         modified = False
         for upd, tree, readable in [
-                (upd_trees, self._state, "configuration"),
-                (upd_op_trees, self._operational_state, "operational"),
-                (upd_mon_trees, self._monitored_state, "monitored")]:
+                (upd_trees, state, "configuration"),
+                (upd_op_trees, operational_state, "operational"),
+                (upd_mon_trees, monitored_state, "monitored")]:
             if upd:
                 modified = True
                 LOG.debug("New %s tree for tenant %s: %s" %
                           (readable, self.tenant_name, tree))
-        if modified:
-            event_handler.EventHandler.reconcile()
+        return modified
 
     def _fill_events(self, events):
         """Gets incomplete objects from APIC if needed
@@ -750,6 +1648,9 @@ class AciTenantManager(utils.AIMThread):
 
     def retrieve_aci_objects(self, events):
         result = {}
+        # Modified objects to be retrieved, by DN. They are all looked up
+        # with a single get_resources call once the events are evaluated.
+        to_retrieve = collections.OrderedDict()
 
         for event in events:
             resource = list(event.values())[0]
@@ -799,29 +1700,46 @@ class AciTenantManager(utils.AIMThread):
                     # Update with changes
                     list(result[raw_dn].values())[0]['attributes'].update(
                         event_attrs)
+                    event_attrs = None
                 key = tree_manager.AimHashTreeMaker._dn_to_key(res_type,
                                                                raw_dn)
-                data = []
                 if key:
-                    # Search within the TenantManager state, which is the most
-                    # up to date.
-                    data = self.get_resources(
-                        [key], desired_state=self._get_full_state())
-                if not data and not apnf:
+                    to_retrieve.setdefault(raw_dn, []).append(
+                        (key, event_attrs, apnf))
+                elif not apnf:
                     LOG.debug("Resource %s not found or not supported", raw_dn)
-                for item in data:
-                    dn = list(item.values())[0]['attributes']['dn']
-                    if dn not in result:
-                        result[dn] = item
-                        if dn == raw_dn:
-                            list(result[raw_dn].values())[
-                                0]['attributes'].update(event_attrs)
             if not status or status == converter.CREATED_STATUS:
                 result[raw_dn] = event
+        self._retrieve_modified_objects(to_retrieve, result)
         LOG.debug("Result for retrieving ACI resources: %s\n %s" %
                   (events, result))
         return list(result.values())
 
+    def _retrieve_modified_objects(self, to_retrieve, result):
+        if not to_retrieve:
+            return
+        keys = list(collections.OrderedDict.fromkeys(
+            item[0] for items in to_retrieve.values() for item in items))
+        # Search within the TenantManager state, which is the most
+        # up to date.
+        data = self.get_resources(keys, desired_state=self._get_full_state())
+        added = set()
+        for item in data:
+            dn = list(item.values())[0]['attributes']['dn']
+            if dn not in result:
+                result[dn] = item
+                added.add(dn)
+        for raw_dn, items in to_retrieve.items():
+            if raw_dn not in added:
+                if raw_dn not in result and not all(x[2] for x in items):
+                    LOG.debug("Resource %s not found or not supported",
+                              raw_dn)
+                continue
+            for _, event_attrs, _ in items:
+                if event_attrs is not None:
+                    list(result[raw_dn].values())[0]['attributes'].update(
+                        event_attrs)
+
     @staticmethod
     def flat_events(events):
         # If there are children objects, put them at the top level
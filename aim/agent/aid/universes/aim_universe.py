@@ -82,7 +82,7 @@ class AimDbUniverse(base.HashTreeStoredUniverse):
             new_state.setdefault(tenant, self._state.get(tenant))
         self._state = new_state
 
-    def observe(self, context):
+    def observe(self, context, roots=None):
         # TODO(ivar): move this to a separate thread and add scheduled reset
         # mechanism
         served_tenants = copy.deepcopy(self._served_tenants)
@@ -96,10 +96,26 @@ class AimDbUniverse(base.HashTreeStoredUniverse):
                 self.manager.recover_root_errors(context, root)
             htdbl.cleanup_zombie_status_objects(context, served_tenants)
             self.schedule_next_recovery()
-        htdbl.catch_up_with_action_log(context.store, served_tenants)
+            roots = None
+        updated_roots = None
+        if roots is None:
+            updated_roots = htdbl.catch_up_with_action_log(
+                context.store, copy.deepcopy(served_tenants))
+        else:
+            served_tenants &= set(roots)
+            if served_tenants:
+                updated_roots = htdbl.catch_up_with_action_log(
+                    context.store, copy.deepcopy(served_tenants))
+        # Status and error changes don't move the tree hashes, make sure
+        # the roots they touched are reconciled again.
+        if updated_roots:
+            for pair in self.multiverse:
+                for universe in pair.values():
+                    universe.invalidate_reconciled_roots(updated_roots)
         # REVISIT(ivar): what if a root is marked as needs_reset? we could
         # avoid syncing it altogether
-        self._state.update(self.get_optimized_state(context, self.state))
+        self._state.update(self.get_optimized_state(context, self.state,
+                                                    roots=served_tenants))
 
     def reset(self, context, tenants):
         LOG.warn('Reset called for roots %s' % tenants)
@@ -108,9 +124,9 @@ class AimDbUniverse(base.HashTreeStoredUniverse):
                 self.manager).tt_mgr.set_needs_reset_by_root_rn(context, root)
 
     def get_optimized_state(self, context, other_state,
-                            tree=tree_manager.CONFIG_TREE):
+                            tree=tree_manager.CONFIG_TREE, roots=None):
         # TODO(ivar): make it tree-version based to reflect metadata changes
-        return self._get_state(context, tree=tree)
+        return self._get_state(context, tree=tree, roots=roots)
 
     def cleanup_state(self, context, key):
         # Only delete if state is still empty. Never remove a tenant if there
@@ -120,9 +136,11 @@ class AimDbUniverse(base.HashTreeStoredUniverse):
             # tenants in the next iteration.
             self.tree_manager.delete_by_root_rn(context, key, if_empty=True)
 
-    def _get_state(self, context, tree=tree_manager.CONFIG_TREE):
+    def _get_state(self, context, tree=tree_manager.CONFIG_TREE,
+                   roots=None):
         return self.tree_manager.find_changed(
-            context, dict([(x, None) for x in self._served_tenants]),
+            context, dict([(x, None) for x in (
+                self._served_tenants if roots is None else roots)]),
             tree=tree)
 
     @property
@@ -152,7 +170,8 @@ class AimDbUniverse(base.HashTreeStoredUniverse):
             # Remove tenants that have been emptied.
             # This means the tenant has been created then deleted
             if (tenant in other_state and not other_state[tenant].root and
-                    other_state[tenant].has_populated is True):
+                    other_state[tenant].has_populated is True and
+                    not other_universe.is_read_only(tenant)):
                 pass
             else:
                 delete_candidates.discard(tenant)
@@ -336,9 +355,9 @@ class AimDbOperationalUniverse(AimDbUniverse):
         return [self.state]
 
     def get_optimized_state(self, context, other_state,
-                            tree=tree_manager.OPERATIONAL_TREE):
+                            tree=tree_manager.OPERATIONAL_TREE, roots=None):
         return super(AimDbOperationalUniverse, self).get_optimized_state(
-            context, other_state, tree=tree)
+            context, other_state, tree=tree, roots=roots)
 
     def vote_deletion_candidates(self, context, other_universe,
                                  delete_candidates, vetoes):
@@ -384,9 +403,9 @@ class AimDbMonitoredUniverse(AimDbUniverse):
         return [self.state, self.get_state_by_type(base.CONFIG_UNIVERSE)]
 
     def get_optimized_state(self, context, other_state,
-                            tree=tree_manager.MONITORED_TREE):
+                            tree=tree_manager.MONITORED_TREE, roots=None):
         return super(AimDbMonitoredUniverse, self).get_optimized_state(
-            context, other_state, tree=tree)
+            context, other_state, tree=tree, roots=roots)
 
     def push_resources(self, context, resources):
         self._push_resources(context, resources, monitored=True)
@@ -39,6 +39,41 @@ OPER_UNIVERSE = 1
 MONITOR_UNIVERSE = 2
 ACTION_RESET = 'reset'
 ACTION_PURGE = 'purge'
+# Reconcile scheduling parameters, costs are in seconds
+BACKGROUND_COST_FACTOR = 10
+DEFAULT_NODE_COST = 0.01
+MIN_NODE_COST = 0.0001
+NODE_COST_WEIGHT = 0.2
+
+
+class KeyDnBuilder(object):
+    """Builds DNs out of split hashtree keys.
+
+    Keys in the same diff share most of their ancestors, therefore the DN of
+    every key prefix is cached and only the last RN is built for each key.
+    Meant to be used for the duration of a single conversion.
+    """
+
+    def __init__(self):
+        self._mos = {}
+        self._dns = {(): 'uni'}
+
+    def build(self, key_parts):
+        return self._build(tuple((x[0], x[1]) for x in key_parts))
+
+    def _build(self, key_parts):
+        try:
+            return self._dns[key_parts]
+        except KeyError:
+            pass
+        mo_type, rn = key_parts[-1]
+        mo = self._mos.get(mo_type)
+        if mo is None:
+            mo = self._mos[mo_type] = apic_client.ManagedObjectClass(mo_type)
+        rn = mo.rn(*rn.split(',')) if mo.rn_param_count else mo.rn()
+        dn = self._dns[key_parts] = '%s/%s' % (self._build(key_parts[:-1]),
+                                               rn)
+        return dn
 
 
 @six.add_metaclass(abc.ABCMeta)
@@ -68,12 +103,14 @@ class BaseUniverse(object):
         """
 
     @abc.abstractmethod
-    def observe(self, context):
+    def observe(self, context, roots=None):
         """Observes the current state of the Universe
 
         This method is used to refresh the current state. Some Universes might
         want to run threads at initialization time for this purpose. In that
         case this method can be void.
+        :param roots: when set, only these roots could have changed since the
+        last observation
         :return:
         """
 
@@ -292,6 +329,15 @@ class HashTreeStoredUniverse(AimUniverse):
             errors.SYSTEM_CRITICAL: self._fail_agent,
         }
         self._sync_log = {}
+        # Root hash pairs (desired, current) as of the last reconciliation
+        # that found the root in sync.
+        self._reconciled_roots = {}
+        # Reconcile scheduling state
+        self.reconcile_time_budget = self.conf_manager.get_option(
+            'reconcile_time_budget', 'aim')
+        self._dirty_since = {}
+        self._synced_roots = set()
+        self._node_cost = DEFAULT_NODE_COST
         return self
 
     def _dissect_key(self, key):
@@ -302,8 +348,9 @@ class HashTreeStoredUniverse(AimUniverse):
     def _split_key(self, key):
         return [k.split('|', 2) for k in key]
 
-    def _keys_to_bare_aci_objects(self, keys):
+    def _keys_to_bare_aci_objects(self, keys, dn_builder=None):
         # Transforms hashtree keys into minimal ACI objects
+        dn_builder = dn_builder or KeyDnBuilder()
         aci_objects = []
         for key in keys:
             fault_code = None
@@ -313,7 +360,7 @@ class HashTreeStoredUniverse(AimUniverse):
             if mo_type == 'faultInst':
                 fault_code = key_parts[-1][1]
                 key_parts = key_parts[:-1]
-            dn = apic_client.DNManager().build(key_parts)
+            dn = dn_builder.build(key_parts)
             if fault_code:
                 dn += '/fault-%s' % fault_code
                 aci_object[mo_type]['attributes']['code'] = fault_code
@@ -327,7 +374,7 @@ class HashTreeStoredUniverse(AimUniverse):
                 other_universe.state[tenant] = (
                     structured_tree.StructuredHashTree())
 
-    def observe(context, self):
+    def observe(self, context, roots=None):
         pass
 
     def reconcile(self, context, other_universe, delete_candidates):
@@ -340,6 +387,7 @@ class HashTreeStoredUniverse(AimUniverse):
     def _pop_up_sync_log(self, delete_candidates):
         for root in delete_candidates:
             self._sync_log.pop(root, None)
+            self._forget_root(root)
 
     def finalize_deletion_candidates(self, context, other_universe,
                                      delete_candidates):
@@ -350,78 +398,53 @@ class HashTreeStoredUniverse(AimUniverse):
         my_state = self.state
         other_state = other_universe.state
         diff = False
-        for tenant in set(my_state.keys()) & set(other_state.keys()):
-            # TODO(ivar): parallelize the procedure on Tenant's basis
+        tenants = set(my_state.keys()) & set(other_state.keys())
+        # Forget roots that are not served anymore
+        for tenant in ((set(self._reconciled_roots) | set(self._dirty_since) |
+                        self._synced_roots) - tenants):
+            self._forget_root(tenant)
+        now = utils.get_time()
+        schedule = []
+        for tenant in tenants:
             try:
-                differences = {CREATE: [], DELETE: []}
                 other_tenant_state = other_state[tenant]
                 my_tenant_state = my_state.get(
                     tenant, structured_tree.StructuredHashTree())
+                hash_pair = self._get_root_hash_pair(other_tenant_state,
+                                                     my_tenant_state)
+                if self._is_root_clean(tenant, hash_pair):
+                    continue
+                self._reconciled_roots.pop(tenant, None)
+                self._dirty_since.setdefault(tenant, now)
                 # Retrieve difference to transform self into other
                 difference = other_tenant_state.diff(my_tenant_state)
-                differences[CREATE].extend(difference['add'])
-                differences[DELETE].extend(difference['remove'])
-
-                if differences.get(CREATE) or differences.get(DELETE):
-                    LOG.info("Universe differences between %s and %s: %s",
-                             self.name, other_universe.name, differences)
-                    diff = True
-                result = {
-                    CREATE: other_universe.get_resources(differences[CREATE]),
-                    DELETE: self.get_resources_for_delete(differences[DELETE])
-                }
-
-                reset, fail, skip = self._track_universe_actions(result,
-                                                                 tenant)
-                if (self._sync_log.get(tenant, {}).get('create') or
-                        self._sync_log.get(tenant, {}).get('delete')):
-                    LOG.debug('Sync log cache for %s (%s): %s' %
-                              (self.name, tenant, self._sync_log))
-
-                if reset:
-                    self.reset(context, [tenant])
-                    other_universe.reset(context, [tenant])
-                    # Don't synchronize resetting roots
-                    continue
-
-                for action, res in fail:
-                    if action == CREATE:
-                        self.creation_failed(
-                            context, res,
-                            reason='Divergence detected on this object.',
-                            error=errors.OPERATION_CRITICAL)
-                    if action == DELETE:
-                        self.deletion_failed(
-                            context, res,
-                            reason='Divergence detected on this object.',
-                            error=errors.OPERATION_CRITICAL)
-                    skip.append((action, res))
-
-                skipset = set()
-                if skip:
-                    differences[CREATE] = set(differences[CREATE])
-                    differences[DELETE] = set(differences[DELETE])
-
-                    for action, res in skip:
-                        for key in (tree_manager.AimHashTreeMaker.
-                                    aim_res_to_nodes(res)):
-                            differences[action].discard(key)
-                            skipset.add(key)
-                    differences[CREATE] = list(differences[CREATE])
-                    differences[DELETE] = list(differences[DELETE])
-                    # Need to rebuild results
-                    result = {
-                        CREATE: other_universe.get_resources(
-                            differences[CREATE]),
-                        DELETE: self.get_resources_for_delete(
-                            differences[DELETE])
-                    }
-                self.update_status_objects(context, my_tenant_state,
-                                           differences, skipset)
-                other_universe.update_status_objects(
-                    context, other_tenant_state, differences, skipset)
-                # Reconciliation method for pushing changes
-                self.push_resources(context, result)
+                schedule.append(
+                    (self._get_root_priority(tenant, difference, now),
+                     tenant, hash_pair, difference))
+            except Exception as e:
+                LOG.error("An unexpected error has occurred while "
+                          "reconciling tenant %s: %s" % (tenant, str(e)))
+                LOG.error(traceback.format_exc())
+                diff = True
+        schedule.sort(key=lambda x: x[0])
+        deadline = None
+        if self.reconcile_time_budget:
+            deadline = now + self.reconcile_time_budget
+        for i, (_, tenant, hash_pair, difference) in enumerate(schedule):
+            # At least one root is reconciled on every cycle
+            if i and deadline and utils.get_time() > deadline:
+                LOG.info("%s reconcile time budget exhausted, deferring "
+                         "roots %s to the next cycle",
+                         self.name, [x[1] for x in schedule[i:]])
+                # Guess we can't consider the multiverse synced yet
+                diff = True
+                break
+            try:
+                diff |= self._reconcile_root(
+                    context, other_universe, tenant, other_state[tenant],
+                    my_state.get(tenant,
+                                 structured_tree.StructuredHashTree()),
+                    hash_pair, difference)
             except Exception as e:
                 LOG.error("An unexpected error has occurred while "
                           "reconciling tenant %s: %s" % (tenant, str(e)))
@@ -430,6 +453,139 @@ class HashTreeStoredUniverse(AimUniverse):
                 diff = True
         return diff
 
+    def _reconcile_root(self, context, other_universe, tenant,
+                        other_tenant_state, my_tenant_state, hash_pair,
+                        difference):
+        diff = False
+        start = utils.get_time()
+        differences = {CREATE: list(difference['add']),
+                       DELETE: list(difference['remove'])}
+        if differences.get(CREATE) or differences.get(DELETE):
+            LOG.info("Universe differences between %s and %s: %s",
+                     self.name, other_universe.name, differences)
+            diff = True
+        if self.is_read_only(tenant) or other_universe.is_read_only(tenant):
+            LOG.debug("Not synchronizing read only root %s", tenant)
+            return diff
+        result = {
+            CREATE: other_universe.get_resources(differences[CREATE]),
+            DELETE: self.get_resources_for_delete(differences[DELETE])
+        }
+
+        reset, fail, skip = self._track_universe_actions(result, tenant)
+        if (self._sync_log.get(tenant, {}).get('create') or
+                self._sync_log.get(tenant, {}).get('delete')):
+            LOG.debug('Sync log cache for %s (%s): %s' %
+                      (self.name, tenant, self._sync_log))
+
+        if reset:
+            self.reset(context, [tenant])
+            other_universe.reset(context, [tenant])
+            # The root will be fully resynced in background
+            self._synced_roots.discard(tenant)
+            # Don't synchronize resetting roots
+            return diff
+
+        for action, res in fail:
+            if action == CREATE:
+                self.creation_failed(
+                    context, res,
+                    reason='Divergence detected on this object.',
+                    error=errors.OPERATION_CRITICAL)
+            if action == DELETE:
+                self.deletion_failed(
+                    context, res,
+                    reason='Divergence detected on this object.',
+                    error=errors.OPERATION_CRITICAL)
+            skip.append((action, res))
+
+        skipset = set()
+        if skip:
+            differences[CREATE] = set(differences[CREATE])
+            differences[DELETE] = set(differences[DELETE])
+
+            for action, res in skip:
+                for key in (tree_manager.AimHashTreeMaker.
+                            aim_res_to_nodes(res)):
+                    differences[action].discard(key)
+                    skipset.add(key)
+            differences[CREATE] = list(differences[CREATE])
+            differences[DELETE] = list(differences[DELETE])
+            # Need to rebuild results
+            result = {
+                CREATE: other_universe.get_resources(differences[CREATE]),
+                DELETE: self.get_resources_for_delete(differences[DELETE])
+            }
+        self.update_status_objects(context, my_tenant_state, differences,
+                                   skipset)
+        other_universe.update_status_objects(
+            context, other_tenant_state, differences, skipset)
+        # Reconciliation method for pushing changes
+        self.push_resources(context, result)
+        if not (differences[CREATE] or differences[DELETE] or
+                self._has_pending_actions(tenant)):
+            self._reconciled_roots[tenant] = hash_pair
+            self._dirty_since.pop(tenant, None)
+            self._synced_roots.add(tenant)
+        self._update_node_cost(
+            utils.get_time() - start,
+            len(difference['add']) + len(difference['remove']))
+        return diff
+
+    def _get_root_priority(self, root, difference, now):
+        # Highest response ratio next: roots with the cheapest changes are
+        # reconciled first, while the ratio of the waiting ones keeps
+        # growing so that big changes don't starve. Roots that were never
+        # synced since being served or reset are background work, and are
+        # considered more expensive than changes coming from the API.
+        size = len(difference['add']) + len(difference['remove'])
+        root_log = self._sync_log.get(root, {})
+        size += len(root_log.get(CREATE) or {})
+        size += len(root_log.get(DELETE) or {})
+        cost = max(size, 1) * self._node_cost
+        if root not in self._synced_roots:
+            cost *= BACKGROUND_COST_FACTOR
+        waited = now - self._dirty_since.get(root, now)
+        return -(waited + cost) / cost, cost, root
+
+    def _update_node_cost(self, elapsed, size):
+        # Moving average of the time spent reconciling a single node
+        if size:
+            self._node_cost = max(
+                (self._node_cost * (1 - NODE_COST_WEIGHT) +
+                 float(elapsed) / size * NODE_COST_WEIGHT), MIN_NODE_COST)
+
+    def _forget_root(self, root):
+        self._reconciled_roots.pop(root, None)
+        self._dirty_since.pop(root, None)
+        self._synced_roots.discard(root)
+
+    def _get_root_hash_pair(self, desired_tree, current_tree):
+        return (getattr(desired_tree, 'root_full_hash', None),
+                getattr(current_tree, 'root_full_hash', None))
+
+    def _has_pending_actions(self, root):
+        root_log = self._sync_log.get(root, {})
+        return bool(root_log.get(CREATE) or root_log.get(DELETE))
+
+    def is_read_only(self, root):
+        """Whether the state of root can be diffed but not acted upon"""
+        return False
+
+    def invalidate_reconciled_roots(self, roots):
+        for root in roots:
+            self._reconciled_roots.pop(root, None)
+
+    def _is_root_clean(self, root, hash_pair):
+        # A root that was found in sync doesn't need to be diffed again until
+        # either side of its hash pair moves, unless some action on it is
+        # still being retried.
+        if root not in self._reconciled_roots:
+            return False
+        if self._reconciled_roots[root] != hash_pair:
+            return False
+        return not self._has_pending_actions(root)
+
     def reset(self, context, tenants):
         pass
 
@@ -449,34 +605,41 @@ class HashTreeStoredUniverse(AimUniverse):
         # NOTE(ivar): state is a copy at the current iteration that was created
         # through the observe() method.
         desired_state = desired_state or self.get_relevant_state_for_read()
+        dn_builder = KeyDnBuilder()
+        aci_to_aim = converter.AciToAimModelConverter()
         result = []
         id_set = set()
         monitored_set = set()
+        # NOTE: related and parent keys are appended to resource_keys while
+        # iterating, so that they are resolved within the same loop.
         for key in resource_keys:
             if key not in id_set:
-                attr = self._fill_node(key, desired_state)
+                # Walk each tree only once per key, the same lookup serves
+                # the node itself as well as its related children and parent.
+                nodes = self._find_nodes(key, desired_state)
+                attr = self._fill_node(key, desired_state, nodes=nodes)
                 if not attr:
                     continue
                 monitored = attr.pop('monitored', None)
                 related = attr.pop('related', False)
                 attr = attr.get('attributes', {})
-                aci_object = self._keys_to_bare_aci_objects([key])[0]
+                aci_object = self._keys_to_bare_aci_objects(
+                    [key], dn_builder=dn_builder)[0]
                 list(aci_object.values())[0]['attributes'].update(attr)
                 dn = list(aci_object.values())[0]['attributes']['dn']
                 # Capture related objects
                 if desired_state:
                     self._fill_related_nodes(resource_keys, key,
-                                             desired_state)
+                                             desired_state, nodes=nodes)
                     if related:
                         self._fill_parent_node(resource_keys, key,
-                                               desired_state)
+                                               desired_state, nodes=nodes)
                 result.append(aci_object)
                 if monitored:
                     if related:
                         try:
                             monitored_set.add(
-                                converter.AciToAimModelConverter().convert(
-                                    [aci_object])[0].dn)
+                                aci_to_aim.convert([aci_object])[0].dn)
                         except IndexError:
                             pass
                     else:
@@ -493,8 +656,8 @@ class HashTreeStoredUniverse(AimUniverse):
             LOG.debug("Requesting resource keys in %s for "
                       "delete: %s" % (self.name, resource_keys))
         result = []
-        for key in resource_keys:
-            aci_object = self._keys_to_bare_aci_objects([key])[0]
+        aci_objects = self._keys_to_bare_aci_objects(resource_keys)
+        for key, aci_object in zip(resource_keys, aci_objects):
             # If this object exists in the monitored tree it's transitioning
             root = tree_manager.AimHashTreeMaker._extract_root_rn(key)
             try:
@@ -507,39 +670,43 @@ class HashTreeStoredUniverse(AimUniverse):
                       (resource_keys, result))
         return result
 
-    def _fill_node(self, current_key, desired_state):
+    def _find_nodes(self, current_key, desired_state):
+        # Returns a (node, parent) tuple for each state containing the root
         root = tree_manager.AimHashTreeMaker._extract_root_rn(current_key)
+        nodes = []
         for state in desired_state:
             try:
-                current_node = state[root].find(current_key)
+                node, parents = state[root]._get_node_and_parent_stack(
+                    current_key)
             except (IndexError, KeyError):
                 continue
+            nodes.append((node, parents[-1] if parents else None))
+        return nodes
+
+    def _fill_node(self, current_key, desired_state, nodes=None):
+        if nodes is None:
+            nodes = self._find_nodes(current_key, desired_state)
+        for current_node, _ in nodes:
             if current_node and not current_node.dummy:
                 return current_node.metadata.to_dict()
 
-    def _fill_related_nodes(self, resource_keys, current_key, desired_state):
-        root = tree_manager.AimHashTreeMaker._extract_root_rn(current_key)
-        for state in desired_state:
-            try:
-                current_node = state[root].find(current_key)
-                if not current_node:
-                    continue
-            except (IndexError, KeyError):
+    def _fill_related_nodes(self, resource_keys, current_key, desired_state,
+                            nodes=None):
+        if nodes is None:
+            nodes = self._find_nodes(current_key, desired_state)
+        for current_node, _ in nodes:
+            if not current_node:
                 continue
             for child in current_node.get_children():
                 if child.metadata.get('related') and not child.dummy:
                     resource_keys.append(child.key)
 
-    def _fill_parent_node(self, resource_keys, current_key, desired_state):
-        root = tree_manager.AimHashTreeMaker._extract_root_rn(current_key)
-        for state in desired_state:
-            try:
-                parent_node = state[root].find(current_key[:-1])
-                if not parent_node:
-                    continue
-            except (IndexError, KeyError):
-                continue
-            if not parent_node.dummy:
+    def _fill_parent_node(self, resource_keys, current_key, desired_state,
+                          nodes=None):
+        if nodes is None:
+            nodes = self._find_nodes(current_key, desired_state)
+        for _, parent_node in nodes:
+            if parent_node and not parent_node.dummy:
                 resource_keys.append(parent_node.key)
 
     def serve(self, context, tenants):
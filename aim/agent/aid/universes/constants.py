@@ -27,5 +27,7 @@ ACI_TREE_LOCK_NAME_PREFIX = "root_aci_tree_lock-"
 ACI_BACKLOG_LOCK_NAME_PREFIX = "backlog_aci_lock-"
 # Subscription lock
 ACI_WS_CONNECTION_LOCK = "aci_ws_connection_lock"
+# Websocket reconnection flag
+ACI_WS_RECONNECTED_LOCK = "aci_ws_reconnected_lock"
 # Sync log lock
 SYNC_LOG_LOCK = "sync_log_lock-"
@@ -13,6 +13,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import contextlib
 from six.moves import queue
 import time
 import traceback
@@ -27,6 +28,7 @@ from aim.api import status
 from aim.api import tree as aim_tree
 from aim.common.hashtree import structured_tree
 from aim.common import utils
+from aim import config as aim_cfg
 from aim import context
 from aim.db import api
 from aim.k8s import api_v1
@@ -56,6 +58,49 @@ class K8SObserverStopped(Exception):
     message = "Kubernetes observer connection is closed."
 
 
+class K8SResourceVersionExpired(K8SObserverStopped):
+    message = "Kubernetes resource version is too old to resume watching."
+
+
+class K8sTreeShard(object):
+    """Events and pending saves of the roots owned by one tree builder
+
+    Every root is owned by a single shard, so its events are applied in the
+    order they were received. Events are queued with the generation of the
+    trees they apply to, which moves on every reset.
+    """
+
+    def __init__(self, id):
+        self.id = id
+        self.q = queue.Queue()
+        self.generation = 0
+        # Roots whose trees need to be saved in AIM
+        self.affected_tenants = set()
+        self.lock_name = '%s-%s' % (lcon.K8S_WATCHER_TREE_LOCK, id)
+
+    def put(self, event):
+        self.q.put((self.generation, event))
+
+    def get_event(self, timeout=None):
+        """Return the next event, and the generation it was queued in"""
+        try:
+            return self.q.get(timeout=timeout)
+        except queue.Empty:
+            return None, None
+
+    def reset(self):
+        """Drop the queued events, and invalidate the dequeued ones
+
+        Must be called with the shard lock held.
+        """
+        self.generation += 1
+        try:
+            while True:
+                self.q.get_nowait()
+        except queue.Empty:
+            pass
+
+
 class K8sWatcher(object):
     """HashTree Universe of the ACI state.
 
@@ -79,14 +124,23 @@ class K8sWatcher(object):
         self.event_handler = event_handler.EventHandler
         self._stop = False
         self._http_resp = None
-        # Tenants whose trees need to be saved in AIM
-        self.affected_tenants = set()
+        k8s_conf = aim_cfg.CONF.aim_k8s
+        self.shards = [K8sTreeShard(x) for x in
+                       range(max(1, k8s_conf.k8s_watcher_workers))]
+        self.flush_interval = k8s_conf.k8s_watcher_flush_interval
+        self.flush_size = k8s_conf.k8s_watcher_flush_size
         self._observe_thread_state = {}
 
         self._k8s_types_to_observe = set([])
         self._k8s_aim_type_map = {}
         self._k8s_kinds = set([])
         self._needs_init = True
+        # Last resource version seen for each observed type, watches
+        # resume from there
+        self._version_by_type = {}
+        # Last known state of the objects owning auxiliary objects, by kind,
+        # namespace and name
+        self._owners = {}
 
         for aim_res in aim_manager.AimManager.aim_resources:
             if issubclass(aim_res, resource.AciResourceBase):
@@ -102,11 +156,13 @@ class K8sWatcher(object):
                                api_v1.Endpoints: self._endpoints_event_filter}
 
     def run(self):
-        threads = {'observer': self.observer_thread,
-                   'persister': self.persistence_thread}
-        for attr, thd in threads.items():
-            thd = utils.spawn_thread(thd)
-            setattr(self, attr, thd)
+        self.observer = utils.spawn_thread(self.observer_thread)
+        self.start_builders()
+
+    def start_builders(self):
+        self.persister = utils.spawn_thread(self.persistence_thread)
+        self.builders = [utils.spawn_thread(self.builder_thread, shard)
+                         for shard in self.shards]
 
     def stop_threads(self):
         self._stop = True
@@ -159,7 +215,11 @@ class K8sWatcher(object):
         self._thread(self.observe_and_monitor_loop, "K8S Observer")
 
     def persistence_thread(self):
-        self._thread(self.persistence_loop, "K8S Tree Builder")
+        self._thread(self.persistence_loop, "K8S Event Dispatcher")
+
+    def builder_thread(self, shard):
+        self._thread(lambda: self.builder_loop(shard),
+                     "K8S Tree Builder %s" % shard.id)
 
     def observe_and_monitor_loop(self):
         LOG.info("Starting observe and monitor loop.")
@@ -177,35 +237,46 @@ class K8sWatcher(object):
 
         exc = self._check_observers()
         if exc:
-            for ts in self._observe_thread_state.values():
-                ts['watch_stop'] = True
-            if self.klient.watch:
-                self.klient.stop_watch()
-            self._observe_thread_state = {}
-            self._needs_init = True
+            self._stop_observers(exc)
             raise exc
         time.sleep(MONITOR_LOOP_MAX_WAIT)
 
+    def _stop_observers(self, exc):
+        for ts in self._observe_thread_state.values():
+            ts['watch_stop'] = True
+        if self.klient.watch:
+            self.klient.stop_watch()
+        self._observe_thread_state = {}
+        # Trees are rebuilt only if watches can't be resumed
+        if isinstance(exc, K8SResourceVersionExpired):
+            LOG.info("Kubernetes resource versions expired, listing all the "
+                     "objects again")
+            self._needs_init = True
+
     def _init_aim_k8s(self, types_to_observe):
         if self._needs_init:
             # NOTE(ivar): we need to lock the observer here to prevent it
             # from reading empty or incomplete trees
             # REVISIT(ivar): this is NOT gonna work for multi AID. In general,
             # the whole K8S watcher cannot run as-is in a multi AID environment
-            with utils.get_rlock(lcon.AID_OBSERVER_LOCK):
+            with utils.get_rlock(lcon.AID_OBSERVER_LOCK), \
+                    self._lock_shards():
                 self._reset_trees()
                 self._renew_klient_watch()
 
                 self._version_by_type = {}
                 for typ in self._k8s_types_to_observe:
                     self._init_stream_for_type(typ)
-                self._persistence_loop(save_on_empty=True)
+                self._persistence_loop(save_on_empty=True, sync=True)
                 LOG.info("Trees initialized")
                 self._needs_init = False
+        else:
+            self._renew_klient_watch()
 
     @utils.rlock(lcon.K8S_WATCHER_TREE_LOCK)
     def _start_observers(self, types_to_observe):
         self._init_aim_k8s(types_to_observe)
+        self._check_time = time.time()
         for id, typ in enumerate(list(types_to_observe)):
             self._observe_thread_state[id] = dict(watch_stop=False)
             thd = utils.spawn_thread(
@@ -275,9 +346,14 @@ class K8sWatcher(object):
                     if my_state.get('watch_stop', False):
                         LOG.debug('Stopping %s objects thread', k8s_type.kind)
                         break
-                    ev_name = event.get('object',
-                                        {}).get('metadata',
-                                                {}).get('name')
+                    if (event.get('type', '').lower() == ACTION_ERROR and
+                            event.get('object', {}).get('code') == 410):
+                        raise K8SResourceVersionExpired()
+                    metadata = event.get('object', {}).get('metadata', {})
+                    ev_name = metadata.get('name')
+                    if id is not None and metadata.get('resourceVersion'):
+                        self._version_by_type[k8s_type] = metadata[
+                            'resourceVersion']
                     if ev_filt(event):
                         LOG.debug("Received Kubernetes event for %s %s",
                                   k8s_type.kind, ev_name or event)
@@ -289,58 +365,174 @@ class K8sWatcher(object):
                 LOG.debug('Observe %s objects caught exception: %s',
                           k8s_type.kind, e)
                 LOG.debug(traceback.format_exc())
+                if str(getattr(e, 'status', '')) == '410':
+                    e = K8SResourceVersionExpired()
                 my_state['watch_exception'] = e
         LOG.debug('End observing %s objects', k8s_type.kind)
 
+    @contextlib.contextmanager
+    def _lock_shards(self):
+        locks = [utils.generate_rlock(x.lock_name) for x in self.shards]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
     def _reset_trees(self):
         self.trees = None
-        self.affected_tenants = set()
         try:
             while self.q.get_nowait():
                 pass
         except queue.Empty:
             pass
-        self.tt_mgr.delete_all(self.ctx)
+        for shard in self.shards:
+            shard.reset()
+            shard.affected_tenants = set()
+        self._owners = {}
+        # Stored trees are replaced only where they differ from the rebuilt
+        # ones
         self.trees = {}
 
+    def _get_shard(self, root):
+        return self.shards[hash(root) % len(self.shards)]
+
+    def _dispatch_event(self, event):
+        event = self._parse_event(event)
+        if event:
+            root = self.tt_maker.get_root_key(event['resource'])
+            self._get_shard(root).put(event)
+
     @utils.retry_loop(BUILDER_LOOP_MAX_WAIT, BUILDER_LOOP_MAX_RETRIES,
-                      'K8S observer thread')
+                      'K8S dispatcher thread')
     def persistence_loop(self):
-        self._persistence_loop()
+        self._dispatch_loop()
+
+    def _dispatch_loop(self):
+        if self._stop:
+            LOG.info("Quitting k8s dispatcher loop")
+            raise utils.ThreadExit()
+        event = self._get_event(WARM_BUILD_TIME)
+        if event:
+            # Trees can't be reset while the event is being dispatched
+            with utils.get_rlock(lcon.K8S_WATCHER_TREE_LOCK):
+                self._dispatch_event(event)
+
+    @utils.retry_loop(BUILDER_LOOP_MAX_WAIT, BUILDER_LOOP_MAX_RETRIES,
+                      'K8S builder thread')
+    def builder_loop(self, shard):
+        self._builder_loop(shard)
+
+    def _builder_loop(self, shard):
+        if self._stop:
+            LOG.info("Quitting k8s builder loop %s", shard.id)
+            raise utils.ThreadExit()
+        generation, event = shard.get_event(WARM_BUILD_TIME)
+        if not event:
+            return
+        with utils.get_rlock(shard.lock_name):
+            # Batch the events received within the flush interval, and save
+            # the affected trees once
+            flush_time = time.time() + self.flush_interval
+            processed = 0
+            while event:
+                # The trees might have been reset after the event was
+                # dequeued
+                if generation == shard.generation:
+                    shard.affected_tenants |= self._process_parsed_event(
+                        event)
+                processed += 1
+                remaining = flush_time - time.time()
+                if processed >= self.flush_size or remaining <= 0:
+                    break
+                generation, event = shard.get_event(remaining)
+            self._flush_shard(shard)
 
     @utils.rlock(lcon.K8S_WATCHER_TREE_LOCK)
     def _persistence_loop(self, save_on_empty=False,
-                          warmup_wait=WARM_BUILD_TIME):
+                          warmup_wait=WARM_BUILD_TIME, sync=False):
+        """Apply all the pending events and save the affected trees
+
+        Used when the trees are built, it doesn't rely on the builders.
+        With sync, the stored trees that differ from the in-memory ones are
+        saved, and the ones that don't exist anymore are removed.
+        """
         if self._stop:
             LOG.info("Quitting k8s builder loop")
             raise utils.ThreadExit()
-        first_event_time = None
-        affected_tenants = set(self.affected_tenants)
-        squash_time = warmup_wait if not save_on_empty else float('inf')
-        while squash_time > 0:
+        while True:
             event = self._get_event(warmup_wait)
-            if not first_event_time:
-                first_event_time = time.time()
-            if not save_on_empty:
-                squash_time = (first_event_time + warmup_wait -
-                               time.time())
-            if event:
-                LOG.debug('Got save event from queue')
-                affected_tenants |= self._process_event(event)
-            elif save_on_empty:
+            if not event:
                 break
-
+            self._dispatch_event(event)
+        for shard in self.shards:
+            with utils.get_rlock(shard.lock_name):
+                while True:
+                    try:
+                        _, event = shard.q.get_nowait()
+                    except queue.Empty:
+                        break
+                    shard.affected_tenants |= self._process_parsed_event(
+                        event)
+                if sync:
+                    shard.affected_tenants = set()
+        if sync:
+            self._sync_trees()
+        for shard in self.shards:
+            with utils.get_rlock(shard.lock_name):
+                self._flush_shard(shard)
+
+    def _sync_trees(self):
+        tree_types = [(tree_manager.CONFIG_TREE, self.tt_builder.CONFIG),
+                      (tree_manager.OPERATIONAL_TREE, self.tt_builder.OPER),
+                      (tree_manager.MONITORED_TREE, self.tt_builder.MONITOR)]
+        roots = set()
+        for _, name in tree_types:
+            roots |= set(x for x, tree in self.trees.get(name, {}).items()
+                         if tree.root_key)
+        stored = set(self.tt_mgr.get_roots(self.ctx))
+        changed = roots - stored
+        cleaned = set()
+        for tree_type, name in tree_types:
+            trees = self.trees.get(name, {})
+            root_map = {}
+            for root in roots & stored:
+                tree = trees.get(root)
+                if tree and tree.root_key:
+                    root_map[root] = tree.root_full_hash
+                elif root not in cleaned and any(
+                        x.root is not None for x in self.tt_mgr.find(
+                            self.ctx, tree=tree_type, root_rn=[root])):
+                    # Emptied trees can't be saved, clean the root and save
+                    # the others
+                    LOG.debug('Cleaning trees of root %s', root)
+                    self.tt_mgr.clean_by_root_rn(self.ctx, root)
+                    cleaned.add(root)
+                    changed.add(root)
+            changed |= set(self.tt_mgr.find_changed(self.ctx, root_map,
+                                                    tree=tree_type))
+        for root in stored - roots:
+            LOG.info('Removing trees of root %s', root)
+            self.tt_mgr.delete_by_root_rn(self.ctx, root)
+        LOG.info('Trees changed while not watching: %s', changed)
+        for root in changed:
+            self._get_shard(root).affected_tenants.add(root)
+
+    def _flush_shard(self, shard):
+        affected_tenants = shard.affected_tenants
         if affected_tenants:
             LOG.info('Saving trees for tenants: %s', affected_tenants)
+            shard.affected_tenants = set()
             try:
                 # Save procedure can be context switched at this point
                 self._save_trees(affected_tenants)
-                self.affected_tenants = set()
             except Exception:
                 LOG.error(traceback.format_exc())
                 # Put the affected tenants back to the list since we couldn't
                 # persist their trees.
-                self.affected_tenants |= affected_tenants
+                shard.affected_tenants |= affected_tenants
 
     def _parse_event(self, event):
         event_type = event['type']
@@ -361,20 +553,26 @@ class K8sWatcher(object):
             aim_res = self.ctx.store.make_resource(aim_klass, db_obj)
 
             if k8s_type.kind != kind:
-                # Event on an auxiliary object. Fetch the main object and
-                # treat this event as a modify event for the main object.
-                # Drop this event if main object cannot be retrieved.
-                id_attr = {k: getattr(aim_res, k)
-                           for k in aim_res.identity_attributes}
-                db_obj = self.ctx.store.query(k8s_type, aim_klass, **id_attr)
-                if not db_obj:
+                # Event on an auxiliary object. Treat this event as a modify
+                # event for the main object. Drop this event if main object
+                # is unknown and cannot be retrieved.
+                db_obj = self._get_owner(k8s_type, aim_klass, aim_res,
+                                         event_type, event_object)
+                if db_obj is None:
                     LOG.debug('Unable to fetch main %s object from event '
                               'on auxiliary object %s %s',
                               k8s_type.kind, kind,
                               event_object['metadata']['name'])
                     return
                 event_type = ACTION_MODIFIED
-                aim_res = self.ctx.store.make_resource(aim_klass, db_obj[0])
+                aim_res = self.ctx.store.make_resource(aim_klass, db_obj)
+            elif k8s_type.aux_objects:
+                key = self._get_owner_key(k8s_type, event_object)
+                if event_type.lower() == ACTION_DELETED:
+                    self._owners.pop(key, None)
+                else:
+                    self._owners.setdefault(key, {'aux': {}})['object'] = (
+                        db_obj)
 
             try:
                 aim_res._injected_aim_id = db_obj.aim_id
@@ -383,8 +581,50 @@ class K8sWatcher(object):
             return {'event_type': event_type,
                     'resource': aim_res}
 
+    def _get_owner_key(self, k8s_type, event_object):
+        metadata = event_object.get('metadata', {})
+        return (k8s_type.kind, metadata.get('namespace'),
+                metadata.get('name'))
+
+    def _get_owner(self, k8s_type, aim_klass, aim_res, event_type,
+                   event_object):
+        """Main object of an auxiliary one, updated with it
+
+        The main object is read from the store only when its last state is
+        not known from the watch events.
+        """
+        key = self._get_owner_key(k8s_type, event_object)
+        owner = self._owners.get(key)
+        if owner is None:
+            id_attr = {k: getattr(aim_res, k)
+                       for k in aim_res.identity_attributes}
+            db_objs = self.ctx.store.query(k8s_type, aim_klass, **id_attr)
+            if not db_objs:
+                return
+            self._owners[key] = {
+                'object': db_objs[0],
+                'aux': {a: getattr(db_objs[0], a)
+                        for a in k8s_type.aux_objects
+                        if hasattr(db_objs[0], a)}}
+            return db_objs[0]
+        for aux_attr, aux_kls in k8s_type.aux_objects.items():
+            if aux_kls.kind == event_object.get('kind'):
+                if event_type.lower() == ACTION_DELETED:
+                    owner['aux'].pop(aux_attr, None)
+                else:
+                    aux_obj = aux_kls()
+                    aux_obj.update(event_object)
+                    owner['aux'][aux_attr] = aux_obj
+        db_obj = k8s_type()
+        db_obj.update(owner['object'])
+        for aux_attr, aux_obj in owner['aux'].items():
+            setattr(db_obj, aux_attr, aux_obj)
+        return db_obj
+
     def _process_event(self, event):
-        event = self._parse_event(event)
+        return self._process_parsed_event(self._parse_event(event))
+
+    def _process_parsed_event(self, event):
         affected_tenants = set()
         if not event:
             return affected_tenants
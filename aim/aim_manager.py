@@ -156,38 +156,56 @@ class AimManager(object):
         self._validate_resource_class(resource)
         with context.store.begin(subtransactions=True):
             old_db_obj = None
-            old_monitored = None
-            new_monitored = None
             if overwrite:
                 old_db_obj = self._query_db_obj(context.store, resource)
-                if old_db_obj:
-                    old_monitored = getattr(old_db_obj, 'monitored', None)
-                    new_monitored = getattr(resource, 'monitored', None)
-                    if (fix_ownership and old_monitored is not None and
-                            old_monitored != new_monitored):
-                        raise exc.InvalidMonitoredStateUpdate(object=resource)
-                    attr_val = context.store.extract_attributes(resource,
-                                                                "other")
-                    old_resource = self._make_resource(context, resource,
-                                                       old_db_obj)
-                    if old_resource.user_equal(resource):
-                        # No need to update. Return old_resource for
-                        # updated DB attributes
-                        return old_resource
-                    context.store.from_attr(old_db_obj, type(resource),
-                                            attr_val)
-            db_obj = old_db_obj or context.store.make_db_obj(resource)
-            context.store.add(db_obj)
-            if self._should_set_pending(old_db_obj, old_monitored,
-                                        new_monitored):
-                # NOTE(ivar): we shouldn't change status in the AIM manager
-                # as this goes against the "AIM as a schema" principles.
-                # However, we need to do this at least for cases where
-                # we take ownership of the objects, which should be removed
-                # soon as it's causing most of our bugs.
-                self.set_resource_sync_pending(context, resource)
+            old_resource = self._create_db_obj(context, resource, old_db_obj,
+                                               fix_ownership=fix_ownership)
+            if old_resource is not None:
+                # No need to update. Return old_resource for updated DB
+                # attributes
+                return old_resource
             return self.get(context, resource)
 
+    def create_with_db_obj(self, context, resource, old_db_obj=None):
+        """Persist AIM resource, given its current DB object if any.
+
+        Same as create with 'overwrite', for callers that already
+        retrieved the DB object of the resource within their transaction.
+        The DB is not queried, and therefore pending changes are not
+        flushed, unless the ownership of a monitored object is taken.
+        Returns True if the resource was written, False if it was
+        already up to date.
+        """
+        self._validate_resource_class(resource)
+        return self._create_db_obj(context, resource, old_db_obj) is None
+
+    def _create_db_obj(self, context, resource, old_db_obj,
+                       fix_ownership=False):
+        # Returns the existing resource when no update is needed
+        old_monitored = None
+        new_monitored = None
+        if old_db_obj:
+            old_monitored = getattr(old_db_obj, 'monitored', None)
+            new_monitored = getattr(resource, 'monitored', None)
+            if (fix_ownership and old_monitored is not None and
+                    old_monitored != new_monitored):
+                raise exc.InvalidMonitoredStateUpdate(object=resource)
+            attr_val = context.store.extract_attributes(resource, "other")
+            old_resource = self._make_resource(context, resource, old_db_obj)
+            if old_resource.user_equal(resource):
+                return old_resource
+            context.store.from_attr(old_db_obj, type(resource), attr_val)
+        db_obj = old_db_obj or context.store.make_db_obj(resource)
+        context.store.add(db_obj)
+        if self._should_set_pending(old_db_obj, old_monitored,
+                                    new_monitored):
+            # NOTE(ivar): we shouldn't change status in the AIM manager
+            # as this goes against the "AIM as a schema" principles.
+            # However, we need to do this at least for cases where
+            # we take ownership of the objects, which should be removed
+            # soon as it's causing most of our bugs.
+            self.set_resource_sync_pending(context, resource)
+
     @utils.log
     def update(self, context, resource, fix_ownership=False,
                force_update=False, **update_attr_val):
@@ -251,19 +269,10 @@ class AimManager(object):
         with context.store.begin(subtransactions=True):
             db_obj = self._query_db_obj(context.store, resource)
             if db_obj:
-                if isinstance(resource, api_res.AciResourceBase):
-                    status = self.get_status(
-                        context, resource, create_if_absent=False)
-                    if status and getattr(
-                            db_obj, 'monitored', None) and not force:
-                        if status.sync_status == status.SYNC_PENDING:
-                            # Cannot delete monitored objects if sync status
-                            # is pending, or ownership flip might fail
-                            raise exc.InvalidMonitoredObjectDelete(
-                                object=resource)
-                    if status:
-                        self.delete(context, status, force=force)
-                context.store.delete(db_obj)
+                self._delete_db_obj(
+                    context, resource, db_obj,
+                    self._query_status_db_obj(context, resource, db_obj),
+                    force=force)
             # When cascade is specified, delete the object's subtree even if
             # the resource itself doesn't exist.
             if cascade:
@@ -271,6 +280,46 @@ class AimManager(object):
                     # Delete without cascade
                     self.delete(context, child_res, force=force)
 
+    def delete_with_db_obj(self, context, resource, db_obj, status_db_obj,
+                           force=False):
+        """Delete AIM resource from the database, given its DB object.
+
+        Same as delete without cascade, for callers that already retrieved
+        the DB objects of the resource and of its status (None when it has
+        none) within their transaction. The status is deleted as well,
+        without flushing the pending changes.
+        """
+        self._validate_resource_class(resource)
+        with context.store.no_autoflush():
+            self._delete_db_obj(context, resource, db_obj, status_db_obj,
+                                force=force)
+
+    def _query_status_db_obj(self, context, resource, db_obj):
+        if not isinstance(resource, api_res.AciResourceBase):
+            return None
+        res_id = getattr(db_obj, 'aim_id', None)
+        if res_id is None:
+            return None
+        return self._query_db_obj(
+            context.store, api_status.AciStatus(
+                resource_type=type(resource).__name__, resource_id=res_id,
+                resource_root=resource.root))
+
+    def _delete_db_obj(self, context, resource, db_obj, status_db_obj,
+                       force=False):
+        if isinstance(resource, api_res.AciResourceBase):
+            if (status_db_obj and getattr(db_obj, 'monitored', None) and
+                    not force):
+                status = context.store.make_resource(api_status.AciStatus,
+                                                     status_db_obj)
+                if status.sync_status == status.SYNC_PENDING:
+                    # Cannot delete monitored objects if sync status
+                    # is pending, or ownership flip might fail
+                    raise exc.InvalidMonitoredObjectDelete(object=resource)
+            if status_db_obj:
+                context.store.delete(status_db_obj)
+        context.store.delete(db_obj)
+
     @utils.log
     def delete_all(self, context, resource_class, for_update=False, **kwargs):
         """Delete many AIM resources from the database that match criteria.
@@ -328,7 +377,7 @@ class AimManager(object):
         self._validate_resource_class(resource_class)
         attr_val = {k: v for k, v in kwargs.items()
                     if k in resource_class.attributes() +
-                    ['in_', 'notin_', 'order_by']}
+                    ['in_', 'notin_', 'order_by', 'limit', 'offset']}
         result = []
         for obj in self._query_db(context.store, resource_class,
                                   for_update=for_update, **attr_val):
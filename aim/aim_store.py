@@ -13,13 +13,15 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 from contextlib import contextmanager
 import copy
 from oslo_log import log as logging
 import six
 from sqlalchemy import and_
 from sqlalchemy import event as sa_event
-from sqlalchemy import or_
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy import tuple_
 from sqlalchemy.sql.expression import func
 
 from aim.agent.aid.event_services import rpc
@@ -29,6 +31,7 @@ from aim.api import resource as api_res
 from aim.api import service_graph as api_service_graph
 from aim.api import status as api_status
 from aim.api import tree as api_tree
+from aim.common import utils
 from aim.db import agent_model
 from aim.db import config_model
 from aim.db import hashtree_db_listener as ht_db_l
@@ -80,6 +83,11 @@ class AimStore(object):
         # default returns a no-op contextmanager
         return _begin(**kwargs)
 
+    def no_autoflush(self):
+        # Prevent queries from flushing the pending changes, if applicable.
+        # Should return a contextmanager object
+        return _begin()
+
     def expunge_all(self):
         # Expunge transaction artifacts if supported
         pass
@@ -100,8 +108,10 @@ class AimStore(object):
         pass
 
     def query(self, db_obj_type, resource_klass, in_=None, notin_=None,
-              order_by=None, lock_update=False, **filters):
-        # Return list of objects that match specified criteria
+              order_by=None, lock_update=False, limit=None, offset=None,
+              **filters):
+        # Return list of objects that match specified criteria. When limit
+        # or offset are set, objects are sorted consistently across calls
         pass
 
     def count(self, db_obj_type, resource_klass, in_=None, notin_=None,
@@ -136,6 +146,9 @@ class AimStore(object):
     def query_statuses(self, resources):
         raise NotImplementedError('query_statuses not implemented')
 
+    def query_aim_ids(self, resources):
+        raise NotImplementedError('query_aim_ids not implemented')
+
     def register_before_session_flush_callback(self, name, func):
         """Register callback for update to AIM objects.
 
@@ -304,6 +317,10 @@ class SqlAlchemyStore(AimStore):
     for k, v in db_model_map.items():
         resource_map[v] = k
 
+    # Max number of values bound in a single IN clause, this keeps the
+    # statements small and below the parameter limits of the backends.
+    in_query_chunk_size = 500
+
     def __init__(self, db_session):
         super(SqlAlchemyStore, self).__init__()
         self.db_session = db_session
@@ -334,6 +351,9 @@ class SqlAlchemyStore(AimStore):
     def begin(self, **kwargs):
         return self.db_session.begin(subtransactions=True)
 
+    def no_autoflush(self):
+        return self.db_session.no_autoflush
+
     def resource_to_db_type(self, resource_klass):
         return self.db_model_map.get(resource_klass)
 
@@ -354,7 +374,8 @@ class SqlAlchemyStore(AimStore):
             self.add(obj)
 
     def _query(self, db_obj_type, resource_klass, in_=None, notin_=None,
-               order_by=None, lock_update=False, **filters):
+               order_by=None, lock_update=False, limit=None, offset=None,
+               **filters):
         query = self.db_session.query(db_obj_type)
         for k, v in (in_ or {}).items():
             query = query.filter(getattr(db_obj_type, k).in_(v))
@@ -369,38 +390,102 @@ class SqlAlchemyStore(AimStore):
             else:
                 args = [getattr(db_obj_type, order_by)]
             query = query.order_by(*args)
+        elif limit is not None or offset:
+            query = query.order_by(*sa_inspect(db_obj_type).primary_key)
+        if offset:
+            query = query.offset(offset)
+        if limit is not None:
+            query = query.limit(limit)
         if lock_update:
             query = query.with_lockmode('update')
         return query
 
+    def _identity_filter(self, db_klass, resource_klass, identities):
+        # Build an IN clause on the identity columns of a DB model. Single
+        # column identities use a plain IN, composite ones a tuple IN.
+        columns = [getattr(db_klass, k)
+                   for k in resource_klass.identity_attributes]
+        if len(columns) == 1:
+            return columns[0].in_([x[0] for x in identities])
+        return tuple_(*columns).in_(identities)
+
+    def _group_identities(self, resources):
+        # Group the identity tuples of the given resources by resource
+        # class, dropping duplicates but preserving the input order.
+        by_klass = collections.OrderedDict()
+        for res in resources:
+            ids = by_klass.setdefault(type(res), collections.OrderedDict())
+            ids[tuple(getattr(res, k)
+                      for k in res.identity_attributes)] = None
+        return by_klass
+
+    def query_aim_ids(self, resources):
+        """Resolve the aim_id of many resources at once.
+
+        Returns a dictionary keyed by (resource class, identity tuple).
+        Resources that don't exist in the DB are omitted from the result.
+        """
+        result = {}
+        for klass, identities in self._group_identities(resources).items():
+            db_klass = self.db_model_map[klass]
+            if not hasattr(db_klass, 'aim_id'):
+                continue
+            columns = [getattr(db_klass, k)
+                       for k in klass.identity_attributes]
+            for chunk in utils.chunks(identities, self.in_query_chunk_size):
+                query = self.db_session.query(db_klass.aim_id, *columns)
+                if columns:
+                    query = query.filter(
+                        self._identity_filter(db_klass, klass, chunk))
+                for row in query.all():
+                    result[(klass, tuple(row[1:]))] = row[0]
+        return result
+
     def query_statuses(self, resources):
         if not resources:
             return []
-        db_ids_by_type = {}
+        status_klass = status_model.Status
+        # Resources that already carry their aim_id can be looked up
+        # directly, the others are joined with their own table.
+        known_ids = collections.OrderedDict()
+        unknown = []
         for res in resources:
-            db_ids_by_type.setdefault(self.db_model_map[type(res)], []).append(
-                self.extract_attributes(res, "id"))
-        query = self.db_session.query(status_model.Status)
-        in_query = []
-        for klass in db_ids_by_type:
-            subq = self.db_session.query(getattr(klass, 'aim_id'))
-            subq = subq.filter(
-                or_(*[
-                    and_(*[getattr(klass, k) == v for k, v in ids.items()])
-                    for ids in db_ids_by_type[klass]]))
-            in_query.append(subq)
-        query = query.filter(or_(*[status_model.Status.resource_id.in_(sub)
-                                   for sub in in_query]))
-        db_statuses = query.all()
+            aim_id = getattr(res, '_injected_aim_id',
+                             getattr(res, '_aim_id', None))
+            if aim_id:
+                known_ids.setdefault(type(res).__name__, set()).add(aim_id)
+            else:
+                unknown.append(res)
+        db_statuses = {}
+        for res_type, aim_ids in known_ids.items():
+            for chunk in utils.chunks(aim_ids, self.in_query_chunk_size):
+                query = self.db_session.query(status_klass).filter(
+                    status_klass.resource_type == res_type,
+                    status_klass.resource_id.in_(chunk))
+                for db_obj in query.all():
+                    db_statuses[db_obj.id] = db_obj
+        for klass, identities in self._group_identities(unknown).items():
+            db_klass = self.db_model_map[klass]
+            for chunk in utils.chunks(identities, self.in_query_chunk_size):
+                query = self.db_session.query(status_klass).join(
+                    db_klass, and_(
+                        status_klass.resource_id == db_klass.aim_id,
+                        status_klass.resource_type == klass.__name__))
+                if klass.identity_attributes:
+                    query = query.filter(
+                        self._identity_filter(db_klass, klass, chunk))
+                for db_obj in query.all():
+                    db_statuses[db_obj.id] = db_obj
         return [self.make_resource(api_status.AciStatus, x)
-                for x in db_statuses]
+                for x in db_statuses.values()]
 
     def query(self, db_obj_type, resource_klass, in_=None, notin_=None,
-              order_by=None, lock_update=False, **filters):
+              order_by=None, lock_update=False, limit=None, offset=None,
+              **filters):
 
         return self._query(db_obj_type, resource_klass, in_=in_, notin_=notin_,
                            order_by=order_by, lock_update=lock_update,
-                           **filters).all()
+                           limit=limit, offset=offset, **filters).all()
 
     def count(self, db_obj_type, resource_klass, in_=None, notin_=None,
               **filters):
@@ -665,7 +750,8 @@ class K8sStore(AimStore):
         self._post_delete(deleted)
 
     def query(self, db_obj_type, resource_klass, in_=None, notin_=None,
-              order_by=None, lock_update=False, **filters):
+              order_by=None, lock_update=False, limit=None, offset=None,
+              **filters):
         def_ns = (self.namespace
                   if db_obj_type == api_v1.AciContainersObject else None)
 
@@ -745,6 +831,12 @@ class K8sStore(AimStore):
                 order_by = [order_by]
             result = sorted(result,
                             key=lambda x: tuple([x[k] for k in order_by]))
+        elif limit is not None or offset:
+            result = sorted(result, key=lambda x: x.aim_id)
+        if limit is not None or offset:
+            offset = offset or 0
+            result = result[offset:(offset + limit
+                                    if limit is not None else None)]
         return result
 
     def count(self, db_obj_type, resource_klass, in_=None, notin_=None,
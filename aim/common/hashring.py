@@ -141,15 +141,80 @@ class ConsistentHashRing(object):
                 except ValueError:
                     pass
 
+    def _get_index(self, key):
+        index = bisect.bisect(self._ring, Star(self._hash(key)))
+        if index == len(self._ring):
+            index = 0
+        return index
+
+    def _get_weight(self, node):
+        weight = self._nodes[node]
+        return weight if weight is not None else self._default_weight
+
+    def walk_key(self, key):
+        """Walk the ring starting from a key position
+
+        :param key: identifier
+        :return: iterator over all the distinct nodes of the ring, in the
+        same order assign_key uses for replicas.
+        """
+        index = self._get_index(key)
+        seen = set()
+        for x in range(len(self._ring)):
+            node = self._ring[index - x].node
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == len(self._nodes):
+                    return
+
+    def assign_weighted_keys(self, keys, balance_factor=1.25):
+        """Assign weighted keys to the ring with bounded load
+
+        Each key goes to the first node of its ring walk that can take it
+        without exceeding balance_factor times its fair share of the total
+        key weight, the fair share of a node being proportional to the node
+        weight. Heavier keys are placed first. When no node can fit a key,
+        the one with the lowest relative load is chosen.
+        Like assign_key, results are reproducible by different instances
+        given the same nodes and keys, and only a few keys move when either
+        changes.
+
+        :param keys: dictionary with the key identifier as key and its
+        weight as value.
+        :param balance_factor: maximum load of a node relative to its fair
+        share, must be greater or equal than 1.
+        :return: dictionary with the node ID as key and the list of its
+        assigned keys as value.
+        """
+        result = dict((node, []) for node in self._nodes)
+        if not self._nodes:
+            return result
+        node_weights = dict((node, self._get_weight(node))
+                            for node in self._nodes)
+        total_node_weight = sum(node_weights.values())
+        total_weight = sum(keys.values())
+        loads = dict((node, 0) for node in self._nodes)
+        for key in sorted(keys, key=lambda x: (-keys[x], x)):
+            weight = keys[key]
+            for node in self.walk_key(key):
+                if ((loads[node] + weight) * total_node_weight <=
+                        balance_factor * total_weight * node_weights[node]):
+                    break
+            else:
+                node = min(self._nodes, key=lambda x: (
+                    float(loads[x] + weight) / node_weights[x], x))
+            loads[node] += weight
+            result[node].append(key)
+        return result
+
     def assign_key(self, key):
         """Assign a key to the ring
 
         :param key: identifier
         :return: list of nodes that serve this key
         """
-        index = bisect.bisect(self._ring, Star(self._hash(key)))
-        if index == len(self._ring):
-            index = 0
+        index = self._get_index(key)
         result = [self._ring[index].node]
         # Replicate across the ring in anti clockwise motion
         for x in range(len(self._ring)):
@@ -160,5 +225,9 @@ class ConsistentHashRing(object):
                 result.append(self._ring[index - x].node)
         return result
 
+    @property
+    def nodes(self):
+        return dict(self._nodes)
+
     def __len__(self):
         return len(self._nodes)
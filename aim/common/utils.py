@@ -24,6 +24,7 @@ import oslo_serialization
 import random
 import re
 import six
+from six.moves import queue as Queue
 import threading
 import time
 import traceback
@@ -303,6 +304,48 @@ def spawn_thread(target, *args, **kwargs):
     return thd
 
 
+def run_in_parallel(tasks, concurrency, semaphore=None):
+    """Run callables on up to concurrency threads and wait for them
+
+    :param tasks: list of callables with no arguments
+    :param concurrency: max number of tasks running at the same time
+    :param semaphore: optional semaphore held while running each task, to
+    bound the concurrency across callers
+    :return: list of the results, in the same order as the tasks. The
+    first exception raised by a task is re-raised once all are done
+    """
+    results = [None] * len(tasks)
+    errors = []
+    pending = Queue.Queue()
+    for i in range(len(tasks)):
+        pending.put(i)
+
+    def worker():
+        while True:
+            try:
+                i = pending.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                if semaphore:
+                    with semaphore:
+                        results[i] = tasks[i]()
+                else:
+                    results[i] = tasks[i]()
+            except Exception as e:
+                errors.append(e)
+
+    threads = [spawn_thread(worker)
+               for _ in range(min(concurrency, len(tasks)) - 1)]
+    # The caller takes part in the work as well
+    worker()
+    for thd in threads:
+        thd.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
 # Key/Values will be garbage collected once al references are lost
 all_locks = weakref.WeakValueDictionary()
 _master_lock = threading.Lock()
@@ -386,3 +429,15 @@ def schedule_next_event(interval, deviation):
 
 def get_time():
     return time.time()
+
+
+def chunks(iterable, size):
+    """Yield successive lists of at most 'size' items from 'iterable'."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
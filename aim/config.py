@@ -15,6 +15,7 @@
 
 import copy
 import socket
+import threading
 import time
 import traceback
 
@@ -46,15 +47,47 @@ agent_opts = [
                        "an event is received before starting the "
                        "reconciliation. This will squash similar events "
                        "together")),
+    cfg.FloatOpt('agent_event_squash_max_time', default=2.0,
+                 help=("Maximum number of seconds AID keeps squashing a "
+                       "burst of events, as long as each of them arrives "
+                       "within agent_event_squash_time from the previous "
+                       "one. The actual limit adapts to the duration of the "
+                       "recent reconciliation cycles, and is never lower "
+                       "than agent_event_squash_time.")),
+    cfg.FloatOpt('agent_full_sweep_interval', default=60,
+                 help=("Events received by AID carry the roots they concern, "
+                       "so that only those are observed. Every this many "
+                       "seconds, all the served roots are observed anyway.")),
     cfg.IntOpt('agent_report_interval', default=60,
                help=("Number of seconds after which an agent reports his "
                      "state")),
     cfg.IntOpt('agent_deadlock_time', default=300,
                help=("Number of seconds agent can be non-responsive before "
                      "it will get restarted.")),
+    cfg.IntOpt('agent_capacity', default=1,
+               help=("Relative capacity of an AID agent, used to weight "
+                     "tenant assignment among agents. An agent with "
+                     "capacity 2 is assigned twice the amount of objects "
+                     "of an agent with capacity 1. It can be set per "
+                     "host.")),
+    cfg.FloatOpt('tenant_balance_factor', default=1.25,
+                 help=("Maximum amount of objects assigned to an AID agent "
+                       "relative to its fair share, tenants are weighted by "
+                       "the size of their configuration tree. Values closer "
+                       "to 1 balance agents more evenly but move more "
+                       "tenants when the load changes. Set to 0 to assign "
+                       "tenants by name hash only.")),
     cfg.IntOpt('config_polling_interval', default=30,
                help=("Number of seconds the config subscriber thread needs "
                      "to wait between checks.")),
+    cfg.FloatOpt('config_cache_ttl', default=5,
+                 help=("Number of seconds a configuration option read from "
+                       "the database is cached by the process before being "
+                       "read again. Changes made through this process "
+                       "invalidate the cache immediately, changes made by "
+                       "other processes (eg. aimctl or other agents) are "
+                       "seen after at most this many seconds. Set to 0 to "
+                       "disable caching.")),
     # Setting to False until further testing is done
     cfg.BoolOpt('poll_config', default=False,
                 help=("Check whether to run the configuration poller or "
@@ -73,6 +106,80 @@ agent_opts = [
                     "the orchestrator this AID agent is serving"),
     cfg.FloatOpt('aci_tenant_polling_yield', default=0.2,
                  help="how long the ACITenant yield to other processed"),
+    cfg.FloatOpt('aci_event_coalesce_window', default=0,
+                 help=("Number of seconds an ACI tenant accumulates websocket "
+                       "events before updating its trees. Events received "
+                       "for the same DN within the window are merged into "
+                       "their net effect, so that bursts of changes on the "
+                       "same objects are processed once. 0 processes events "
+                       "as soon as they are received.")),
+    cfg.StrOpt('aci_tenant_snapshot_dir', default='',
+               help=("Directory where AID periodically stores a snapshot of "
+                     "the ACI state of each tenant it serves. On restart, "
+                     "tenants start from their snapshot and are diffed "
+                     "right away, but no change is pushed or deleted until "
+                     "their full state is retrieved from APIC. Empty to "
+                     "disable snapshots.")),
+    cfg.IntOpt('aci_tenant_snapshot_interval', default=60,
+               help=("Minimum number of seconds between two snapshots of "
+                     "the same tenant.")),
+    cfg.IntOpt('aci_tenant_snapshot_max_age', default=600,
+               help=("Snapshots older than this number of seconds are "
+                     "ignored on restart.")),
+    cfg.IntOpt('aci_tenant_max_concurrent_resets', default=4,
+               help=("Maximum number of ACI tenants that AID resubscribes "
+                     "at the same time for their periodic reset. Resets "
+                     "above this limit are deferred.")),
+    cfg.IntOpt('aci_tenant_max_resets_per_minute', default=30,
+               help=("Maximum number of ACI tenant resets AID performs per "
+                     "minute. Periodic resets above this rate are "
+                     "deferred, the ones fixing a divergence are not, but "
+                     "still count against it.")),
+    cfg.StrOpt('aci_tenant_execution_model', default='thread',
+               choices=['thread', 'pool'],
+               help=("How ACI tenants are served by AID. With 'thread' each "
+                     "tenant polls its websocket events in a dedicated "
+                     "thread. With 'pool' a dispatcher hands the tenants "
+                     "that have pending events or pushes to a bounded set "
+                     "of workers.")),
+    cfg.IntOpt('aci_tenant_workers', default=8,
+               help=("Number of worker threads serving ACI tenants when "
+                     "aci_tenant_execution_model is 'pool'.")),
+    cfg.IntOpt('apic_push_batch_size', default=100,
+               help=("Maximum number of objects AID posts to APIC in a "
+                     "single request. Objects sharing the same parent are "
+                     "posted together in a hierarchical request, and "
+                     "posted one by one if that fails. 1 disables "
+                     "batching.")),
+    cfg.IntOpt('apic_push_batch_max_bytes', default=1048576,
+               help=("Maximum size in bytes of a batched request posted "
+                     "to APIC.")),
+    cfg.IntOpt('aci_tenant_push_concurrency', default=4,
+               help=("Maximum number of independent requests a single ACI "
+                     "tenant posts to APIC concurrently when pushing its "
+                     "changes.")),
+    cfg.IntOpt('apic_push_concurrency', default=32,
+               help=("Maximum number of push requests posted to APIC "
+                     "concurrently by all the ACI tenants served by AID. "
+                     "The APIC HTTP session keeps as many connections "
+                     "alive.")),
+    cfg.StrOpt('apic_class_cache_file',
+               default='/var/lib/aim/apic_classes.json',
+               help=("File where AID stores the APIC classes it found to be "
+                     "supported, along with the APIC version they were "
+                     "probed on. On startup the file is used instead of "
+                     "probing APIC again, unless the APIC version changed. "
+                     "Empty to always probe.")),
+    cfg.IntOpt('apic_class_probe_concurrency', default=8,
+               help=("Number of requests AID sends to APIC at the same time "
+                     "when probing the supported classes.")),
+    cfg.IntOpt('websocket_sessions', default=1,
+               help=("Number of websocket sessions AID opens towards APIC. "
+                     "ACI tenants are consistently spread across the "
+                     "sessions, each refreshing its subscriptions and "
+                     "reconnecting independently. On reconnection, only "
+                     "the tenants of the affected session are "
+                     "resubscribed.")),
     cfg.FloatOpt('websocket_monitor_sleep', default=10,
                  help="how long the ACITenant yield to other processed"),
     cfg.IntOpt('max_operation_retry', default=5,
@@ -81,6 +188,18 @@ agent_opts = [
     cfg.IntOpt('retry_cooldown', default=3,
                help="How many seconds AID needs to wait between the same "
                     "failure before considering it a new tentative"),
+    cfg.FloatOpt('reconcile_time_budget', default=0,
+                 help=("Maximum number of seconds each AID universe spends "
+                       "reconciling roots in a single cycle. Roots are "
+                       "reconciled by priority, and the ones left out are "
+                       "carried over to the next cycle. At least one root "
+                       "is reconciled per cycle. 0 means no limit.")),
+    cfg.FloatOpt('agent_event_notification_window', default=0.2,
+                 help=("Seconds during which the AID notifications sent by "
+                       "this process are coalesced. The first notification "
+                       "after an idle period is sent right away, the "
+                       "following ones are merged and sent once when the "
+                       "window expires. 0 disables coalescing.")),
     cfg.StrOpt('unix_socket_path', default='/run/aid/events/aid.sock',
                help="Path to the unix socket used for notifications"),
     cfg.BoolOpt('recovery_restart', default=True,
@@ -143,7 +262,17 @@ k8s_options = [
                     "AIM installation."),
     cfg.StrOpt('k8s_controller', default='kube-cluster',
                help="Name of controller in Kubernetes VMM domain used "
-                    "by this AIM installation.")
+                    "by this AIM installation."),
+    cfg.IntOpt('k8s_watcher_workers', default=4,
+               help="Number of threads building and saving the trees of "
+                    "the Kubernetes watcher. Each tree root is always "
+                    "handled by the same thread."),
+    cfg.FloatOpt('k8s_watcher_flush_interval', default=0.2,
+                 help="Seconds each Kubernetes watcher thread collects "
+                      "events before saving the trees they changed."),
+    cfg.IntOpt('k8s_watcher_flush_size', default=1000,
+               help="Maximum number of events each Kubernetes watcher "
+                    "thread applies before saving the trees they changed.")
 ]
 
 server_options = [
@@ -242,6 +371,7 @@ class ConfigManager(object):
     def to_db(self, cfg_obj, host=None, context=None):
         configs = self._to_query_format(cfg_obj, host=host)
         self.db.update_bulk(context or self.context, configs)
+        OPTION_CACHE.invalidate()
 
     def replace_all(self, cfg_obj, host=None, context=None):
         # If not restricted by host, all the config will be deleted
@@ -249,42 +379,94 @@ class ConfigManager(object):
         LOG.info("Replacing existing configuration for host %s "
                  "with: %s" % (host, configs))
         self.db.replace_all(context or self.context, configs, host=host)
+        OPTION_CACHE.invalidate()
 
     def override(self, item, value, group='default', host=None, context=None):
         value = self._convert_value(value)
         self.db.update(context or self.context, group, item, value,
                        host=host or '')
+        OPTION_CACHE.invalidate()
+
+    def _validate_option(self, item, group):
+        if group not in self.map:
+            raise exc.UnsupportedAIMConfigGroup(group=group)
+        if item not in self.map[group]:
+            raise exc.UnsupportedAIMConfig(group=group, conf=item)
+
+    def _from_db_conf(self, item, group, host, db_conf):
+        # Convert the DB string value to the option type. A copy is returned
+        # so that cached entries are never modified by the callers.
+        db_conf = dict(db_conf)
+        obj = self.map[group][item]
+        value = db_conf['value']
+        if isinstance(obj, cfg.IntOpt):
+            db_conf['value'] = self._int_opt(value)
+        elif isinstance(obj, cfg.StrOpt):
+            db_conf['value'] = self._str_opt(value)
+        elif isinstance(obj, cfg.ListOpt):
+            db_conf['value'] = self._list_opt(value)
+        elif isinstance(obj, cfg.BoolOpt):
+            db_conf['value'] = self._bool_opt(value)
+        elif isinstance(obj, cfg.FloatOpt):
+            db_conf['value'] = self._float_opt(value)
+        else:
+            LOG.warn(
+                "Unsupported option type %s of item %s in group %s for "
+                "host %s. Returning None" % (type(obj), item, group, host))
+        return db_conf
 
-    def _get_option(self, item, group, host):
+    def _get_db_conf(self, item, group, host):
         # Get per host config if any, or default one
-        try:
-            if group not in self.map:
-                raise exc.UnsupportedAIMConfigGroup(group=group)
-            if item not in self.map[group]:
-                raise exc.UnsupportedAIMConfig(group=group, conf=item)
-
-            db_conf = self.db.get(self.context, group, item, host=host)
-            obj = self.map[group][item]
-            value = db_conf['value']
-            if isinstance(obj, cfg.IntOpt):
-                db_conf['value'] = self._int_opt(value)
-            elif isinstance(obj, cfg.StrOpt):
-                db_conf['value'] = self._str_opt(value)
-            elif isinstance(obj, cfg.ListOpt):
-                db_conf['value'] = self._list_opt(value)
-            elif isinstance(obj, cfg.BoolOpt):
-                db_conf['value'] = self._bool_opt(value)
-            elif isinstance(obj, cfg.FloatOpt):
-                db_conf['value'] = self._float_opt(value)
-            else:
-                LOG.warn(
-                    "Unsupported option type %s of item %s in group %s for "
-                    "host %s. Returning None" % (type(obj), item, group, host))
-            return db_conf
-        except exc.ConfigurationUndefined:
+        cached, found = OPTION_CACHE.get((group, item, host))
+        if found:
+            db_conf = cached
+        else:
+            epoch = OPTION_CACHE.epoch
+            try:
+                db_conf = self.db.get(self.context, group, item, host=host)
+            except exc.ConfigurationUndefined:
+                db_conf = None
+            # Missing host specific options are cached as well, so that
+            # the fallback to the default host doesn't hit the DB
+            OPTION_CACHE.set((group, item, host), db_conf, epoch)
+        if db_conf is None:
             if host == '':
-                raise
-            return self._get_option(item, group, '')
+                raise exc.ConfigurationUndefined(group=group, conf=item,
+                                                 host=host)
+            return self._get_db_conf(item, group, '')
+        return db_conf
+
+    def _get_option(self, item, group, host):
+        self._validate_option(item, group)
+        return self._from_db_conf(item, group, host,
+                                  self._get_db_conf(item, group, host))
+
+    def _get_options(self, options):
+        """Get multiple options with a single DB call.
+
+        :param options: iterable of (item, group, host) tuples
+        :return: dictionary in the form of {(item, group, host): option}.
+        Options that are undefined are omitted from the result.
+        """
+        options = set(options)
+        for item, group, _ in options:
+            self._validate_option(item, group)
+        keys = set()
+        for item, group, host in options:
+            keys.add((group, item, host))
+            keys.add((group, item, ''))
+        epoch = OPTION_CACHE.epoch
+        db_confs = self.db.get_bulk(self.context, keys)
+        for key in keys:
+            OPTION_CACHE.set(key, db_confs.get(key), epoch)
+        result = {}
+        for item, group, host in options:
+            db_conf = (db_confs.get((group, item, host)) or
+                       db_confs.get((group, item, '')))
+            if db_conf:
+                result[(item, group, host)] = self._from_db_conf(
+                    item, group, host, db_conf)
+        return result
 
     def _convert_value(self, value):
         if isinstance(value, list):
@@ -511,36 +693,44 @@ class ConfigSubscriber(utils.AIMThread):
             LOG.error(traceback.format_exc())
 
     def _poll_and_execute(self):
-        # prepare call
-        configs = {}
         # Copy the sub dictionary which might change during the iteration
+        subscriptions = []
         for group, items in copy.copy(self.subscription_map).items():
             for item, callbacks in copy.copy(items).items():
                 for call_id, values in copy.copy(callbacks).items():
-                    for host in values['hosts']:
-                        try:
-                            # TODO(ivar): optimize to make a single DB call
-                            # Get cached option or retrieve it from DB
-                            conf = configs.setdefault(
-                                (group, item), {}).setdefault(
-                                host,
-                                self.config_mgr._get_option(item, group, host))
-                            # Set the requesting host value, can be used to
-                            # resubscribe
-                            if conf['version'] != values['version']:
-                                # Configuration has changed, invoke callback
-                                # TODO(ivar): spawn a thread?
-                                values['callback'](conf)
-                                # Renew the subscription
-                                self.renew_subscription(
-                                    values['callback'], item, group,
-                                    conf['version'])
-                        except Exception as e:
-                            LOG.error(
-                                "An exception has occurred while "
-                                "executing callback %s: %s" % (
-                                    values['callback'], str(e)))
-                            LOG.error(traceback.format_exc())
+                    for host in copy.copy(values['hosts']):
+                        subscriptions.append((item, group, host, values))
+        if not subscriptions:
+            return
+        # Retrieve all the subscribed options at once
+        try:
+            configs = self.config_mgr._get_options(
+                (item, group, host) for item, group, host, _ in subscriptions)
+        except Exception as e:
+            LOG.error("An exception has occurred while retrieving "
+                      "subscribed options: %s" % str(e))
+            LOG.error(traceback.format_exc())
+            return
+        for item, group, host, values in subscriptions:
+            try:
+                conf = configs.get((item, group, host))
+                if conf is None:
+                    raise exc.ConfigurationUndefined(group=group, conf=item,
+                                                     host=host)
+                # Set the requesting host value, can be used to
+                # resubscribe
+                if conf['version'] != values['version']:
+                    # Configuration has changed, invoke callback
+                    # TODO(ivar): spawn a thread?
+                    values['callback'](conf)
+                    # Renew the subscription
+                    self.renew_subscription(
+                        values['callback'], item, group, conf['version'])
+            except Exception as e:
+                LOG.error(
+                    "An exception has occurred while executing callback "
+                    "%s: %s" % (values['callback'], str(e)))
+                LOG.error(traceback.format_exc())
 
     def _get_call_id(self, callback):
         return id(callback)
@@ -550,6 +740,54 @@ class ConfigSubscriber(utils.AIMThread):
         self._polling_interval = new_conf['value']
 
 
+class OptionCache(object):
+    """Process wide cache of the configuration DB entries.
+
+    Entries expire after 'config_cache_ttl' seconds. Every write done through
+    a ConfigManager bumps the cache epoch, which invalidates all the entries
+    and prevents readers that queried the DB before the write from storing
+    stale values.
+
+    Writes done by other processes are not tracked: they become visible
+    once the cached entries expire, so a process may read values that are
+    up to 'config_cache_ttl' seconds old. Subscriptions are not affected,
+    as they compare the option versions stored in the DB.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.epoch = 0
+
+    @property
+    def ttl(self):
+        return CONF.aim.config_cache_ttl
+
+    def get(self, key):
+        """Returns a (db_conf, found) tuple."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None, False
+        epoch, expiration, db_conf = entry
+        if epoch != self.epoch or expiration < utils.get_time():
+            return None, False
+        return db_conf, True
+
+    def set(self, key, db_conf, epoch):
+        ttl = self.ttl
+        if not ttl or ttl <= 0:
+            return
+        with self._lock:
+            if epoch == self.epoch:
+                self._entries[key] = (epoch, utils.get_time() + ttl, db_conf)
+
+    def invalidate(self):
+        with self._lock:
+            self.epoch += 1
+            self._entries = {}
+
+
+OPTION_CACHE = OptionCache()
 OPTION_SUBSCRIBER_MANAGER = None
 
 
@@ -98,6 +98,29 @@ class ConfigurationDBManager(object):
         return self._to_dict(
             self._get(context, group, key, host=host, **kwargs))
 
+    def get_bulk(self, context, configs):
+        """Get Bulk
+
+        :param context: AIM context
+        :param configs: iterable of (group, key, host) tuples
+        :return: dictionary in the form of {(group, key, host): config}.
+        Configurations that don't exist are omitted.
+        """
+        configs = set(configs)
+        if not configs:
+            return {}
+        groups, keys, hosts = [set(x) for x in zip(*configs)]
+        with context.store.begin(subtransactions=True):
+            # A single query returns a superset of what is needed
+            result = {}
+            for cfg in self.aim_mgr.find(
+                    context, resource.Configuration,
+                    in_={'group': list(groups), 'key': list(keys),
+                         'host': list(hosts)}):
+                if (cfg.group, cfg.key, cfg.host) in configs:
+                    result[(cfg.group, cfg.key, cfg.host)] = self._to_dict(cfg)
+            return result
+
     @utils.log
     def delete_all(self, context, group=None, host=None):
         # Can filter by group, host or both
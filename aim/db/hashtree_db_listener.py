@@ -190,6 +190,7 @@ class HashTreeDbListener(object):
         # REVISIT: Maybe we should just bail out if served_tenants is empty?
         if not served_tenants:
             served_tenants = ['dummy_tenant']
+        updated_roots = set()
         for served_tenant in served_tenants:
             if served_tenant != 'dummy_tenant':
                 kwargs['in_'] = {'root_rn': [served_tenant]}
@@ -207,6 +208,8 @@ class HashTreeDbListener(object):
                 # to concurrency issues. Remove when no longer needed.
                 if aim_cfg.CONF.aim.validate_config_trees:
                     self._validate_config_trees(ctx, log_by_root.keys())
+                updated_roots |= set(log_by_root) | resetting_roots
+        return updated_roots
 
     def _preprocess_logs(self, ctx, logs):
         resetting_roots = set()
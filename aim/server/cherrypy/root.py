@@ -13,13 +13,17 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import collections
 import copy
 import json
 import signal
 import sys
+import types
 
 import cherrypy
+from cherrypy._cpcompat import json_encode
 from oslo_log import log as logging
+from oslo_utils import strutils
 
 from aim import aim_manager
 from aim.api import resource as api_res
@@ -28,13 +32,32 @@ from aim.common import utils
 from aim import config as aim_cfg
 from aim import context
 from aim.db import api
+from aim.db import hashtree_db_listener as ht_db_l
+from aim import exceptions as exc
+from aim import tree_manager
 
 LOG = logging.getLogger(__name__)
 STATIC_QUERY_PARAMS = {
     'include-status',
     'object-type',
-    'include-config'
+    'include-config',
+    'limit',
+    'marker',
+    'root',
+    'bulk'
 }
+# Number of objects retrieved from the store at once
+QUERY_BATCH_SIZE = 500
+# Marker format is <object type>:<offset>
+MARKER_SEPARATOR = ':'
+
+
+def json_handler(*args, **kwargs):
+    value = cherrypy.serving.request._json_inner_handler(*args, **kwargs)
+    if isinstance(value, types.GeneratorType):
+        # Already encoded, stream it as is
+        return value
+    return json_encode(value)
 
 
 class Root(object):
@@ -59,10 +82,12 @@ class AIMController(object):
         self.mgr = aim_manager.AimManager()
         self.sneak_name_to_klass = {utils.camel_to_snake(x.__name__): x
                                     for x in self.mgr.aim_resources}
+        self.tt_mgr = tree_manager.HashTreeManager()
+        self.root_types = {}
 
     @cherrypy.expose()
     @cherrypy.tools.json_in()
-    @cherrypy.tools.json_out()
+    @cherrypy.tools.json_out(handler=json_handler)
     def index(self, path_, *args, **kwargs):
         self._validate_path(path_)
         method = self._get_method()
@@ -74,43 +99,247 @@ class AIMController(object):
 
     def GET(self, path_, *args, **kwargs):
         # Get the whole state unless filtered
+        limit = kwargs.pop('limit', None)
+        marker = kwargs.pop('marker', None)
+        roots = kwargs.pop('root', None)
         get_status, klasses, filters = self._inspect_selection_query(**kwargs)
         # Get status and faults only if explicitly requested
         klasses.discard(api_status.AciStatus)
         klasses.discard(api_status.AciFault)
-        all_resources = []
-        data = []
+        try:
+            limit = int(limit) if limit is not None else None
+            start_klass, offset = self._parse_marker(marker)
+        except ValueError:
+            raise cherrypy.HTTPError(400, 'Invalid limit or marker')
+        if limit is not None and limit <= 0:
+            raise cherrypy.HTTPError(400, 'Invalid limit or marker')
+        klasses = sorted(klasses, key=lambda x: utils.camel_to_snake(
+            x.__name__))
+        if start_klass:
+            klasses = [x for x in klasses if utils.camel_to_snake(
+                x.__name__) >= start_klass]
+            if not klasses or utils.camel_to_snake(
+                    klasses[0].__name__) != start_klass:
+                offset = 0
+        cherrypy.response.stream = True
+        page = {}
+        return self._stream_response(
+            self._iter_data(klasses, filters, roots, get_status, limit,
+                            offset, page), page)
+
+    def _iter_data(self, klasses, filters, roots, get_status, limit, offset,
+                   page):
+        """Yield data items, set the next marker in page if limit is hit"""
+        count = 0
         for klass in klasses:
-            all_resources.extend(self.mgr.find(
-                self.ctx, klass, include_aim_id=True, **filters))
-        for obj in all_resources:
-            if get_status:
-                status = self.mgr.get_status(self.ctx, obj,
-                                             create_if_absent=False)
-                if status:
-                    faults = status.faults
-                    del status.faults
-                    data.append(self._generate_data_item(status))
-                    data.extend([self._generate_data_item(f) for f in faults])
-            data.append(self._generate_data_item(obj))
-        return self._generate_response(data)
+            klass_filters = self._get_root_filters(klass, filters, roots)
+            if klass_filters is None:
+                offset = 0
+                continue
+            while True:
+                batch = QUERY_BATCH_SIZE
+                if limit is not None:
+                    batch = min(batch, limit - count)
+                objs = self.mgr.find(self.ctx, klass, include_aim_id=True,
+                                     limit=batch, offset=offset,
+                                     **klass_filters)
+                statuses = self._get_statuses(objs) if get_status else {}
+                for obj in objs:
+                    status = statuses.get(getattr(obj, '_aim_id', None))
+                    if status:
+                        faults = status.faults
+                        del status.faults
+                        yield self._generate_data_item(status)
+                        for f in faults:
+                            yield self._generate_data_item(f)
+                    yield self._generate_data_item(obj)
+                count += len(objs)
+                offset += len(objs)
+                if limit is not None and count >= limit:
+                    page['next_marker'] = MARKER_SEPARATOR.join(
+                        [utils.camel_to_snake(klass.__name__), str(offset)])
+                    return
+                if len(objs) < batch:
+                    break
+            offset = 0
+
+    def _get_statuses(self, objs):
+        """Statuses and faults of objs, by resource aim_id"""
+        objs = [x for x in objs if isinstance(x, api_res.AciResourceBase)]
+        if not objs:
+            return {}
+        statuses = self.mgr.get_statuses(self.ctx, objs)
+        by_id = {}
+        for status in statuses:
+            status.faults = []
+            by_id[status.id] = status
+        for chunk in utils.chunks(list(by_id), QUERY_BATCH_SIZE):
+            for fault in self.mgr.find(self.ctx, api_status.AciFault,
+                                       in_={'status_id': chunk}):
+                by_id[fault.status_id].faults.append(fault)
+        return {x.resource_id: x for x in statuses}
+
+    def _get_root_filters(self, klass, filters, roots):
+        """Filters selecting the objects of klass in roots
+
+        Returns None when klass can't be part of any of them.
+        """
+        if not roots:
+            return filters
+        if not issubclass(klass, api_res.AciResourceBase):
+            return None
+        root_type = self._get_root_type(klass)
+        names = []
+        for root in roots.split(','):
+            rtype, name = self.tt_mgr.root_key_funct(root)[0].split('|', 1)
+            if rtype == root_type:
+                names.append(name)
+        if not names:
+            return None
+        if root_type in ht_db_l.ROOTLESS_TYPES:
+            return filters
+        result = dict(filters)
+        result['in_'] = {klass.root_ref_attribute(): names}
+        return result
+
+    def _get_root_type(self, klass):
+        if klass not in self.root_types:
+            parent = klass
+            while parent._tree_parent:
+                parent = parent._tree_parent
+            self.root_types[klass] = parent._aci_mo_name
+        return self.root_types[klass]
+
+    def _parse_marker(self, marker):
+        if not marker:
+            return None, 0
+        klass, offset = marker.rsplit(MARKER_SEPARATOR, 1)
+        offset = int(offset)
+        if offset < 0:
+            raise ValueError(marker)
+        return klass, offset
 
     def POST(self, path_, *args, **kwargs):
         # Replace the whole model
+        if self._is_bulk(kwargs):
+            return self._bulk_import(self._get_body(), replace=True,
+                                     **kwargs)
         with self.ctx.store.begin(subtransactions=True):
             self.DELETE(path_)
             self.PUT(path_)
 
     def PUT(self, path_, *args, **kwargs):
-        try:
-            body = cherrypy.request.json
-        except AttributeError:
-            body = json.loads(cherrypy.request.body.read())
+        if self._is_bulk(kwargs):
+            return self._bulk_import(self._get_body(), **kwargs)
+        body = self._get_body()
         with self.ctx.store.begin(subtransactions=True):
             for item in body:
                 res = self._generate_aim_resource(item)
                 self.mgr.create(self.ctx, res, overwrite=True)
 
+    def _get_body(self):
+        try:
+            return cherrypy.request.json
+        except AttributeError:
+            return json.loads(cherrypy.request.body.read())
+
+    def _is_bulk(self, kwargs):
+        try:
+            return strutils.bool_from_string(kwargs.pop('bulk', False),
+                                             strict=True)
+        except ValueError as e:
+            raise cherrypy.HTTPError(400, str(e))
+
+    def _bulk_import(self, body, replace=False, **kwargs):
+        """Apply the difference between body and the store at once
+
+        Only the objects that need to be created, updated or (when
+        replacing) deleted are written, within a single transaction and
+        with no flush until all of them are staged, unless the ownership of
+        monitored objects is taken.
+        """
+        desired = collections.OrderedDict()
+        for item in body:
+            try:
+                res = self._generate_aim_resource(item)
+            except (KeyError, TypeError, ValueError,
+                    exc.AimException) as e:
+                raise cherrypy.HTTPError(400, 'Invalid object %s: %s' %
+                                         (item, e))
+            desired.setdefault(type(res), collections.OrderedDict())[
+                tuple(res.identity)] = res
+        scope = set()
+        filters = {}
+        if replace:
+            _, scope, filters = self._inspect_selection_query(**kwargs)
+        store = self.ctx.store
+        result = []
+        with store.begin(subtransactions=True):
+            # Read everything before writing anything, so that autoflush
+            # doesn't break the changes in multiple flushes
+            current = {}
+            statuses = {}
+            for klass in set(desired) | scope:
+                klass_filters = {}
+                if klass in scope:
+                    klass_filters = {k: v for k, v in filters.items()
+                                     if k in klass.attributes()}
+                db_type = store.resource_to_db_type(klass)
+                current[klass] = collections.OrderedDict()
+                if not db_type:
+                    continue
+                for db_obj in store.query(db_type, klass, **klass_filters):
+                    res = store.make_resource(klass, db_obj,
+                                              include_aim_id=True)
+                    current[klass][tuple(res.identity)] = (res, db_obj)
+                if klass in scope:
+                    # Statuses of the objects to delete
+                    statuses.update(self._get_status_db_objs(
+                        klass, [x[0] for key, x in current[klass].items()
+                                if key not in desired.get(klass, {})]))
+            try:
+                for klass, existing in current.items():
+                    for key, res in desired.get(klass, {}).items():
+                        old_db_obj = existing.pop(key, (None, None))[1]
+                        if not self.mgr.create_with_db_obj(self.ctx, res,
+                                                           old_db_obj):
+                            action = 'unchanged'
+                        elif old_db_obj:
+                            action = 'updated'
+                        else:
+                            action = 'created'
+                        result.append(self._generate_result_item(res,
+                                                                 action))
+                    if klass in scope:
+                        for res, db_obj in existing.values():
+                            self.mgr.delete_with_db_obj(
+                                self.ctx, res, db_obj,
+                                statuses.get(getattr(res, '_aim_id', None)))
+                            result.append(
+                                self._generate_result_item(res, 'deleted'))
+            except exc.AimException as e:
+                raise cherrypy.HTTPError(400, str(e))
+        return self._generate_response(result)
+
+    def _get_status_db_objs(self, klass, objs):
+        """Status DB objects of objs, by resource aim_id"""
+        if not issubclass(klass, api_res.AciResourceBase) or not objs:
+            return {}
+        store = self.ctx.store
+        db_type = store.resource_to_db_type(api_status.AciStatus)
+        aim_ids = set(getattr(x, '_aim_id', None) for x in objs)
+        aim_ids.discard(None)
+        result = {}
+        for chunk in utils.chunks(list(aim_ids), QUERY_BATCH_SIZE):
+            for db_obj in store.query(db_type, api_status.AciStatus,
+                                      resource_type=klass.__name__,
+                                      in_={'resource_id': chunk}):
+                status = store.make_resource(api_status.AciStatus, db_obj)
+                # Not all stores filter on in_
+                if status.resource_id in aim_ids:
+                    result[status.resource_id] = db_obj
+        return result
+
     def DELETE(self, path_, *args, **kwargs):
         _, klasses, filters = self._inspect_selection_query(**kwargs)
         with self.ctx.store.begin(subtransactions=True):
@@ -137,6 +366,12 @@ class AIMController(object):
                 'aim_id': aim_resource.__dict__.pop('_aim_id', ''),
                 'attributes': aim_resource.__dict__}
 
+    def _generate_result_item(self, aim_resource, result):
+        return {'type': utils.camel_to_snake(type(aim_resource).__name__),
+                'identity': {k: getattr(aim_resource, k)
+                             for k in aim_resource.identity_attributes},
+                'result': result}
+
     def _generate_aim_resource(self, data_item):
         return self.sneak_name_to_klass[data_item['type']](
             **data_item['attributes'])
@@ -147,6 +382,21 @@ class AIMController(object):
     def _generate_response(self, data):
         return {'count': len(data), 'data': data}
 
+    def _stream_response(self, data, page):
+        # Same document as _generate_response, encoded as the items are
+        # generated
+        count = 0
+        yield b'{"data": ['
+        for item in data:
+            yield ((b', ' if count else b'') +
+                   json.dumps(item).encode('utf-8'))
+            count += 1
+        yield ('], "count": %d' % count).encode('utf-8')
+        if page.get('next_marker'):
+            yield (', "next_marker": %s' %
+                   json.dumps(page['next_marker'])).encode('utf-8')
+        yield b'}'
+
     def _generate_error(self, code, text):
         pass
 
@@ -24,6 +24,7 @@ from oslotest import base
 from sqlalchemy.orm import sessionmaker as sa_sessionmaker
 
 from aim.agent.aid.universes.aci import aci_universe
+from aim.agent.aid.universes.aci import tenant as aci_tenant
 from aim.agent.aid.universes.k8s import k8s_watcher
 from aim import aim_manager
 from aim import aim_store
@@ -164,7 +165,9 @@ class TestAimDBBase(BaseTestCase):
         super(TestAimDBBase, self).setUp()
         self.test_id = uuidutils.generate_uuid()
         aim_cfg.OPTION_SUBSCRIBER_MANAGER = None
+        aim_cfg.OPTION_CACHE.invalidate()
         aci_universe.ws_context = None
+        aci_tenant.reset_scheduler = None
         if not os.environ.get(K8S_STORE_VENV):
             CONF.set_override('aim_store', 'sql', 'aim')
             self.engine = api.get_engine()
@@ -15,6 +15,10 @@
 
 import collections
 import copy
+import os
+import shutil
+import tempfile
+import threading
 import time
 
 from apicapi import apic_client
@@ -537,6 +541,68 @@ class TestAciTenant(base.TestAimDBBase, TestAciClientMixin):
         # Main loop is not raising
         manager._main_loop()
 
+    def test_worker_pool(self):
+        pool = aci_tenant.AciTenantWorkerPool(2, 0)
+        manager = aci_tenant.AciTenantManager(
+            'tn-1', self.cfg_manager,
+            aci_universe.AciUniverse.establish_aci_session(self.cfg_manager),
+            aci_universe.get_websocket_context(self.cfg_manager, None),
+            worker_pool=pool)
+        manager._handle_events = mock.Mock()
+        # Starting the manager schedules its subscription, no thread is
+        # spawned
+        manager.start()
+        self.assertIsNone(manager._thread)
+        self.assertEqual({manager}, pool.scheduled)
+        # Managers are scheduled only once
+        pool.notify(manager)
+        pool.dispatch()
+        self.assertEqual(1, pool.ready.qsize())
+        pool.serve_next(block=False)
+        self.assertTrue(manager.is_warm())
+        self.assertEqual(1, manager._handle_events.call_count)
+        self.assertEqual(set(), pool.scheduled)
+        # Idle managers are not served
+        manager.ws_context.has_event = mock.Mock(return_value=False)
+        pool.dispatch()
+        self.assertEqual(0, pool.ready.qsize())
+        # Events wake them up
+        manager.ws_context.has_event.return_value = True
+        pool.dispatch()
+        pool.serve_next(block=False)
+        self.assertEqual(2, manager._handle_events.call_count)
+        # And so do pushes
+        manager.ws_context.has_event.return_value = False
+        manager.push_aim_resources({'create': [self._get_example_aim_bd()]})
+        self.assertEqual(1, pool.ready.qsize())
+        pool.serve_next(block=False)
+        self.assertEqual(3, manager._handle_events.call_count)
+        # Failures unsubscribe the tenant, which is subscribed again once
+        # the backoff expires
+        manager._handle_events.side_effect = KeyError
+        pool.notify(manager)
+        pool.serve_next(block=False)
+        self.assertFalse(manager.is_warm())
+        self.assertEqual(1, manager.recovery_retries.get())
+        manager._recovery_time = 0
+        manager._handle_events.side_effect = None
+        pool.dispatch()
+        pool.serve_next(block=False)
+        self.assertTrue(manager.is_warm())
+        self.assertIsNone(manager.recovery_retries)
+        # Scheduled resets
+        manager.scheduled_reset = 0
+        self.assertTrue(manager.needs_service())
+        pool.dispatch()
+        pool.serve_next(block=False)
+        self.assertFalse(manager.is_warm())
+        # Killed managers leave the pool
+        self.assertFalse(manager.is_dead())
+        manager.kill()
+        self.assertTrue(manager.is_dead())
+        self.assertFalse(manager.needs_service())
+        self.assertEqual({}, pool.managers)
+
     def test_tenant_reset(self):
         manager = aci_tenant.AciTenantManager(
             'tn-1', self.cfg_manager,
@@ -561,7 +627,47 @@ class TestAciTenant(base.TestAimDBBase, TestAciClientMixin):
         manager._main_loop()
         self.assertEqual(1, manager._unsubscribe_tenant.call_count)
 
+    def test_reset_scheduler(self):
+        clock = {'now': 0}
+        scheduler = aci_tenant.ResetScheduler(
+            600, 0.2, 2, 6, clock=lambda: clock['now'])
+        # Resets are spread evenly over the allowed slots
+        times = [scheduler.schedule('tn-%s' % x) for x in range(10)]
+        self.assertTrue(all(480 <= x <= 720 for x in times))
+        self.assertEqual([2, 2, 2, 2, 2], sorted(scheduler.slots.values()))
+        scheduler.schedule('tn-0')
+        self.assertEqual(10, sum(scheduler.slots.values()))
+        # At most 2 resets at the same time
+        clock['now'] = 720
+        self.assertTrue(scheduler.acquire('tn-0'))
+        self.assertTrue(scheduler.acquire('tn-1'))
+        self.assertFalse(scheduler.acquire('tn-2'))
+        scheduler.release('tn-0')
+        scheduler.release('tn-1')
+        # Tokens are refilled at 6 per minute
+        self.assertFalse(scheduler.acquire('tn-2'))
+        clock['now'] += 10
+        self.assertTrue(scheduler.acquire('tn-2'))
+        self.assertFalse(scheduler.acquire('tn-3'))
+        # Urgent resets are never deferred, but use tokens
+        self.assertTrue(scheduler.acquire('tn-4', urgent=True))
+        scheduler.release('tn-2')
+        clock['now'] += 10
+        self.assertFalse(scheduler.acquire('tn-3'))
+        clock['now'] += 10
+        self.assertTrue(scheduler.acquire('tn-3'))
+        self.assertEqual({'tn-3': 750}, scheduler.in_progress)
+        # Stuck resets expire
+        clock['now'] += scheduler.RESET_TIMEOUT + 20
+        self.assertTrue(scheduler.acquire('tn-5'))
+        self.assertEqual(['tn-5'], list(scheduler.in_progress))
+        scheduler.cancel('tn-5')
+        self.assertEqual({}, scheduler.in_progress)
+        self.assertEqual(4, sum(scheduler.slots.values()))
+
     def test_push_aim_resources(self):
+        # Single object requests
+        self.manager.push_batch_size = 1
         # Create some AIM resources
         bd1 = self._get_example_aim_bd()
         bd2 = self._get_example_aim_bd(name='test2')
@@ -723,6 +829,33 @@ class TestAciTenant(base.TestAimDBBase, TestAciClientMixin):
         self.assertEqual(utils.deep_sort([parent_bd, complete]),
                          utils.deep_sort(events))
 
+    def test_fill_events_single_lookup(self):
+        bds = [{'fvBD': {'attributes': {
+            'arpFlood': 'no', 'dn': 'uni/tn-test-tenant/BD-test%s' % x,
+            'epMoveDetectMode': '', 'ipLearning': 'yes',
+            'limitIpLearnToSubnets': 'no', 'nameAlias': '',
+            'unicastRoute': 'yes', 'unkMacUcastAct': 'proxy'}}}
+            for x in range(5)]
+        ctxs = [{'fvRsCtx': {'attributes': {
+            'dn': 'uni/tn-test-tenant/BD-test%s/rsctx' % x,
+            'tnFvCtxName': 'test'}}} for x in range(5)]
+        self._add_data_to_tree(bds + ctxs, self.backend_state)
+        events = [{'fvBD': {'attributes': {
+            'dn': 'uni/tn-test-tenant/BD-test%s' % x, 'descr': 'test',
+            'status': 'modified'}}} for x in range(5)]
+        # Missing objects are just left out
+        events.append({'fvBD': {'attributes': {
+            'dn': 'uni/tn-test-tenant/BD-missing', 'status': 'modified'}}})
+        get_resources = self.manager.get_resources
+        self.manager.get_resources = mock.Mock(side_effect=get_resources)
+        events = self.manager.ownership_mgr.filter_ownership(
+            self.manager._fill_events(events))
+        self.assertEqual(1, self.manager.get_resources.call_count)
+        for bd in bds:
+            bd['fvBD']['attributes']['descr'] = 'test'
+        self.assertEqual(utils.deep_sort(bds + ctxs),
+                         utils.deep_sort(events))
+
     def test_fill_events_not_found(self):
         events = [
             {"fvRsCtx": {"attributes": {
@@ -931,6 +1064,153 @@ class TestAciTenant(base.TestAimDBBase, TestAciClientMixin):
         self.assertEqual(utils.deep_sort(complete),
                          utils.deep_sort(events))
 
+    def test_push_aim_resources_batched(self):
+        post = self.manager.aci_session.post_body_dict
+        self.manager.creation_succeeded = mock.Mock()
+        self.manager.creation_failed = mock.Mock()
+        self.manager.push_batch_size = 100
+        epgs = [a_res.EndpointGroup(tenant_name='t1', app_profile_name='ap',
+                                    name='epg%s' % x, bd_name='bd')
+                for x in range(5)]
+        bd = a_res.BridgeDomain(tenant_name='t1', name='bd', vrf_name='vrf')
+        self.manager.push_aim_resources({'create': epgs + [bd]})
+        self.manager._push_aim_resources()
+        # EPGs are posted together under their application profile, the BD
+        # on its own.
+        self.assertEqual(2, post.call_count)
+        by_class = dict((list(x[0][1].keys())[0], x[0]) for x in
+                        post.call_args_list)
+        ap = by_class['fvAp'][1]['fvAp']
+        self.assertEqual(('t1', 'ap'), by_class['fvAp'][2:])
+        self.assertEqual({'rn': 'ap-ap', 'status': 'modified'},
+                         ap['attributes'])
+        self.assertEqual(['epg-epg%s' % x for x in range(5)],
+                         sorted(x['fvAEPg']['attributes']['rn']
+                                for x in ap['children']))
+        # Children are nested into their parents
+        for epg in ap['children']:
+            self.assertEqual(
+                ['fvRsBd'],
+                [list(x.keys())[0] for x in epg['fvAEPg']['children']
+                 if 'tagInst' not in x])
+        self.assertEqual(('t1', 'bd'), by_class['fvBD'][2:])
+        self.assertEqual(6, self.manager.creation_succeeded.call_count)
+
+        # Batches are bounded by size
+        post.reset_mock()
+        # Each EPG is 4 objects, with its fvRsBd and tags
+        self.manager.push_batch_size = 8
+        self.manager.push_aim_resources({'create': epgs})
+        self.manager._push_aim_resources()
+        self.assertEqual(
+            [2, 2, 1], [len(x[0][1]['fvAp']['children']) if
+                        'fvAp' in x[0][1] else 1
+                        for x in post.call_args_list])
+        post.reset_mock()
+        self.manager.push_batch_size = 100
+        self.manager.push_batch_max_bytes = 1
+        self.manager.push_aim_resources({'create': epgs})
+        self.manager._push_aim_resources()
+        self.assertEqual(5, post.call_count)
+        self.manager.push_batch_max_bytes = 1048576
+
+        # A failing batch falls back to single object requests
+        def post_body_dict(mo, data, *params):
+            if 'fvAp' in data or params[-1] == 'epg3':
+                raise apic_client.cexc.ApicResponseNotOk(
+                    request='post', status='400', reason='bad request',
+                    err_text='bad', err_code='400')
+        post.reset_mock()
+        post.side_effect = post_body_dict
+        self.manager.creation_succeeded.reset_mock()
+        self.manager.push_aim_resources({'create': epgs})
+        self.manager._push_aim_resources()
+        self.assertEqual(6, post.call_count)
+        self.assertEqual(4, self.manager.creation_succeeded.call_count)
+        self.assertEqual(1, self.manager.creation_failed.call_count)
+        self.assertEqual(epgs[3],
+                         self.manager.creation_failed.call_args[0][0])
+        post.side_effect = None
+
+        # Deletes are batched as well
+        post.reset_mock()
+        aim_converter = converter.AimToAciModelConverter()
+        to_delete = [x for x in aim_converter.convert(epgs)
+                     if 'fvAEPg' in x]
+        self.manager.push_aim_resources({'delete': to_delete})
+        self.manager._push_aim_resources()
+        self.assertEqual(0, self.manager.aci_session.DELETE.call_count)
+        self.assertEqual(1, post.call_count)
+        ap = post.call_args[0][1]['fvAp']
+        self.assertEqual(5, len(ap['children']))
+        for epg in ap['children']:
+            self.assertEqual('deleted', epg['fvAEPg']['attributes']['status'])
+
+    def test_push_aim_resources_batch_errors(self):
+        post = self.manager.aci_session.post_body_dict
+        self.manager.creation_succeeded = mock.Mock()
+        self.manager.creation_failed = mock.Mock()
+        self.manager.push_batch_size = 100
+        epgs = [a_res.EndpointGroup(tenant_name='t1', app_profile_name='ap',
+                                    name='epg%s' % x)
+                for x in range(3)]
+        decompose = apic_client.DNManager.aci_decompose_dn_guess
+
+        def aci_decompose_dn_guess(dn_mgr, dn, mo_type):
+            if 'epg-epg1' in dn:
+                raise apic_client.DNManager.InvalidNameFormat()
+            return decompose(dn_mgr, dn, mo_type)
+
+        with mock.patch.object(apic_client.DNManager,
+                               'aci_decompose_dn_guess',
+                               new=aci_decompose_dn_guess):
+            self.manager.push_aim_resources({'create': epgs})
+            self.manager._push_aim_resources()
+        # The object that can't be posted is reported, the others are
+        # batched
+        self.assertEqual(1, post.call_count)
+        self.assertEqual(['epg-epg0', 'epg-epg2'], sorted(
+            x['fvAEPg']['attributes']['rn']
+            for x in post.call_args[0][1]['fvAp']['children']))
+        self.assertEqual(2, self.manager.creation_succeeded.call_count)
+        self.manager.creation_failed.assert_called_once_with(
+            epgs[1], mock.ANY, mock.ANY)
+
+        # Attributes are sent as strings, and the parent class comes from
+        # the DN for objects with multiple possible containers
+        post.reset_mock()
+        self.assertEqual(set(), self.manager._post_in_batches(
+            [(x, [{'tagInst': {'attributes': {
+                'dn': 'uni/tn-t1/BD-bd/tag-tag%s' % x, 'id': x}}}])
+             for x in range(2)]))
+        self.assertEqual(1, post.call_count)
+        mo, body = post.call_args[0][:2]
+        self.assertEqual('fvBD', mo.klass_name)
+        self.assertEqual(('t1', 'bd'), post.call_args[0][2:])
+        self.assertEqual(
+            [{'rn': 'tag-tag0', 'id': '0'}, {'rn': 'tag-tag1', 'id': '1'}],
+            sorted((x['tagInst']['attributes'] for x in
+                    body['fvBD']['children']), key=lambda x: x['rn']))
+
+    def test_push_aim_resources_levels(self):
+        post = self.manager.aci_session.post_body_dict
+        self.manager.push_concurrency = 4
+        epgs = [a_res.EndpointGroup(tenant_name='t1', app_profile_name=ap,
+                                    name='epg%s' % x)
+                for x in range(3) for ap in ['ap1', 'ap2']]
+        bds = [a_res.BridgeDomain(tenant_name='t1', name='bd%s' % x)
+               for x in range(2)]
+        self.manager.push_aim_resources({'create': epgs + bds})
+        self.manager._push_aim_resources()
+        # BDs are a level up, and go before the EPGs. The two application
+        # profiles can be posted in any order.
+        self.assertEqual(3, post.call_count)
+        self.assertEqual(
+            'fvTenant', list(post.call_args_list[0][0][1].keys())[0])
+        self.assertEqual(
+            set([('t1', 'ap1'), ('t1', 'ap2')]),
+            set(x[0][2:] for x in post.call_args_list[1:]))
+
     def test_squash_operations(self):
         # Craft some objects and push them
         aim_converter = converter.AimToAciModelConverter()
@@ -983,6 +1263,308 @@ class TestAciTenant(base.TestAimDBBase, TestAciClientMixin):
             {'delete': aim_converter.convert([vrf])})
         self.assertEqual(2, len(self.manager.object_backlog.queue))
 
+    def test_squash_operations_index(self):
+        bd = a_res.BridgeDomain(tenant_name='tn1', name='bd1',
+                                display_name='foo')
+        bd_new = copy.deepcopy(bd)
+        bd_new.display_name = 'bar'
+        # Last writer wins within the same request as well
+        self.manager.push_aim_resources({'create': [bd, bd_new]})
+        self.assertEqual([{'create': [bd_new]}],
+                         list(self.manager.object_backlog.queue))
+        self.assertEqual(1, len(self.manager.object_backlog.index))
+        # Objects already taken out of the backlog can't be replaced
+        self.manager.object_backlog.get_nowait()
+        self.assertEqual({}, self.manager.object_backlog.index)
+        self.manager.push_aim_resources({'create': [bd]})
+        self.assertEqual([{'create': [bd]}],
+                         list(self.manager.object_backlog.queue))
+        self.manager._reset_object_backlog()
+        self.assertEqual({}, self.manager.object_backlog.index)
+
+    def test_load_children_mos(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        path = os.path.join(cache_dir, 'aim', 'apic_classes.json')
+        self.set_override('apic_class_cache_file', path, 'aim')
+        self.addCleanup(aci_tenant._set_children_mos,
+                        {'uni': aci_tenant.CHILDREN_MOS_UNI,
+                         'topology': aci_tenant.CHILDREN_MOS_TOPOLOGY})
+        apic = {'version': '1.0', 'unsupported': 'fvBD',
+                'probes': [], 'release': threading.Event()}
+        apic['release'].set()
+
+        def get(url):
+            if 'firmwareCtrlrRunning' in url:
+                return [{'firmwareCtrlrRunning': {'attributes': {
+                    'version': apic['version']}}}]
+            apic['release'].wait()
+            apic['probes'].append(url)
+            if apic['unsupported'] in url:
+                raise apic_client.cexc.ApicResponseNotOk(
+                    request='get', status='400', reason='', err_text='',
+                    err_code='12')
+            return []
+        session = mock.Mock(GET=mock.Mock(side_effect=get))
+        # Classes are probed and stored along with the APIC version
+        self.assertIsNone(aci_tenant.load_children_mos(session,
+                                                       self.cfg_manager))
+        self.assertEqual(
+            len(aci_tenant.CHILDREN_LIST) +
+            len(aci_tenant.TOPOLOGY_CHILDREN_LIST), len(apic['probes']))
+        self.assertNotIn('fvBD', aci_tenant.CHILDREN_MOS_UNI)
+        self.assertIn('fvCtx', aci_tenant.CHILDREN_MOS_UNI)
+        self.assertIn('fabricPod', aci_tenant.CHILDREN_MOS_TOPOLOGY)
+        self.assertTrue(os.path.exists(path))
+        # Restarting on the same APIC version reuses the cache
+        apic['probes'] = []
+        aci_tenant._set_children_mos({'uni': None, 'topology': None})
+        self.assertIsNone(aci_tenant.load_children_mos(session,
+                                                       self.cfg_manager))
+        self.assertEqual([], apic['probes'])
+        self.assertNotIn('fvBD', aci_tenant.CHILDREN_MOS_UNI)
+        self.assertIn('fvCtx', aci_tenant.CHILDREN_MOS_UNI)
+        # On a new version, the cache is used until classes are probed
+        # again in background
+        apic.update({'version': '2.0', 'unsupported': 'fvCtx'})
+        apic['release'].clear()
+        aci_tenant._set_children_mos({'uni': None, 'topology': None})
+        thread = aci_tenant.load_children_mos(session, self.cfg_manager)
+        self.assertIn('fvCtx', aci_tenant.CHILDREN_MOS_UNI)
+        apic['release'].set()
+        thread.join()
+        self.assertIn('fvBD', aci_tenant.CHILDREN_MOS_UNI)
+        self.assertNotIn('fvCtx', aci_tenant.CHILDREN_MOS_UNI)
+        self.assertEqual(
+            ('2.0', {'uni': aci_tenant.CHILDREN_MOS_UNI,
+                     'topology': aci_tenant.CHILDREN_MOS_TOPOLOGY}),
+            aci_tenant._load_children_mos_cache(path))
+
+    def test_coalesce_events(self):
+        bd_dn = 'uni/tn-tn1/BD-bd1'
+        vrf_dn = 'uni/tn-tn1/ctx-vrf1'
+        pending, index = [], {}
+        aci_tenant.coalesce_events(pending, index, [
+            {'fvBD': {'attributes': {'dn': bd_dn, 'arpFlood': 'no',
+                                     'descr': 'a'}}},
+            {'fvCtx': {'attributes': {'dn': vrf_dn, 'descr': 'a',
+                                      'status': 'modified'}}},
+            {'fvBD': {'attributes': {'dn': bd_dn, 'descr': 'b',
+                                     'status': 'modified'}}}])
+        aci_tenant.coalesce_events(pending, index, [
+            {'fvCtx': {'attributes': {'dn': vrf_dn, 'descr': 'b',
+                                      'status': 'modified'}}},
+            {'fvBD': {'attributes': {'dn': bd_dn, 'descr': 'c',
+                                     'status': 'modified'}}}])
+        # Modifications are merged in order into the complete object
+        self.assertEqual(
+            [{'fvBD': {'attributes': {'dn': bd_dn, 'arpFlood': 'no',
+                                      'descr': 'c'}}},
+             {'fvCtx': {'attributes': {'dn': vrf_dn, 'descr': 'b',
+                                       'status': 'modified'}}}],
+            pending)
+        # Deletion drops earlier events of its DN, and a re-creation
+        # follows it
+        aci_tenant.coalesce_events(pending, index, [
+            {'fvCtx': {'attributes': {'dn': vrf_dn, 'status': 'deleted'}}},
+            {'fvCtx': {'attributes': {'dn': vrf_dn, 'descr': 'c',
+                                      'status': 'created'}}},
+            {'fvCtx': {'attributes': {'dn': vrf_dn, 'descr': 'd',
+                                      'status': 'modified'}}}])
+        self.assertEqual(
+            [{'fvBD': {'attributes': {'dn': bd_dn, 'arpFlood': 'no',
+                                      'descr': 'c'}}},
+             None,
+             {'fvCtx': {'attributes': {'dn': vrf_dn, 'status': 'deleted'}}},
+             {'fvCtx': {'attributes': {'dn': vrf_dn, 'descr': 'd',
+                                       'status': 'created'}}}],
+            pending)
+        # Nothing is moved ahead of a deletion
+        subnet_dn = bd_dn + '/subnet-[10.0.0.1/24]'
+        pending, index = [], {}
+        aci_tenant.coalesce_events(pending, index, [
+            {'fvSubnet': {'attributes': {'dn': subnet_dn, 'descr': 'a',
+                                         'status': 'modified'}}},
+            {'fvBD': {'attributes': {'dn': bd_dn, 'status': 'deleted'}}},
+            {'fvSubnet': {'attributes': {'dn': subnet_dn, 'descr': 'b',
+                                         'status': 'created'}}}])
+        self.assertEqual(
+            [{'fvSubnet': {'attributes': {'dn': subnet_dn, 'descr': 'a',
+                                          'status': 'modified'}}},
+             {'fvBD': {'attributes': {'dn': bd_dn, 'status': 'deleted'}}},
+             {'fvSubnet': {'attributes': {'dn': subnet_dn, 'descr': 'b',
+                                          'status': 'created'}}}],
+            pending)
+
+    def test_event_coalesce_window(self):
+        old_name = self.manager.tenant_name
+        self.manager.tenant_name = 'tn-test-tenant'
+        self.manager.event_coalesce_window = 60
+        self.manager._subscribe_tenant()
+        self.manager._event_to_tree = mock.Mock(
+            side_effect=self.manager._event_to_tree)
+        self._set_events(self._init_event())
+        self.manager._handle_events()
+        # Events are held until the window expires
+        self.assertEqual(0, self.manager._event_to_tree.call_count)
+        self.assertFalse(self.manager.needs_service())
+        self._set_events([{'fvBD': {'attributes': {
+            'dn': 'uni/tn-test-tenant/BD-test', 'descr': 'changed',
+            'status': 'modified'}}}])
+        self.manager._handle_events()
+        self.assertEqual(0, self.manager._event_to_tree.call_count)
+        self.manager._pending_events_deadline = 0
+        self.assertTrue(self.manager.needs_service())
+        self.manager._handle_events()
+        self.assertEqual(1, self.manager._event_to_tree.call_count)
+        self.assertEqual([], self.manager.pending_events)
+        bd = [x for x in self.manager._event_to_tree.call_args[0][0]
+              if 'fvBD' in x][0]
+        self.assertEqual('changed', bd['fvBD']['attributes']['descr'])
+        self.manager.tenant_name = old_name
+
+    def test_event_no_coalesce_window(self):
+        old_name = self.manager.tenant_name
+        self.manager.tenant_name = 'tn-test-tenant'
+        self.manager.event_coalesce_window = 0
+        self.manager._subscribe_tenant()
+        self._set_events(self._init_event())
+        self.manager._handle_events()
+        events = [{'fvBD': {'attributes': {
+            'dn': 'uni/tn-test-tenant/BD-test', 'descr': x,
+            'status': 'modified'}}} for x in 'ab']
+        with mock.patch.object(aci_tenant, 'coalesce_events') as coalesce, \
+                mock.patch.object(self.manager, '_fill_events',
+                                  return_value=[]) as fill:
+            self._set_events(events)
+            self.manager._handle_events()
+            self.assertFalse(coalesce.called)
+            # Events are processed as they are, without waiting
+            self.assertEqual(['a', 'b'],
+                             [x['fvBD']['attributes']['descr']
+                              for x in fill.call_args[0][0]])
+        self.manager.tenant_name = old_name
+
+    def test_tenant_snapshot(self):
+        snapshot_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, snapshot_dir)
+        self.set_override('aci_tenant_snapshot_dir', snapshot_dir, 'aim')
+
+        def get_manager():
+            manager = aci_tenant.AciTenantManager(
+                'tn-tenant-1', self.cfg_manager,
+                aci_universe.AciUniverse.establish_aci_session(
+                    self.cfg_manager), self.manager.ws_context)
+            manager.tenant_name = 'tn-test-tenant'
+            return manager
+        manager = get_manager()
+        path = os.path.join(snapshot_dir, 'tn-tenant-1.json')
+        self.assertEqual(path, manager.snapshot_path)
+        self._set_events(self._init_event(), manager=manager)
+        manager._subscribe_tenant()
+        self.assertTrue(os.path.exists(path))
+        state = manager._state.root_full_hash
+        monitored = manager._monitored_state.root_full_hash
+        self.assertIsNotNone(monitored)
+        manager._unsubscribe_tenant()
+
+        # A new manager serves the snapshot, read only, while subscribing
+        # in the background
+        manager = get_manager()
+        self.assertFalse(manager.is_warm())
+        subscribed = threading.Event()
+        manager._load_snapshot()
+        # The snapshot is not refreshed until it is verified
+        with mock.patch.object(aci_tenant, '_save_tenant_snapshot') as save:
+            manager._save_snapshot(force=True)
+            self.assertFalse(save.called)
+        self._set_events(self._init_event(), manager=manager)
+        with mock.patch.object(
+                manager.ws_context, 'subscribe',
+                side_effect=lambda urls: subscribed.wait()):
+            manager._subscribe_tenant()
+            self.assertTrue(manager.is_warm())
+            self.assertTrue(manager.is_warm_pending())
+            self.assertEqual(state, manager._state.root_full_hash)
+            self.assertEqual(monitored,
+                             manager._monitored_state.root_full_hash)
+            with mock.patch.object(manager, '_fill_events') as fill:
+                manager._handle_events()
+                self.assertFalse(fill.called)
+            subscribed.set()
+            manager._subscription.join()
+        # The snapshot is verified by the full state, without replacing the
+        # trees nor reconciling them
+        snapshot_trees = manager._state, manager._monitored_state
+        with mock.patch('aim.agent.aid.event_handler.EventHandler.'
+                        'reconcile') as reconcile:
+            self.assertTrue(manager.needs_service())
+            manager._handle_events()
+            self.assertFalse(reconcile.called)
+        self.assertFalse(manager.is_warm_pending())
+        self.assertTrue(manager.is_warm())
+        self.assertEqual(snapshot_trees,
+                         (manager._state, manager._monitored_state))
+        self.assertFalse(manager._snapshot_dirty)
+        # Unchanged trees are only stored again before the snapshot expires
+        with mock.patch.object(aci_tenant, '_save_tenant_snapshot') as save:
+            manager._snapshot_time -= manager.snapshot_interval
+            manager._save_snapshot()
+            self.assertFalse(save.called)
+            manager._snapshot_time -= manager.snapshot_max_age
+            manager._save_snapshot()
+            self.assertTrue(save.called)
+        manager._unsubscribe_tenant()
+
+        # An outdated snapshot is replaced by the full state
+        manager = get_manager()
+        manager._load_snapshot()
+        self._set_events(self._init_event()[:2], manager=manager)
+        with mock.patch.object(manager.ws_context, 'subscribe'):
+            manager._subscribe_tenant()
+            manager._subscription.join()
+        with mock.patch('aim.agent.aid.event_handler.EventHandler.'
+                        'reconcile') as reconcile:
+            manager._handle_events()
+            reconcile.assert_called_once_with(roots=['tn-test-tenant'])
+        self.assertFalse(manager.is_warm_pending())
+        self.assertNotEqual(monitored,
+                            manager._monitored_state.root_full_hash)
+        self.assertTrue(manager._snapshot_dirty)
+        manager._unsubscribe_tenant()
+
+        # Background subscription failures are raised by the event loop
+        manager = get_manager()
+        manager._load_snapshot()
+        with mock.patch.object(
+                manager.ws_context, 'subscribe',
+                side_effect=aci_universe.WebSocketSubscriptionFailed(
+                    urls=[], code=500, text='')):
+            manager._subscribe_tenant()
+            manager._subscription.join()
+        self.assertRaises(aci_universe.WebSocketSubscriptionFailed,
+                          manager._handle_events)
+        manager._unsubscribe_tenant()
+        self.assertFalse(manager.is_warm())
+
+        # Snapshots stored before the full state was received are ignored
+        manager = get_manager()
+        with open(path) as snapshot:
+            content = json.load(snapshot)
+        content['subscribed_at'] = content['timestamp'] + 1
+        with open(path, 'w') as snapshot:
+            json.dump(content, snapshot)
+        manager._load_snapshot()
+        self.assertFalse(manager.is_warm())
+        self.assertIsNone(manager._monitored_state.root)
+
+        # Old snapshots are ignored
+        manager = get_manager()
+        manager.snapshot_max_age = -1
+        manager._load_snapshot()
+        self.assertFalse(manager.is_warm())
+        self.assertIsNone(manager._monitored_state.root)
+
     def test_aci_types_not_convertible_if_monitored(self):
         self.assertEqual({'fvRsProv': ['l3extInstP'],
                           'fvRsCons': ['l3extInstP'],
@@ -35,6 +35,11 @@ class TestAciUniverseMixin(test_aci_tenant.TestAciClientMixin):
         super(TestAciUniverseMixin, self).setUp()
         self._do_aci_mocks()
         self.backend_state = {}
+        # Tenant managers are global, don't share them across tests
+        self.mock_serving_tenants = mock.patch.object(
+            aci_universe, 'serving_tenants', {})
+        self.mock_serving_tenants.start()
+        self.addCleanup(self.mock_serving_tenants.stop)
         self.universe = (universe_klass or
                          aci_universe.AciUniverse)().initialize(
             aim_cfg.ConfigManager(self.ctx, 'h1'), [])
@@ -120,6 +125,38 @@ class TestAciUniverseMixin(test_aci_tenant.TestAciClientMixin):
             self.assertTrue(isinstance(self.universe.state[tenant],
                                        structured_tree.StructuredHashTree))
 
+    def test_observe_roots(self):
+        tenant_list = ['tn-%s' % x for x in range(3)]
+        self.universe.serve(self.ctx, tenant_list)
+        self.universe.observe(self.ctx)
+        state = self.universe.state
+        self.universe._get_state_copy = mock.Mock(
+            side_effect=self.universe._get_state_copy)
+        # Only the given roots are copied again
+        self.universe.observe(self.ctx, roots=set(['tn-1']))
+        self.universe._get_state_copy.assert_called_once_with('tn-1')
+        self.assertIs(state['tn-0'], self.universe.state['tn-0'])
+        self.assertIsNot(state['tn-1'], self.universe.state['tn-1'])
+        # Replacing a tree in the state doesn't affect the next observation
+        self.universe.state['tn-2'] = structured_tree.StructuredHashTree()
+        self.universe.observe(self.ctx, roots=set())
+        self.assertIs(state['tn-2'], self.universe.state['tn-2'])
+        # Roots not warm anymore are dropped
+        with mock.patch.object(self.universe.serving_tenants['tn-0'],
+                               'is_warm', return_value=False):
+            self.universe.observe(self.ctx, roots=set())
+        self.assertNotIn('tn-0', self.universe.state)
+        self.assertEqual(1, self.universe._get_state_copy.call_count)
+
+    def test_read_only_roots(self):
+        self.universe.serve(self.ctx, ['tn-0', 'tn-1'])
+        self.assertFalse(self.universe.is_read_only('tn-0'))
+        # Tenants warmed up from an unverified snapshot are read only
+        self.universe.serving_tenants['tn-0']._warm_pending = True
+        self.assertTrue(self.universe.is_read_only('tn-0'))
+        self.assertFalse(self.universe.is_read_only('tn-1'))
+        self.assertFalse(self.universe.is_read_only('tn-2'))
+
     def test_serve_exception(self):
         tenant_list = ['tn-%s' % x for x in range(10)]
         self.universe.serve(self.ctx, tenant_list)
@@ -367,6 +404,51 @@ class TestAciUniverseMixin(test_aci_tenant.TestAciClientMixin):
             self.universe.ws_context._thread_monitor({'monitor_runs': 4})
             self.assertEqual(0, harakiri.call_count)
 
+    def test_sharded_ws_context(self):
+        self.set_override('websocket_sessions', 3, 'aim')
+        aci_universe.ws_context = None
+        ws_context = aci_universe.get_websocket_context(
+            aim_cfg.ConfigManager(self.ctx, 'h1'), self.universe.manager)
+        self.assertEqual(3, len(ws_context.shards))
+        # Each shard has its own session
+        self.assertEqual(3, len(set(id(x.session) for x in ws_context.shards)))
+        self.universe.ws_context = ws_context
+        tenant_list = ['tn-%s' % x for x in range(20)]
+        self.universe.serve(self.ctx, tenant_list)
+        by_shard = {}
+        for name, manager in self.universe.serving_tenants.items():
+            shard = ws_context.get_shard(manager.tenant.urls)
+            # Tenants are consistently assigned
+            self.assertIs(shard, ws_context.get_shard(
+                list(manager.tenant.urls)))
+            by_shard.setdefault(shard.shard, set()).add(name)
+        self.assertEqual(3, len(by_shard))
+        manager = self.universe.serving_tenants['tn-0']
+        shard = ws_context.get_shard(manager.tenant.urls)
+        with mock.patch.object(shard.session, 'has_events',
+                               return_value=True):
+            self.assertTrue(ws_context.has_event(manager.tenant.urls))
+        self.assertFalse(ws_context.has_event(ws_context.EMPTY_URLS))
+        # Only the tenants of a reconnected session are reset
+        ws_context.shards[1].is_session_reconnected = True
+        self.assertTrue(ws_context.is_session_reconnected)
+
+        def reconnect(context, tenants):
+            # Another shard reconnects while the first one is handled
+            if reset.call_count == 1:
+                ws_context.shards[2].is_session_reconnected = True
+
+        with mock.patch.object(self.universe, 'reset',
+                               side_effect=reconnect) as reset:
+            self.universe.serve(self.ctx, tenant_list)
+            self.assertEqual(by_shard[1], set(reset.call_args[0][1]))
+            # The later reconnection is not lost
+            self.assertFalse(ws_context.shards[1].is_session_reconnected)
+            self.assertTrue(ws_context.is_session_reconnected)
+            self.universe.serve(self.ctx, tenant_list)
+            self.assertEqual(by_shard[2], set(reset.call_args[0][1]))
+        self.assertFalse(ws_context.is_session_reconnected)
+
     def test_track_universe_actions(self):
         # When AIM is the current state, created objects are in ACI form,
         # deleted objects are in AIM form
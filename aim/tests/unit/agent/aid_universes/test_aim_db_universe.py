@@ -13,10 +13,12 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from apicapi import apic_client
 import mock
 
 from aim.agent.aid.universes.aci import converter
 from aim.agent.aid.universes import aim_universe
+from aim.agent.aid.universes import base_universe
 from aim import aim_manager
 from aim.api import resource
 from aim.api import service_graph as aim_service_graph
@@ -553,6 +555,211 @@ class TestAimDbUniverse(TestAimDbUniverseBase, base.TestAimDBBase):
         self.assertEqual('uni/tn-t1/BD-b', purge[0][1].dn)
         self.universe.max_backoff_time = old_backoff_time
 
+    def test_keys_to_bare_aci_objects(self):
+        keys = [('fvTenant|t1', 'fvBD|bd1'),
+                ('fvTenant|t1', 'fvBD|bd1', 'fvRsCtx|rsctx'),
+                ('fvTenant|t1', 'fvBD|bd1', 'faultInst|901'),
+                ('fvTenant|t1', 'fvAp|ap', 'fvAEPg|epg'),
+                ('vmmProvP|OpenStack', 'vmmDomP|os', 'vmmCtrlrP|ctrl')]
+        dn_mgr = apic_client.DNManager()
+        builder = base_universe.KeyDnBuilder()
+        result = self.universe._keys_to_bare_aci_objects(
+            keys, dn_builder=builder)
+        self.assertEqual(
+            [{'fvBD': {'attributes': {'dn': 'uni/tn-t1/BD-bd1'}}},
+             {'fvRsCtx': {'attributes': {'dn': 'uni/tn-t1/BD-bd1/rsctx'}}},
+             {'faultInst': {'attributes': {
+                 'dn': 'uni/tn-t1/BD-bd1/fault-901', 'code': '901'}}},
+             {'fvAEPg': {'attributes': {'dn': 'uni/tn-t1/ap-ap/epg-epg'}}},
+             {'vmmCtrlrP': {'attributes': {
+                 'dn': 'uni/vmmp-OpenStack/dom-os/ctrlr-ctrl'}}}], result)
+        for key in keys[:2] + keys[3:]:
+            self.assertEqual(dn_mgr.build(self.universe._split_key(key)),
+                             builder.build(self.universe._split_key(key)))
+        # Ancestors are built only once
+        self.assertIn((('fvTenant', 't1'),), builder._dns)
+        self.assertEqual(1, len([x for x in builder._dns
+                                 if x and x[-1] == ('fvBD', 'bd1')]))
+
+    def test_get_resources_single_lookup(self):
+        bd = resource.BridgeDomain(tenant_name='t1', name='bd1',
+                                   vrf_name='vrf')
+        epg = resource.EndpointGroup(tenant_name='t1', app_profile_name='ap',
+                                     name='epg', bd_name='bd1')
+        cfg_tree = tree.StructuredHashTree()
+        tree_manager.AimHashTreeMaker().update(cfg_tree, [bd, epg])
+        keys = [('fvTenant|t1', 'fvBD|bd1'),
+                ('fvTenant|t1', 'fvAp|ap', 'fvAEPg|epg')]
+        with mock.patch.object(tree.StructuredHashTree, 'find') as find:
+            result = self.universe.get_resources(
+                list(keys), desired_state=[{'tn-t1': cfg_tree}, {}])
+            self.assertFalse(find.called)
+        self.assertEqual({bd.dn, epg.dn}, set(x.dn for x in result))
+        self.assertEqual('vrf', [x for x in result
+                                 if x.dn == bd.dn][0].vrf_name)
+        self.assertEqual('bd1', [x for x in result
+                                 if x.dn == epg.dn][0].bd_name)
+
+    def test_reconcile_skips_clean_roots(self):
+        def make_tree(root, *keys):
+            return tree.StructuredHashTree().include(
+                [{'key': ('fvTenant|%s' % root,) + k} for k in keys])
+
+        desired = mock.Mock()
+        desired.state = {'tn-t1': make_tree('t1', ('fvBD|b',)),
+                         'tn-t2': make_tree('t2', ('fvBD|b',))}
+        desired.get_resources.return_value = []
+        desired.is_read_only.return_value = False
+        self.universe._state = {'tn-t1': make_tree('t1', ('fvBD|b',)),
+                                'tn-t2': make_tree('t2', ('fvBD|b',))}
+        self.universe.get_resources_for_delete = mock.Mock(return_value=[])
+        self.universe.update_status_objects = mock.Mock()
+        self.universe.push_resources = mock.Mock()
+
+        self.assertFalse(self.universe._reconcile(self.ctx, desired))
+        self.assertEqual(2, self.universe.push_resources.call_count)
+        self.assertEqual({'tn-t1', 'tn-t2'},
+                         set(self.universe._reconciled_roots))
+        # Nothing moved, both roots are skipped
+        self.universe.push_resources.reset_mock()
+        self.assertFalse(self.universe._reconcile(self.ctx, desired))
+        self.assertEqual(0, self.universe.push_resources.call_count)
+        # Desired state of t1 changes, only t1 is reconciled
+        desired.state['tn-t1'].add(('fvTenant|t1', 'fvBD|c'))
+        self.assertTrue(self.universe._reconcile(self.ctx, desired))
+        self.assertEqual(1, self.universe.push_resources.call_count)
+        self.assertNotIn('tn-t1', self.universe._reconciled_roots)
+        self.assertIn('tn-t2', self.universe._reconciled_roots)
+        # t1 stays dirty until both sides converge
+        self.universe.push_resources.reset_mock()
+        self.universe._reconcile(self.ctx, desired)
+        self.assertEqual(1, self.universe.push_resources.call_count)
+        self.universe.state['tn-t1'].add(('fvTenant|t1', 'fvBD|c'))
+        self.assertFalse(self.universe._reconcile(self.ctx, desired))
+        self.assertIn('tn-t1', self.universe._reconciled_roots)
+        # Pending retries force the root to be reconciled again
+        self.universe.push_resources.reset_mock()
+        self.universe._sync_log['tn-t2'] = {
+            'create': {'res': {}}, 'delete': {}}
+        self.universe._reconcile(self.ctx, desired)
+        self.assertEqual(1, self.universe.push_resources.call_count)
+        # Roots that are not served anymore are forgotten
+        desired.state.pop('tn-t2')
+        self.universe._reconcile(self.ctx, desired)
+        self.assertEqual({'tn-t1'}, set(self.universe._reconciled_roots))
+        # As well as deleted roots
+        self.universe.finalize_deletion_candidates(self.ctx, desired,
+                                                   {'tn-t1'})
+        self.assertEqual({}, self.universe._reconciled_roots)
+
+    def test_reconcile_read_only_roots(self):
+        desired = mock.Mock()
+        desired.state = {'tn-t1': tree.StructuredHashTree().include(
+            [{'key': ('fvTenant|t1', 'fvBD|b')}])}
+        desired.is_read_only.return_value = True
+        self.universe._state = {'tn-t1': tree.StructuredHashTree()}
+        self.universe.get_resources_for_delete = mock.Mock(return_value=[])
+        self.universe.push_resources = mock.Mock()
+        self.universe.update_status_objects = mock.Mock()
+        # Differences are found, but not acted upon
+        self.assertTrue(self.universe._reconcile(self.ctx, desired))
+        self.assertFalse(self.universe.push_resources.called)
+        self.assertFalse(self.universe.update_status_objects.called)
+        self.assertFalse(desired.get_resources.called)
+        self.assertNotIn('tn-t1', self.universe._reconciled_roots)
+        desired.is_read_only.return_value = False
+        desired.get_resources.return_value = []
+        self.universe._reconcile(self.ctx, desired)
+        self.assertTrue(self.universe.push_resources.called)
+
+    def test_reconcile_priority(self):
+        def make_tree(root, size):
+            return tree.StructuredHashTree().include(
+                [{'key': ('fvTenant|%s' % root, 'fvBD|b%s' % x)}
+                 for x in range(size)])
+
+        desired = mock.Mock()
+        desired.state = {'tn-small': make_tree('small', 1),
+                         'tn-big': make_tree('big', 15),
+                         'tn-bg': make_tree('bg', 2)}
+        self.universe._state = {'tn-small': tree.StructuredHashTree(),
+                                'tn-big': tree.StructuredHashTree(),
+                                'tn-bg': tree.StructuredHashTree()}
+        # Roots never synced are background work
+        self.universe._synced_roots = {'tn-small', 'tn-big'}
+        reconciled = []
+
+        def reconcile_root(context, other, tenant, *args):
+            reconciled.append(tenant)
+            return True
+        self.universe._reconcile_root = reconcile_root
+
+        self.assertTrue(self.universe._reconcile(self.ctx, desired))
+        self.assertEqual(['tn-small', 'tn-big', 'tn-bg'], reconciled)
+        # Waiting roots get promoted
+        del reconciled[:]
+        self.universe._dirty_since['tn-bg'] -= 60
+        self.universe._reconcile(self.ctx, desired)
+        self.assertEqual(['tn-bg', 'tn-small', 'tn-big'], reconciled)
+        # Pending actions make a root more expensive
+        del reconciled[:]
+        self.universe._dirty_since = {}
+        self.universe._sync_log['tn-small'] = {
+            'create': dict(('res%s' % x, {}) for x in range(15)),
+            'delete': {}}
+        self.universe._reconcile(self.ctx, desired)
+        self.assertEqual(['tn-big', 'tn-small', 'tn-bg'], reconciled)
+
+    def test_reconcile_time_budget(self):
+        desired = mock.Mock()
+        desired.state = dict(
+            ('tn-t%s' % x, tree.StructuredHashTree().include(
+                [{'key': ('fvTenant|t%s' % x, 'fvBD|b')}]))
+            for x in range(3))
+        self.universe._state = dict((x, tree.StructuredHashTree())
+                                    for x in desired.state)
+        reconciled = []
+
+        def reconcile_root(context, other, tenant, *args):
+            reconciled.append(tenant)
+            return False
+        self.universe._reconcile_root = reconcile_root
+        self.universe.reconcile_time_budget = 3
+        now = [1000]
+
+        def get_time():
+            now[0] += 4
+            return now[0]
+        with mock.patch('aim.common.utils.get_time', side_effect=get_time):
+            # At least one root is reconciled, the rest is deferred
+            self.assertTrue(self.universe._reconcile(self.ctx, desired))
+            self.assertEqual(1, len(reconciled))
+            self.assertEqual(set(desired.state),
+                             set(self.universe._dirty_since))
+            self.universe.reconcile_time_budget = 0
+            self.assertFalse(self.universe._reconcile(self.ctx, desired))
+            self.assertEqual(4, len(reconciled))
+            self.assertEqual(set(desired.state), set(reconciled))
+
+    def test_observe_invalidates_reconciled_roots(self):
+        other = aim_universe.AimDbUniverse().initialize(
+            aim_cfg.ConfigManager(self.ctx, ''), [])
+        self.universe.multiverse.append(
+            {'desired': other, 'current': self.universe})
+        self.universe.serve(self.ctx, ['tn-t1', 'tn-t2'])
+        for universe in [self.universe, other]:
+            universe._reconciled_roots = {'tn-t1': ('a', 'b'),
+                                          'tn-t2': ('a', 'b')}
+        # Status changes only touch metadata, but the action log still
+        # reports their roots.
+        with mock.patch('aim.db.hashtree_db_listener.HashTreeDbListener.'
+                        'catch_up_with_action_log',
+                        return_value={'tn-t1'}):
+            self.universe.observe(self.ctx)
+        for universe in [self.universe, other]:
+            self.assertEqual({'tn-t2': ('a', 'b')},
+                             universe._reconciled_roots)
+
 
 class TestAimDbOperationalUniverse(TestAimDbUniverseBase, base.TestAimDBBase):
 
@@ -13,8 +13,11 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import copy
 import pprint
 
+import mock
+
 from aim.agent.aid.universes.aci import converter
 from aim.agent.aid.universes.aci.converters import (
     service_graph as conv_service_graph)
@@ -4949,3 +4952,50 @@ class TestAimToAciConverterSpanSpanlbl(TestAimToAciConverterBase,
                   dn=('uni/infra/vsrcgrp-testSrcGrp/spanlbl-testDestGrp1'),
                   nameAlias='', tag='yellow-green')]
     ]
+
+
+class TestConversionPlan(base.TestAimDBBase):
+
+    def test_plan_cached(self):
+        resource_map = converter.resource_map
+        plan = converter._get_conversion_plan(resource_map, 'fvBD')
+        self.assertIs(plan,
+                      converter._get_conversion_plan(resource_map, 'fvBD'))
+        self.assertIsNone(
+            converter._get_conversion_plan(resource_map, 'fooBar'))
+        helper = converter.resource_map['fvBD'][0]
+        conv_plan = conv_utils.get_conversion_plan(helper, to_aim=True)
+        self.assertIs(conv_plan,
+                      conv_utils.get_conversion_plan(helper, to_aim=True))
+        self.assertIsNot(conv_plan,
+                         conv_utils.get_conversion_plan(helper, to_aim=False))
+        self.assertEqual({'enable_arp_flood': True},
+                         conv_plan.convert_attribute({'arpFlood': 'yes'},
+                                                     'arpFlood'))
+        self.assertEqual('limit_ip_learn_to_subnets',
+                         conv_utils.convert_attribute('limitIpLearnToSubnets'))
+
+    def test_plan_cache_bounded(self):
+        # Plans of both converters share the same bounded cache
+        self.assertIs(
+            converter._get_conversion_plan(converter.resource_map, 'fvBD'),
+            conv_utils._conversion_plans[
+                (id(converter.resource_map['fvBD']), 'steps')][1])
+        with mock.patch.object(conv_utils, 'MAX_CONVERSION_PLANS', 10):
+            # Helpers built on the fly
+            for x in range(25):
+                conv_utils.get_conversion_plan({'resource': 'fvBD'})
+                self.assertTrue(len(conv_utils._conversion_plans) <= 10)
+
+    def test_input_not_modified(self):
+        bd = resource.BridgeDomain(tenant_name='t1', name='bd1',
+                                   display_name='BD 1')
+        before = dict(bd.__dict__)
+        aci = converter.AimToAciModelConverter().convert([bd])
+        self.assertEqual(before, bd.__dict__)
+        fv_bd = [x for x in aci if 'fvBD' in x][0]
+        self.assertEqual('BD 1', fv_bd['fvBD']['attributes']['nameAlias'])
+        before = copy.deepcopy(aci)
+        aim = converter.AciToAimModelConverter().convert(aci)
+        self.assertEqual(before, aci)
+        self.assertEqual('BD 1', aim[0].display_name)
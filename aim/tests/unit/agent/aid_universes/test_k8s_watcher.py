@@ -16,6 +16,7 @@
 import copy
 import mock
 from mock import patch
+import random
 import time
 
 from aim.agent.aid.universes.k8s import k8s_watcher
@@ -26,6 +27,50 @@ from aim.k8s import api_v1
 from aim.tests import base
 
 
+class FakeWatchStream(object):
+    """Watch stream generating churn on Bridge Domains
+
+    Can replace Watch.stream. Every BD is added first, then random ones are
+    modified until the requested number of events is reached. The display
+    name each BD ends up with is kept in 'expected'.
+    """
+
+    def __init__(self, store, tenants, objects, events, seed=None):
+        self.store = store
+        self.tenants = tenants
+        self.objects = objects
+        self.events = events
+        self.random = random.Random(seed)
+        self.expected = {}
+
+    def make_event(self, event_type, tenant, name, display_name=''):
+        bd = resource.BridgeDomain(tenant_name='tn-load-%s' % tenant,
+                                   name='bd-%s' % name,
+                                   display_name=display_name)
+        db_obj = self.store.make_db_obj(bd)
+        db_obj.update({'kind': db_obj.kind,
+                       'apiVersion': db_obj.api_version})
+        self.expected[(tenant, name)] = display_name
+        return {'type': event_type, 'object': db_obj}
+
+    def __call__(self, func, k8s_type, **kwargs):
+        if k8s_type != api_v1.AciContainersObject:
+            return
+        count = 0
+        for tenant in range(self.tenants):
+            for name in range(self.objects):
+                if count >= self.events:
+                    return
+                yield self.make_event('ADDED', tenant, name)
+                count += 1
+        while count < self.events:
+            yield self.make_event(
+                'MODIFIED', self.random.randrange(self.tenants),
+                self.random.randrange(self.objects),
+                display_name=str(count))
+            count += 1
+
+
 class TestK8SWatcher(base.TestAimDBBase):
 
     def setUp(self):
@@ -350,3 +395,212 @@ class TestK8SWatcher(base.TestAimDBBase):
         watcher._check_time -= 30 * 60
         # dies
         self.assertIsNotNone(watcher._check_observers())
+
+    @base.requires(['k8s'])
+    def test_sharded_builders(self):
+        self.set_override('k8s_watcher_workers', 3, 'aim_k8s')
+        self.set_override('k8s_watcher_flush_size', 2, 'aim_k8s')
+        watcher = k8s_watcher.K8sWatcher()
+        self.assertEqual(3, len(watcher.shards))
+        events = []
+        for tn in ['t1', 't2', 't3', 't4']:
+            for name in ['bd1', 'bd2', 'bd1']:
+                bd = resource.BridgeDomain(tenant_name=tn, name=name,
+                                           display_name=str(len(events)))
+                bd_db_obj = self.ctx.store.make_db_obj(bd)
+                bd_db_obj.update({'kind': bd_db_obj.kind,
+                                  'apiVersion': bd_db_obj.api_version})
+                events.append({'type': 'ADDED', 'object': bd_db_obj})
+        for ev in events:
+            watcher._dispatch_event(ev)
+        # Events of the same root are queued in order on the same shard
+        for tn in ['t1', 't2', 't3', 't4']:
+            shard = watcher._get_shard('tn-' + tn)
+            queued = [x[1]['resource'] for x in list(shard.q.queue)
+                      if x['resource'].tenant_name == tn]
+            self.assertEqual(['bd1', 'bd2', 'bd1'],
+                             [x.name for x in queued])
+            self.assertTrue(int(queued[0].display_name) <
+                            int(queued[2].display_name))
+        # Batches are saved when the size threshold is reached
+        with mock.patch.object(watcher, '_save_trees') as save:
+            for shard in watcher.shards:
+                while not shard.q.empty():
+                    watcher._builder_loop(shard)
+            saved = set()
+            for call in save.call_args_list:
+                self.assertTrue(len(call[0][0]) <= 2)
+                saved |= call[0][0]
+            self.assertEqual(set(['tn-t1', 'tn-t2', 'tn-t3', 'tn-t4']),
+                             saved)
+        bd = resource.BridgeDomain(tenant_name='t1', name='bd1')
+        cfg_tree = watcher.trees['config']['tn-t1']
+        self.assertIsNotNone(cfg_tree.find(
+            watcher.tt_builder.tt_maker._build_hash_tree_key(bd)))
+
+        # Events dequeued before a reset of the trees are dropped
+        shard = watcher._get_shard('tn-t1')
+        watcher._dispatch_event(events[0])
+        dequeued = shard.get_event()
+        with watcher._lock_shards():
+            watcher._reset_trees()
+        shard.q.put(dequeued)
+        with mock.patch.object(watcher, '_process_parsed_event') as process:
+            watcher._builder_loop(shard)
+            self.assertFalse(process.called)
+
+    @base.requires(['k8s'])
+    def test_fake_watch_stream_load(self):
+        self.set_override('k8s_watcher_workers', 3, 'aim_k8s')
+        self.set_override('k8s_watcher_flush_size', 25, 'aim_k8s')
+        self.set_override('k8s_watcher_flush_interval', 0, 'aim_k8s')
+
+        def build(events):
+            watcher = k8s_watcher.K8sWatcher()
+            for event in events:
+                watcher.q.put(event)
+            with mock.patch.object(watcher, '_save_trees') as save:
+                while not watcher.q.empty():
+                    watcher._dispatch_loop()
+                for shard in watcher.shards:
+                    while not shard.q.empty():
+                        watcher._builder_loop(shard)
+            saved = set()
+            for call in save.call_args_list:
+                saved |= call[0][0]
+            return watcher, saved
+
+        stream = FakeWatchStream(self.ctx.store, 4, 10, 200, seed=0)
+        self.assertEqual([], list(stream(None, api_v1.Pod)))
+        watcher, saved = build(stream(None, api_v1.AciContainersObject))
+        roots = set('tn-tn-load-%s' % x for x in range(4))
+        self.assertEqual(roots, saved)
+        # Every root ends up with the last state of its objects, as if only
+        # that state was received
+        final = FakeWatchStream(self.ctx.store, 4, 10, 0)
+        expected, _ = build(
+            final.make_event('ADDED', tenant, name, display_name=value)
+            for (tenant, name), value in stream.expected.items())
+        for root in roots:
+            self.assertEqual(
+                expected.trees['config'][root].root_full_hash,
+                watcher.trees['config'][root].root_full_hash)
+
+    @base.requires(['k8s'])
+    def test_resume_watch(self):
+        watcher = k8s_watcher.K8sWatcher()
+        watcher._renew_klient_watch()
+        watcher._needs_init = False
+        watcher._observe_thread_state[1] = {'watch_stop': False}
+        ev = {'type': 'MODIFIED',
+              'object': {'kind': 'Pod', 'spec': {},
+                         'metadata': {'name': 'pod1',
+                                      'resourceVersion': '42'}}}
+        stream_mock = mock.Mock(return_value=[ev])
+        with patch.object(watcher.klient.watch, 'stream', new=stream_mock):
+            watcher._observe_objects(watcher.klient.watch.stream,
+                                     api_v1.Pod, 1)
+        self.assertEqual('42', watcher._version_by_type[api_v1.Pod])
+        self.assertIsNone(
+            watcher._observe_thread_state[1].get('watch_exception'))
+
+        # Watches are resumed without rebuilding the trees
+        watcher._stop_observers(k8s_watcher.K8SObserverStopped())
+        self.assertFalse(watcher._needs_init)
+        with patch.object(watcher, '_observe_objects') as observe:
+            with patch.object(watcher, '_reset_trees') as reset:
+                watcher._start_observers([api_v1.Pod])
+                self.assertFalse(reset.called)
+            time.sleep(1)  # yield
+            observe.assert_called_once_with(mock.ANY, api_v1.Pod, 0, '42')
+
+        # Expired versions rebuild the trees
+        gone = {'type': 'ERROR', 'object': {'kind': 'Status', 'code': 410}}
+        watcher._observe_thread_state[1] = {'watch_stop': False}
+        stream_mock = mock.Mock(return_value=[gone])
+        with patch.object(watcher.klient.watch, 'stream', new=stream_mock):
+            watcher._observe_objects(watcher.klient.watch.stream,
+                                     api_v1.Pod, 1)
+        exc = watcher._observe_thread_state[1]['watch_exception']
+        self.assertTrue(isinstance(exc,
+                                   k8s_watcher.K8SResourceVersionExpired))
+        watcher._stop_observers(exc)
+        self.assertTrue(watcher._needs_init)
+
+    @base.requires(['k8s'])
+    def test_sync_trees(self):
+        watcher = k8s_watcher.K8sWatcher()
+        watcher.event_handler = mock.Mock()
+
+        def bd_event(tenant, name, display_name=''):
+            bd = resource.BridgeDomain(tenant_name=tenant, name=name,
+                                       display_name=display_name)
+            db_obj = self.ctx.store.make_db_obj(bd)
+            db_obj.update({'kind': db_obj.kind,
+                           'apiVersion': db_obj.api_version})
+            return {'type': 'ADDED', 'object': db_obj}
+
+        for ev in [bd_event('t1', 'bd1'), bd_event('t2', 'bd1'),
+                   bd_event('t3', 'bd1')]:
+            watcher.q.put(ev)
+        watcher._persistence_loop(save_on_empty=True, warmup_wait=0)
+        self.assertEqual(set(['tn-t1', 'tn-t2', 'tn-t3']),
+                         set(self.tt_mgr.get_roots(self.ctx)) &
+                         set(['tn-t1', 'tn-t2', 'tn-t3']))
+
+        # Re-list: t1 unchanged, t2 changed, t3 gone
+        watcher._reset_trees()
+        for ev in [bd_event('t1', 'bd1'), bd_event('t2', 'bd1', 'new')]:
+            watcher.q.put(ev)
+        with patch.object(watcher, '_save_trees') as save:
+            watcher._persistence_loop(save_on_empty=True, warmup_wait=0,
+                                      sync=True)
+            saved = set()
+            for call in save.call_args_list:
+                saved |= call[0][0]
+            self.assertEqual(set(['tn-t2']), saved)
+        self.assertFalse('tn-t3' in self.tt_mgr.get_roots(self.ctx))
+        self.assertTrue('tn-t1' in self.tt_mgr.get_roots(self.ctx))
+
+    @base.requires(['k8s'])
+    def test_aux_event_owner_index(self):
+        watcher = k8s_watcher.K8sWatcher()
+        store = self.ctx.store
+        svc = resource.VmmInjectedService(
+            domain_type='Kubernetes', domain_name='kubernetes',
+            controller_name='kube-cluster', namespace_name='ns1',
+            name='svc1',
+            endpoints=[{'ip': '1.2.3.4', 'pod_name': 'foo'},
+                       {'ip': '2.1.3.4', 'pod_name': 'bar'}])
+        svc_db_obj = store.make_db_obj(svc)
+        ep_db_obj = svc_db_obj.endpoints
+
+        def event(ev_type, db_obj):
+            obj = {'kind': db_obj.kind, 'apiVersion': db_obj.api_version}
+            obj.update(copy.deepcopy(db_obj))
+            return {'type': ev_type, 'object': obj}
+
+        # Service events populate the index
+        with patch.object(store, 'query') as query:
+            watcher._parse_event(event('ADDED', svc_db_obj))
+            res = watcher._parse_event(event('ADDED', ep_db_obj))
+            self.assertFalse(query.called)
+        self.assertEqual('modified', res['event_type'])
+        self.assertEqual('svc1', res['resource'].name)
+        self.assertEqual(svc.endpoints, res['resource'].endpoints)
+
+        ep_db_obj['subsets'][0]['addresses'] = (
+            ep_db_obj['subsets'][0]['addresses'][:-1])
+        with patch.object(store, 'query') as query:
+            res = watcher._parse_event(event('MODIFIED', ep_db_obj))
+            self.assertEqual(svc.endpoints[:-1], res['resource'].endpoints)
+            res = watcher._parse_event(event('DELETED', ep_db_obj))
+            self.assertEqual([], res['resource'].endpoints)
+            self.assertFalse(query.called)
+
+        # Unknown owners are read from the store
+        watcher._parse_event(event('DELETED', svc_db_obj))
+        with patch.object(store, 'query', return_value=[]) as query:
+            self.assertIsNone(
+                watcher._parse_event(event('ADDED', ep_db_obj)))
+            self.assertTrue(query.called)
@@ -0,0 +1,80 @@
+# Copyright (c) 2016 Cisco Systems
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from aim.agent.aid.event_services import rpc
+from aim.tests import base
+
+
+class TestNotificationDebouncer(base.TestAimDBBase):
+
+    def setUp(self):
+        super(TestNotificationDebouncer, self).setUp()
+        self.now = 0
+        self.debouncer = rpc.NotificationDebouncer(clock=lambda: self.now)
+        self.send = mock.Mock()
+        timer = mock.patch('aim.agent.aid.event_services.rpc.threading.Timer')
+        self.timer = timer.start()
+        self.addCleanup(timer.stop)
+
+    def _notify(self, method, server=None, roots=None):
+        self.debouncer.notify(self.send, {}, method, server, roots=roots,
+                              window=1)
+
+    def _expire(self, server=None):
+        self.debouncer._flush(server, 1)
+
+    def test_coalesce(self):
+        # First notification goes out right away
+        self._notify('reconcile', roots=['tn-a'])
+        self.send.assert_called_once_with({}, 'reconcile', None,
+                                          roots=['tn-a'])
+        self.assertFalse(self.timer.called)
+        self.send.reset_mock()
+        # The following are merged until the window expires
+        self.now = 0.2
+        self._notify('reconcile', roots=['tn-b'])
+        self._notify('reconcile', roots=['tn-a'])
+        self.assertFalse(self.send.called)
+        self.timer.assert_called_once_with(0.8, mock.ANY, args=(None, 1))
+        # Windows are per target
+        self._notify('reconcile', roots=['tn-c'], server='other')
+        self.send.assert_called_once_with({}, 'reconcile', 'other',
+                                          roots=['tn-c'])
+        self.send.reset_mock()
+        self._expire()
+        self.send.assert_called_once_with({}, 'reconcile', None,
+                                          roots=['tn-a', 'tn-b'])
+        self.send.reset_mock()
+        # Flushing starts a new window, serve supersedes reconcile
+        self.now = 1.0
+        self._notify('reconcile', roots=['tn-a'])
+        self._notify('serve')
+        self._notify('reconcile', roots=['tn-b'])
+        self._expire()
+        self.send.assert_called_once_with({}, 'serve', None, roots=None)
+        self.send.reset_mock()
+        # Idle again
+        self.now = 10
+        self._notify('reconcile')
+        self.send.assert_called_once_with({}, 'reconcile', None, roots=None)
+
+    def test_no_window(self):
+        for x in range(3):
+            self.debouncer.notify(self.send, {}, 'reconcile', None,
+                                  roots=['tn-a'], window=0)
+        self.assertEqual(3, self.send.call_count)
+        self.assertFalse(self.timer.called)
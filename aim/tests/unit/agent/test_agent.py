@@ -20,6 +20,7 @@ from apicapi import apic_client
 from apicapi import exceptions as aexc
 import mock
 
+from aim.agent.aid import event_handler
 from aim.agent.aid import service
 from aim.agent.aid.universes.aci import aci_universe
 from aim import aim_manager
@@ -237,6 +238,62 @@ class TestAgent(base.TestAimDBBase, test_aci_tenant.TestAciClientMixin):
         self.assertEqual(set(['keyA', 'keyA1', 'keyA2']),
                          set(result + result2 + result3))
 
+    def test_calculate_tenants_weighted(self):
+        # One big tenant and many small ones
+        trees = [tree.StructuredHashTree().include(
+            [{'key': ('keyBig', 'key%s' % x)} for x in range(300)])]
+        for y in range(10):
+            trees.append(tree.StructuredHashTree().include(
+                [{'key': ('keyS%s' % y, 'key%s' % x)} for x in range(10)]))
+        self.tree_manager.update_bulk(self.ctx, trees)
+        agent = self._create_agent()
+        agent2 = self._create_agent(host='h2')
+        result = agent._calculate_tenants(self.ctx)
+        result2 = agent2._calculate_tenants(self.ctx)
+        # All the tenants are served exactly once
+        self.assertEqual(set(['keyBig'] + ['keyS%s' % x for x in range(10)]),
+                         set(result + result2))
+        self.assertEqual(set(), set(result) & set(result2))
+        # The big tenant is served alone
+        self.assertEqual(['keyBig'], [result, result2][
+            'keyBig' not in result])
+        # Both agents used the same weights, read from the stored trees
+        # without loading them
+        sizes = self.tree_manager.get_sizes(self.ctx)
+        self.assertEqual(
+            set(['keyBig'] + ['keyS%s' % x for x in range(10)]), set(sizes))
+        self.assertTrue(sizes['keyBig'] > 10 * sizes['keyS0'])
+        with mock.patch.object(agent.tree_manager, 'find') as find, \
+                mock.patch.object(agent.tree_manager,
+                                  'find_changed') as find_changed:
+            self.assertEqual(
+                agent._get_tenant_weights(self.ctx, list(sizes)),
+                agent2._get_tenant_weights(self.ctx, list(sizes)))
+            self.assertFalse(find.called)
+            self.assertFalse(find_changed.called)
+
+        # Ring is not rebuilt if nothing changed
+        with mock.patch.object(agent.ring, 'add_nodes') as add_nodes:
+            self.assertEqual(result, agent._calculate_tenants(self.ctx))
+            self.assertFalse(add_nodes.called)
+        # Changing an agent capacity updates the ring
+        self.set_override('agent_capacity', 3, 'aim', host='h2')
+        agent._calculate_tenants(self.ctx)
+        self.assertEqual({'aid-h1': 1, 'aid-h2': 3}, agent.ring.nodes)
+
+        # Weighting can be disabled
+        agent.balance_factor = 0
+        with mock.patch.object(agent.ring, 'assign_weighted_keys') as awk:
+            agent._calculate_tenants(self.ctx)
+            self.assertFalse(awk.called)
+
+    def test_quantize_weight(self):
+        agent = self._create_agent()
+        self.assertEqual(
+            [1, 1, 2, 7, 8, 10, 10, 12, 1024, 1024, 1280],
+            [agent._quantize_weight(x) for x in
+             [0, 1, 2, 7, 8, 9, 10, 11, 1000, 1024, 1025]])
+
     @base.requires(['timestamp'])
     def test_down_time_suicide(self):
         with mock.patch.object(service.utils, 'perform_harakiri') as hara:
@@ -481,6 +538,94 @@ class TestAgent(base.TestAimDBBase, test_aci_tenant.TestAciClientMixin):
         agent.conf_manager.subs_mgr._poll_and_execute()
         self.assertEqual(130, agent.report_interval)
 
+    def test_adaptive_squash_window(self):
+        agent = self._create_agent()
+        agent.squash_time = 1
+        agent.max_squash_time = 10
+        clock = {'now': 0}
+        # Each item is the delay before an event is received
+        arrivals = []
+
+        def get_event(timeout):
+            if arrivals and arrivals[0] <= timeout:
+                clock['now'] += arrivals.pop(0)
+                return event_handler.EVENT_RECONCILE
+            clock['now'] += timeout
+            return None
+        cycles = []
+
+        def reconciliation_cycle(serve, roots=None):
+            cycles.append(clock['now'])
+            clock['now'] += 4
+
+        def run(*delays):
+            arrivals[:] = delays
+            del cycles[:]
+            clock['now'] = 0
+            agent._daemon_loop()
+            return cycles[0]
+        agent.events.get_event = get_event
+        agent._reconciliation_cycle = reconciliation_cycle
+        with mock.patch('time.time', side_effect=lambda: clock['now']):
+            with mock.patch('aim.common.utils.wait_for_next_cycle',
+                            side_effect=utils.StopLoop):
+                # An isolated event is only squashed for the squash time
+                self.assertEqual(1, run(0))
+                self.assertEqual(2, agent.cycle_time)
+                # Bursts are absorbed as long as recent cycles took
+                self.assertEqual(2, run(0, 0.5, 0.5, 0.5, 0.5, 0.5))
+                self.assertEqual(3, agent.cycle_time)
+                self.assertEqual(3, run(0, 0.5, 0.5, 0.5, 0.5, 0.5, 0.5,
+                                        0.5))
+                # A gap longer than the squash time ends the burst
+                self.assertEqual(1, run(0, 2))
+                # Up to the maximum squash time
+                agent.cycle_time = 60
+                self.assertEqual(10, run(*[0] + [0.5] * 30))
+
+    def test_root_scoped_cycle(self):
+        agent = self._create_agent()
+        # Queued events are squashed together
+        agent.squash_time = 0.01
+        agent.max_squash_time = 0.01
+        cycles = []
+
+        def reconciliation_cycle(serve, roots=None):
+            cycles.append((serve, roots))
+
+        def run(*events):
+            for event, roots in events:
+                event_handler.EventHandler._put_event(event, roots=roots)
+            del cycles[:]
+            agent._daemon_loop()
+            self.assertTrue(agent.events.q.empty())
+            return cycles[0]
+        agent._reconciliation_cycle = reconciliation_cycle
+        with mock.patch('aim.common.utils.wait_for_next_cycle',
+                        side_effect=utils.StopLoop):
+            # The first cycle is a full sweep
+            self.assertEqual(
+                (False, None),
+                run((event_handler.EVENT_RECONCILE, ['tn-1'])))
+            # Only roots in the events are observed
+            self.assertEqual(
+                (False, set(['tn-1', 'tn-2'])),
+                run((event_handler.EVENT_RECONCILE, ['tn-1']),
+                    (event_handler.EVENT_RECONCILE, ['tn-2'])))
+            self.assertEqual(
+                (False, None),
+                run((event_handler.EVENT_RECONCILE, ['tn-1']),
+                    (event_handler.EVENT_RECONCILE, None)))
+            self.assertEqual(
+                (True, None),
+                run((event_handler.EVENT_RECONCILE, ['tn-1']),
+                    (event_handler.EVENT_SERVE, None)))
+            # Unless a full sweep is due
+            agent._next_full_sweep = 0
+            self.assertEqual(
+                (False, None),
+                run((event_handler.EVENT_RECONCILE, ['tn-1'])))
+
     def test_monitored_tree_lifecycle(self):
         agent = self._create_agent()
 
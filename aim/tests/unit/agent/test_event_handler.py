@@ -60,3 +60,29 @@ class TestEventHandler(base.TestAimDBBase):
         self.sender.reconcile()
         self.assertEqual(event_handler.EVENT_RECONCILE,
                          self.handler.get_event())
+
+    def test_receive_event_roots(self):
+        self.handler.get_roots()
+        self.sender.reconcile(roots=['tn-b', 'tn-a'])
+        self.assertEqual(event_handler.EVENT_RECONCILE,
+                         self.handler.get_event())
+        self.sender.reconcile(roots=['tn-c'])
+        self.assertEqual(event_handler.EVENT_RECONCILE,
+                         self.handler.get_event())
+        self.assertEqual(set(['tn-a', 'tn-b', 'tn-c']),
+                         self.handler.get_roots())
+        # Events without roots concern all of them
+        self.sender.reconcile(roots=['tn-a'])
+        self.sender.serve()
+        self.handler.get_event()
+        self.handler.get_event()
+        self.assertIsNone(self.handler.get_roots())
+        # As well as events with too many roots
+        self.sender.reconcile(
+            roots=['tn-%s' % x for x in range(
+                event_handler.MAX_EVENT_ROOTS + 1)])
+        self.handler.get_event()
+        self.assertIsNone(self.handler.get_roots())
+        self.sender.reconcile(roots=['tn-' + 'a' * 60] * 20)
+        self.handler.get_event()
+        self.assertIsNone(self.handler.get_roots())
@@ -27,6 +27,7 @@ import jsonschema
 from jsonschema import exceptions as schema_exc
 import mock
 import six
+import sqlalchemy as sa
 from sqlalchemy.orm import exc as sql_exc
 
 from aim import aim_manager
@@ -179,6 +180,102 @@ class TestAimManager(base.TestAimDBBase):
         statuses = self.mgr.get_statuses(self.ctx, [])
         self.assertEqual(expected_statuses, statuses)
 
+    @base.requires(['sql'])
+    def test_multiple_statuses_chunked(self):
+        tenants = []
+        epgs = []
+        for i in range(5):
+            tn = self.mgr.create(self.ctx, resource.Tenant(name='t%s' % i))
+            self.mgr.create(self.ctx, resource.ApplicationProfile(
+                tenant_name=tn.name, name='ap'))
+            epg = self.mgr.create(self.ctx, resource.EndpointGroup(
+                tenant_name=tn.name, app_profile_name='ap', name='epg'))
+            tenants.append(tn)
+            epgs.append(epg)
+        statuses = set()
+        for res in tenants + epgs:
+            statuses.add(self.mgr.get_status(self.ctx, res))
+        # Resource without status is ignored
+        self.mgr.create(self.ctx, resource.Tenant(name='nostatus'))
+        requested = (tenants + epgs +
+                     [resource.Tenant(name='nostatus'),
+                      resource.Tenant(name='nonexistent')])
+        with mock.patch.object(self.ctx.store, 'in_query_chunk_size', 2):
+            self.assertEqual(statuses,
+                             set(self.mgr.get_statuses(self.ctx, requested)))
+            # Duplicates are returned once
+            self.assertEqual(
+                len(statuses),
+                len(self.mgr.get_statuses(self.ctx, requested + requested)))
+            # Resources with a known aim_id skip the join
+            with_ids = self.mgr.find(self.ctx, resource.EndpointGroup,
+                                     include_aim_id=True)
+            self.assertEqual(
+                set(x for x in statuses
+                    if x.resource_type == 'EndpointGroup'),
+                set(self.mgr.get_statuses(self.ctx, with_ids)))
+
+    @base.requires(['sql'])
+    def test_query_aim_ids(self):
+        tn = self.mgr.create(self.ctx, resource.Tenant(name='t1'))
+        self.mgr.create(self.ctx, resource.ApplicationProfile(
+            tenant_name=tn.name, name='ap'))
+        epg = self.mgr.create(self.ctx, resource.EndpointGroup(
+            tenant_name=tn.name, app_profile_name='ap', name='epg'))
+        db_tn = self.mgr._query_db_obj(self.ctx.store, tn)
+        db_epg = self.mgr._query_db_obj(self.ctx.store, epg)
+        with mock.patch.object(self.ctx.store, 'in_query_chunk_size', 1):
+            result = self.ctx.store.query_aim_ids(
+                [tn, epg, resource.Tenant(name='nonexistent')])
+        self.assertEqual(
+            {(resource.Tenant, ('t1',)): db_tn.aim_id,
+             (resource.EndpointGroup, ('t1', 'ap', 'epg')): db_epg.aim_id},
+            result)
+
+    @base.requires(['sql'])
+    def test_multiple_statuses_scale(self):
+        epgs = []
+        # Hash tree updates are irrelevant here and slow down the setup
+        with mock.patch.dict(self.ctx.store._update_listeners,
+                             {'hashtree_db_listener_on_commit':
+                              lambda *args: None}), \
+                self.ctx.store.begin(subtransactions=True):
+            for i in range(1200):
+                epg = resource.EndpointGroup(
+                    tenant_name='t1', app_profile_name='ap',
+                    name='epg-%s' % i)
+                db_obj = self.ctx.store.make_db_obj(epg)
+                db_obj.aim_id = utils.generate_uuid()
+                self.ctx.store.add(db_obj)
+                self.ctx.store.add(self.ctx.store.make_db_obj(
+                    aim_status.AciStatus(
+                        resource_type='EndpointGroup',
+                        resource_id=db_obj.aim_id, resource_root=epg.root,
+                        resource_dn=epg.dn)))
+                epgs.append(epg)
+            self.ctx.store.db_session.flush()
+
+        statements = []
+
+        def count_statements(conn, cursor, statement, *args):
+            if statement.startswith('SELECT') and 'aim_statuses' in statement:
+                statements.append(statement)
+
+        engine = self.ctx.store.db_session.get_bind()
+        sa.event.listen(engine, 'before_cursor_execute', count_statements)
+        try:
+            statuses = self.mgr.get_statuses(self.ctx, epgs)
+        finally:
+            sa.event.remove(engine, 'before_cursor_execute',
+                            count_statements)
+        self.assertEqual(len(epgs), len(statuses))
+        self.assertEqual(set(x.dn for x in epgs),
+                         set(x.resource_dn for x in statuses))
+        # One statement per chunk of identities
+        chunk_size = self.ctx.store.in_query_chunk_size
+        self.assertEqual((len(epgs) + chunk_size - 1) // chunk_size,
+                         len(statements))
+
 
 class TestResourceOpsBase(object):
     test_dn = None
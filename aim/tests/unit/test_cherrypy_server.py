@@ -18,6 +18,7 @@ import testtools
 
 import mock
 import requests
+import sqlalchemy as sa
 
 from aim import aim_manager
 from aim.api import infra as infra_res
@@ -211,3 +212,247 @@ class TestServer(base.TestAimDBBase, TestServerMixin):
         self.assertEqual('900', fault_code)
         self.assertEqual(real_status_id, status_id)
         self.assertEqual(aim_id, res_id)
+
+
+class TestAIMController(base.TestAimDBBase):
+
+    def setUp(self):
+        super(TestAIMController, self).setUp()
+        self.mgr = aim_manager.AimManager()
+        self.aimc = root.AIMController(config.CONF)
+        self.aimc.ctx = self.ctx
+        for tn in ['t1', 't2']:
+            self.mgr.create(self.ctx, api_res.Tenant(name=tn))
+            for bd in range(3):
+                self.mgr.create(self.ctx, api_res.BridgeDomain(
+                    tenant_name=tn, name='bd%s' % bd))
+
+    def _get(self, **kwargs):
+        return json.loads(
+            b''.join(self.aimc.GET(['aim'], **kwargs)).decode('utf-8'))
+
+    def test_get_pages(self):
+        full = self._get()
+        self.assertEqual(8, full['count'])
+        self.assertFalse('next_marker' in full)
+        data = []
+        marker = None
+        for _ in range(4):
+            params = {'limit': '3'}
+            if marker:
+                params['marker'] = marker
+            page = self._get(**params)
+            self.assertTrue(page['count'] <= 3)
+            data.extend(page['data'])
+            marker = page.get('next_marker')
+            if not marker:
+                break
+        self.assertIsNone(marker)
+        self.assertEqual(sorted(x['aim_id'] for x in full['data']),
+                         sorted(x['aim_id'] for x in data))
+        self.assertRaises(root.cherrypy.HTTPError, self._get,
+                          marker='tenant:nope')
+        self.assertRaises(root.cherrypy.HTTPError, self._get, limit='0')
+
+    def test_get_roots(self):
+        resp = self._get(root='tn-t1')
+        self.assertEqual(4, resp['count'])
+        for item in resp['data']:
+            self.assertEqual('t1', item['attributes'].get(
+                'tenant_name', item['attributes'].get('name')))
+        resp = self._get(root='tn-t1,tn-t2', **{'object-type': 'tenant'})
+        self.assertEqual(2, resp['count'])
+        self.assertEqual(0, self._get(root='tn-t3')['count'])
+
+    def test_get_statuses(self):
+        bd = api_res.BridgeDomain(tenant_name='t1', name='bd0')
+        self.mgr.set_resource_sync_synced(self.ctx, bd)
+        self.mgr.set_fault(self.ctx, bd, status_res.AciFault(
+            fault_code='900', external_identifier=bd.dn + '/fault-900'))
+        with mock.patch.object(self.aimc.mgr, 'get_status') as get_status:
+            resp = self._get(**{'include-status': 'true',
+                                'object-type': 'bridge_domain'})
+            self.assertFalse(get_status.called)
+        types = [x['type'] for x in resp['data']]
+        self.assertEqual(6, types.count('bridge_domain'))
+        self.assertEqual(1, types.count('aci_fault'))
+        self.assertTrue(types.count('aci_status') >= 1)
+        for item in resp['data']:
+            if item['type'] == 'aci_fault':
+                status_id = item['attributes']['status_id']
+            elif item['type'] == 'bridge_domain' and (
+                    item['attributes']['name'] == 'bd0' and
+                    item['attributes']['tenant_name'] == 't1'):
+                bd_id = item['aim_id']
+        status = [x for x in resp['data'] if x['type'] == 'aci_status' and
+                  x['attributes']['id'] == status_id][0]
+        self.assertEqual(bd_id, status['attributes']['resource_id'])
+
+    def _bulk(self, method, body, bulk='true', **kwargs):
+        flushes = []
+        commits = []
+
+        def record(changes):
+            # Ignore the hash-tree updates that follow the import
+            def _record(*args):
+                if any(isinstance(x, api_res.BridgeDomain)
+                       for res_list in args[-3:] for x in res_list):
+                    changes.append(args)
+            return _record
+
+        self.ctx.store.register_before_session_flush_callback(
+            'test_bulk', record(flushes))
+        self.ctx.store.register_after_transaction_ends_callback(
+            'test_bulk', record(commits))
+        self.addCleanup(
+            self.ctx.store.unregister_before_session_flush_callback,
+            'test_bulk')
+        self.addCleanup(
+            self.ctx.store.unregister_after_transaction_ends_callback,
+            'test_bulk')
+        with mock.patch.object(self.aimc, '_get_body', return_value=body):
+            resp = getattr(self.aimc, method)(['aim'], bulk=bulk, **kwargs)
+        return resp, flushes, commits
+
+    def _bd_item(self, tn, bd, **kwargs):
+        kwargs.update({'tenant_name': tn, 'name': bd})
+        return {'type': 'bridge_domain', 'attributes': kwargs}
+
+    def _results(self, resp):
+        return sorted((x['result'], x['identity'].get('tenant_name'),
+                       x['identity']['name']) for x in resp['data'])
+
+    def test_bulk_import(self):
+        resp, flushes, commits = self._bulk(
+            'PUT', [self._bd_item('t1', 'bd0', display_name='new'),
+                    self._bd_item('t1', 'bd1'),
+                    self._bd_item('t1', 'bd3')])
+        self.assertEqual(
+            [('created', 't1', 'bd3'), ('unchanged', 't1', 'bd1'),
+             ('updated', 't1', 'bd0')], self._results(resp))
+        if self.ctx.store.supports_hooks:
+            self.assertEqual(1, len(flushes))
+            self.assertEqual(1, len(commits))
+            _, added, updated, deleted = flushes[0]
+            self.assertEqual(['bd3'], [x.name for x in added
+                                       if x.name.startswith('bd')])
+            self.assertEqual(['bd0'], [x.name for x in updated])
+            self.assertEqual([], deleted)
+        self.assertEqual('new', self.mgr.get(self.ctx, api_res.BridgeDomain(
+            tenant_name='t1', name='bd0')).display_name)
+        self.assertEqual(7, len(self.mgr.find(self.ctx,
+                                              api_res.BridgeDomain)))
+        # Nothing to write
+        resp, flushes, commits = self._bulk(
+            'PUT', [self._bd_item('t1', 'bd0', display_name='new')])
+        self.assertEqual([('unchanged', 't1', 'bd0')], self._results(resp))
+        self.assertEqual([], flushes)
+
+    def test_bulk_replace(self):
+        resp, flushes, commits = self._bulk(
+            'POST', [self._bd_item('t1', 'bd0'),
+                     self._bd_item('t2', 'bd3')],
+            **{'object-type': 'bridge_domain'})
+        self.assertEqual(
+            [('created', 't2', 'bd3'), ('deleted', 't1', 'bd1'),
+             ('deleted', 't1', 'bd2'), ('deleted', 't2', 'bd0'),
+             ('deleted', 't2', 'bd1'), ('deleted', 't2', 'bd2'),
+             ('unchanged', 't1', 'bd0')], self._results(resp))
+        if self.ctx.store.supports_hooks:
+            self.assertEqual(1, len(flushes))
+            self.assertEqual(1, len(commits))
+        self.assertEqual(
+            [('t1', 'bd0'), ('t2', 'bd3')],
+            sorted((x.tenant_name, x.name) for x in self.mgr.find(
+                self.ctx, api_res.BridgeDomain)))
+        # Other types are out of scope
+        self.assertEqual(2, len(self.mgr.find(self.ctx, api_res.Tenant)))
+
+    def test_bulk_invalid(self):
+        self.assertRaises(
+            root.cherrypy.HTTPError, self._bulk, 'PUT',
+            [self._bd_item('t1', 'bd3'), {'type': 'nope', 'attributes': {}}])
+        self.assertIsNone(self.mgr.get(self.ctx, api_res.BridgeDomain(
+            tenant_name='t1', name='bd3')))
+
+    def test_bulk_invalid_attributes(self):
+        # Identity attributes missing
+        self.assertRaises(
+            root.cherrypy.HTTPError, self._bulk, 'PUT',
+            [{'type': 'bridge_domain', 'attributes': {'name': 'bd3'}}])
+        self.assertEqual([], self.mgr.find(self.ctx, api_res.BridgeDomain,
+                                           name='bd3'))
+
+    def test_bulk_flag(self):
+        with mock.patch.object(self.aimc, '_bulk_import') as bulk_import:
+            for value in ['false', '0', 'no']:
+                self._bulk('PUT', [self._bd_item('t1', 'bd3')], bulk=value)
+            self.assertFalse(bulk_import.called)
+            self._bulk('PUT', [self._bd_item('t1', 'bd4')], bulk='1')
+            self.assertTrue(bulk_import.called)
+        self.assertIsNotNone(self.mgr.get(self.ctx, api_res.BridgeDomain(
+            tenant_name='t1', name='bd3')))
+        self.assertRaises(root.cherrypy.HTTPError, self._bulk, 'PUT',
+                          [self._bd_item('t1', 'bd5')], bulk='maybe')
+
+    def test_bulk_replace_status(self):
+        bd = api_res.BridgeDomain(tenant_name='t1', name='bd1')
+        self.mgr.set_fault(self.ctx, bd, status_res.AciFault(
+            fault_code='900', external_identifier=bd.dn + '/fault-900'))
+        status = self.mgr.get_status(self.ctx, bd)
+        self.assertIsNotNone(status)
+        self.mgr.get_status(self.ctx, api_res.BridgeDomain(
+            tenant_name='t1', name='bd2'))
+        statements = []
+
+        def count_statements(conn, cursor, statement, *args):
+            if statement.startswith('SELECT') and 'aim_statuses' in statement:
+                statements.append(statement)
+
+        db_session = getattr(self.ctx.store, 'db_session', None)
+        if db_session:
+            engine = db_session.get_bind()
+            sa.event.listen(engine, 'before_cursor_execute',
+                            count_statements)
+            self.addCleanup(sa.event.remove, engine,
+                            'before_cursor_execute', count_statements)
+        resp, flushes, _ = self._bulk(
+            'POST', [self._bd_item('t1', 'bd0')],
+            **{'object-type': 'bridge_domain', 'tenant_name': 't1'})
+        if db_session:
+            # The statuses of all the deleted objects are retrieved at once
+            self.assertEqual(1, len(statements))
+        self.assertEqual(
+            [('deleted', 't1', 'bd1'), ('deleted', 't1', 'bd2'),
+             ('unchanged', 't1', 'bd0')], self._results(resp))
+        if self.ctx.store.supports_hooks:
+            self.assertEqual(1, len(flushes))
+        # The status of the deleted object is gone with it
+        self.assertIsNone(self.mgr.get(self.ctx, status))
+        self.assertIsNone(self.mgr.get_status(self.ctx, bd,
+                                              create_if_absent=False))
+
+    def test_bulk_replace_monitored_pending(self):
+        bd = self.mgr.create(self.ctx, api_res.BridgeDomain(
+            tenant_name='t1', name='bd3', monitored=True))
+        self.mgr.set_resource_sync_pending(self.ctx, bd)
+        # Monitored objects can't be deleted while their sync is pending
+        self.assertRaises(
+            root.cherrypy.HTTPError, self._bulk, 'POST',
+            [self._bd_item('t1', 'bd0')],
+            **{'object-type': 'bridge_domain', 'tenant_name': 't1'})
+        self.assertEqual(4, len(self.mgr.find(
+            self.ctx, api_res.BridgeDomain, tenant_name='t1')))
+
+    def test_bulk_ownership_flip(self):
+        bd = api_res.BridgeDomain(tenant_name='t1', name='bd0')
+        self.mgr.set_resource_sync_synced(self.ctx, bd)
+        self.assertEqual(status_res.AciStatus.SYNCED,
+                         self.mgr.get_status(self.ctx, bd).sync_status)
+        resp, _, _ = self._bulk(
+            'PUT', [self._bd_item('t1', 'bd0', monitored=True)])
+        self.assertEqual([('updated', 't1', 'bd0')], self._results(resp))
+        self.assertTrue(self.mgr.get(self.ctx, bd).monitored)
+        # Like with the AIM manager, the object goes back in pending
+        self.assertEqual(status_res.AciStatus.SYNC_PENDING,
+                         self.mgr.get_status(self.ctx, bd).sync_status)
@@ -15,6 +15,7 @@
 
 import mock
 
+from aim.common import utils
 from aim import config
 from aim.db import config_model
 from aim import exceptions as exc
@@ -279,3 +280,73 @@ class TestAimConfig(base.TestAimDBBase):
         cfg_mgr2 = config.ConfigManager(self.ctx, 'h2')
         self.assertTrue(cfg_mgr1 is not cfg_mgr2)
         self.assertTrue(cfg_mgr1.subs_mgr is cfg_mgr2.subs_mgr)
+
+    def test_option_cache(self):
+        cfg_mgr = config.ConfigManager(self.ctx, 'h1')
+        with mock.patch.object(cfg_mgr.db, 'get',
+                               wraps=cfg_mgr.db.get) as db_get:
+            self.assertEqual(['1.1.1.1', '1.1.1.2', '1.1.1.3'],
+                             cfg_mgr.get_option('apic_hosts', 'apic'))
+            # Host specific miss and default value
+            self.assertEqual(2, db_get.call_count)
+            self.assertEqual(['1.1.1.1', '1.1.1.2', '1.1.1.3'],
+                             cfg_mgr.get_option('apic_hosts', 'apic'))
+            self.assertEqual(2, db_get.call_count)
+            # Local changes invalidate the cache
+            self.set_override('apic_hosts', ['2.2.2.2'], 'apic')
+            self.assertEqual(['2.2.2.2'],
+                             cfg_mgr.get_option('apic_hosts', 'apic'))
+            self.assertEqual(4, db_get.call_count)
+            # Returned values can't modify the cache
+            cfg_mgr.get_option('apic_hosts', 'apic').append('3.3.3.3')
+            self.assertEqual(['2.2.2.2'],
+                             cfg_mgr.get_option('apic_hosts', 'apic'))
+            # Entries expire
+            now = utils.get_time()
+            with mock.patch.object(utils, 'get_time',
+                                   return_value=now + 100):
+                cfg_mgr.get_option('apic_hosts', 'apic')
+            self.assertEqual(6, db_get.call_count)
+
+    def test_option_cache_disabled(self):
+        config.CONF.set_override('config_cache_ttl', 0, 'aim')
+        cfg_mgr = config.ConfigManager(self.ctx, 'h1')
+        with mock.patch.object(cfg_mgr.db, 'get',
+                               wraps=cfg_mgr.db.get) as db_get:
+            cfg_mgr.get_option('apic_hosts', 'apic')
+            cfg_mgr.get_option('apic_hosts', 'apic')
+            self.assertEqual(4, db_get.call_count)
+
+    def test_option_cache_stale_epoch(self):
+        cache = config.OPTION_CACHE
+        epoch = cache.epoch
+        cache.invalidate()
+        # Values read before an invalidation are not stored
+        cache.set(('apic', 'apic_hosts', ''), {'value': '1.1.1.1'}, epoch)
+        self.assertEqual((None, False), cache.get(('apic', 'apic_hosts', '')))
+        cache.set(('apic', 'apic_hosts', ''), {'value': '1.1.1.1'},
+                  cache.epoch)
+        self.assertEqual(({'value': '1.1.1.1'}, True),
+                         cache.get(('apic', 'apic_hosts', '')))
+
+    def test_poll_and_execute_single_query(self):
+        cfg_mgr = config.ConfigManager(self.ctx, 'h1')
+        callbacks = [mock.Mock() for _ in range(3)]
+        cfg_mgr.get_option_and_subscribe(callbacks[0], 'apic_hosts', 'apic')
+        cfg_mgr.get_option_and_subscribe(callbacks[1], 'aim_system_id',
+                                         'aim')
+        cfg_mgr.get_option_and_subscribe(callbacks[2], 'agent_down_time',
+                                         'aim')
+        self.set_override('apic_hosts', ['2.2.2.2'], 'apic')
+        self.set_override('agent_down_time', 20, 'aim', host='h1')
+        with mock.patch.object(cfg_mgr.db.aim_mgr, 'find',
+                               wraps=cfg_mgr.db.aim_mgr.find) as find:
+            cfg_mgr.subs_mgr._poll_and_execute()
+            self.assertEqual(1, find.call_count)
+        callbacks[0].assert_called_once_with(
+            {'key': 'apic_hosts', 'host': '', 'group': 'apic',
+             'value': ['2.2.2.2'], 'version': mock.ANY})
+        self.assertFalse(callbacks[1].called)
+        callbacks[2].assert_called_once_with(
+            {'key': 'agent_down_time', 'host': 'h1', 'group': 'aim',
+             'value': 20, 'version': mock.ANY})
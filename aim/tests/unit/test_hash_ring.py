@@ -13,6 +13,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import random
 import uuid
 
 from aim.common import hashring
@@ -152,3 +153,89 @@ class TestHashRing(base.BaseTestCase):
         ring.add_node('a', 6)
         a_count2 = self._count_replicas(ring, 'a')
         self.assertEqual(6, a_count2 / a_count)
+
+    def _simulate_tenants(self, seed, count=500):
+        # Heavily skewed tenant sizes: most tenants are small, a few are
+        # orders of magnitude bigger than the average.
+        rand = random.Random(seed)
+        return dict(('tn-%s' % x, int(rand.paretovariate(1.1) * 10))
+                    for x in range(count))
+
+    def _loads(self, keys, allocations):
+        return dict((node, sum(keys[x] for x in assigned))
+                    for node, assigned in allocations.items())
+
+    def test_walk_key(self):
+        ring = hashring.ConsistentHashRing({'a': None, 'b': None, 'c': 2})
+        for x in range(20):
+            key = str(uuid.uuid4())
+            walk = list(ring.walk_key(key))
+            self.assertEqual(['a', 'b', 'c'], sorted(walk))
+            self.assertEqual(ring.assign_key(key)[0], walk[0])
+
+    def test_assign_weighted_keys_balance(self):
+        nodes = dict((str(x), None) for x in range(5))
+        ring = hashring.ConsistentHashRing(nodes)
+        for seed in range(5):
+            keys = self._simulate_tenants(seed)
+            allocations = ring.assign_weighted_keys(keys, balance_factor=1.1)
+            # Every key is assigned exactly once
+            assigned = [x for y in allocations.values() for x in y]
+            self.assertEqual(sorted(keys), sorted(assigned))
+            fair = sum(keys.values()) / float(len(nodes))
+            weighted = self._loads(keys, allocations)
+            unweighted = {}
+            for key, weight in keys.items():
+                node = ring.assign_key(key)[0]
+                unweighted[node] = unweighted.get(node, 0) + weight
+            # No node exceeds the bound unless a single key does
+            self.assertTrue(max(weighted.values()) <=
+                            max(1.1 * fair, max(keys.values())))
+            self.assertTrue(max(weighted.values()) <=
+                            max(unweighted.values()))
+
+    def test_assign_weighted_keys_node_weight(self):
+        ring = hashring.ConsistentHashRing({'a': 1, 'b': 3})
+        keys = dict(('tn-%s' % x, 10) for x in range(400))
+        loads = self._loads(keys, ring.assign_weighted_keys(keys, 1.05))
+        self.assertTrue(loads['a'] <= 1.05 * 1000)
+        self.assertTrue(loads['b'] <= 1.05 * 3000)
+
+    def test_assign_weighted_keys_minimal_movement(self):
+        nodes = dict((str(x), None) for x in range(5))
+        ring = hashring.ConsistentHashRing(nodes)
+        keys = self._simulate_tenants(42)
+        before = ring.assign_weighted_keys(keys)
+        # Same input, same output, even on a different instance
+        self.assertEqual(
+            before, hashring.ConsistentHashRing(nodes).assign_weighted_keys(
+                keys))
+
+        def owners(allocations):
+            return dict((x, node) for node, assigned in allocations.items()
+                        for x in assigned)
+
+        # Adding a node only moves keys to the new node, roughly its share
+        ring.add_node('5')
+        after = ring.assign_weighted_keys(keys)
+        moved = [x for x, node in owners(after).items()
+                 if owners(before)[x] != node]
+        self.assertTrue(len(moved) < len(keys) / 3)
+        # A small change in a single key's weight moves a handful of keys
+        before = after
+        keys['tn-0'] += 1
+        after = ring.assign_weighted_keys(keys)
+        moved = [x for x, node in owners(after).items()
+                 if owners(before)[x] != node]
+        self.assertTrue(len(moved) <= 5)
+
+    def test_assign_weighted_keys_oversized(self):
+        ring = hashring.ConsistentHashRing({'a': None, 'b': None})
+        keys = {'big': 1000, 'small1': 1, 'small2': 1}
+        allocations = ring.assign_weighted_keys(keys)
+        big_owner = [x for x, y in allocations.items() if 'big' in y][0]
+        other = 'a' if big_owner == 'b' else 'b'
+        self.assertEqual(['big'], allocations[big_owner])
+        self.assertEqual(['small1', 'small2'], sorted(allocations[other]))
+        self.assertEqual({}, hashring.ConsistentHashRing(
+            {}).assign_weighted_keys(keys))
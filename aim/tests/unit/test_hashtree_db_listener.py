@@ -243,6 +243,8 @@ class TestHashTreeDbListener(base.TestAimDBBase):
 
     @base.requires(['hooks'])
     def test_tree_hooks(self):
+        # Every notification is expected
+        self.set_override('agent_event_notification_window', 0, 'aim')
         with mock.patch('aim.agent.aid.event_services.'
                         'rpc.AIDEventRpcApi._cast') as cast:
             tn_name = 'test_tree_hooks'
@@ -258,7 +260,7 @@ class TestHashTreeDbListener(base.TestAimDBBase):
             # consequently a reconcile call
             exp_calls = [
                 mock.call(mock.ANY, 'serve', None),
-                mock.call(mock.ANY, 'reconcile', None)]
+                mock.call(mock.ANY, 'reconcile', None, roots=[tn_rn])]
             self._check_call_list(exp_calls, cast)
             self.mgr.create(self.ctx, tn)
             cast.reset_mock()
@@ -266,16 +268,16 @@ class TestHashTreeDbListener(base.TestAimDBBase):
             self.mgr.create(self.ctx, epg)
             # Create AP will create tenant, create EPG will modify it
             exp_calls = [
-                mock.call(mock.ANY, 'reconcile', None),
-                mock.call(mock.ANY, 'reconcile', None),
-                mock.call(mock.ANY, 'reconcile', None),
-                mock.call(mock.ANY, 'reconcile', None)]
+                mock.call(mock.ANY, 'reconcile', None, roots=[tn_rn]),
+                mock.call(mock.ANY, 'reconcile', None, roots=[tn_rn]),
+                mock.call(mock.ANY, 'reconcile', None, roots=[tn_rn]),
+                mock.call(mock.ANY, 'reconcile', None, roots=[tn_rn])]
             self._check_call_list(exp_calls, cast)
             cast.reset_mock()
             self.mgr.update(self.ctx, epg, bd_name='bd2')
             exp_calls = [
-                mock.call(mock.ANY, 'reconcile', None),
-                mock.call(mock.ANY, 'reconcile', None)]
+                mock.call(mock.ANY, 'reconcile', None, roots=[tn_rn]),
+                mock.call(mock.ANY, 'reconcile', None, roots=[tn_rn])]
             self._check_call_list(exp_calls, cast)
             cast.reset_mock()
             self.tt_mgr.delete_by_root_rn(self.ctx, tn_rn)
@@ -452,6 +454,8 @@ class TestHashTreeDbListenerNoMockStore(base.TestAimDBBase):
 
     @base.requires(['hooks'])
     def test_tree_hooks_transactions(self):
+        # Every notification is expected
+        self.set_override('agent_event_notification_window', 0, 'aim')
         with mock.patch('aim.agent.aid.event_services.'
                         'rpc.AIDEventRpcApi._cast') as cast:
             tn = aim_res.Tenant(name='test_tree_hooks')
@@ -481,7 +485,9 @@ class TestHashTreeDbListenerNoMockStore(base.TestAimDBBase):
                     self.mgr.create(self.ctx, ap1)
                     self.mgr.create(self.ctx, epg1)
                 self.assertEqual(0, cast.call_count)
-            exp_calls = [mock.call(mock.ANY, 'reconcile', None)]
+            exp_calls = [mock.call(mock.ANY, 'reconcile', None,
+                                   roots=['tn-test_tree_hooks',
+                                          'tn-test_tree_hooks1'])]
             self._check_call_list(exp_calls, cast)
             cast.reset_mock()
 
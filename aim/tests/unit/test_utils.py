@@ -21,6 +21,8 @@ Tests for `utils` module.
 """
 
 import mock
+import threading
+import time
 
 from aim.common import utils as internal_utils
 from aim.tests import base
@@ -118,3 +120,46 @@ class TestUtils(base.TestAimDBBase):
         self.assertTrue('test' in internal_utils.all_locks)
         self.assertTrue('test2' in internal_utils.all_locks)
         self.assertEqual(2, len(internal_utils.all_locks))
+
+    def test_chunks(self):
+        self.assertEqual([[1, 2], [3, 4], [5]],
+                         list(internal_utils.chunks([1, 2, 3, 4, 5], 2)))
+        self.assertEqual([[1, 2]],
+                         list(internal_utils.chunks(iter([1, 2]), 5)))
+        self.assertEqual([], list(internal_utils.chunks([], 3)))
+
+    def test_run_in_parallel(self):
+        running = {'now': 0, 'max': 0}
+        lock = threading.Lock()
+
+        def task(i):
+            with lock:
+                running['now'] += 1
+                running['max'] = max(running['max'], running['now'])
+            time.sleep(0.01)
+            with lock:
+                running['now'] -= 1
+            return i
+
+        tasks = [lambda i=i: task(i) for i in range(10)]
+        self.assertEqual(list(range(10)),
+                         internal_utils.run_in_parallel(tasks, 4))
+        self.assertTrue(1 < running['max'] <= 4)
+        # Bounded by the semaphore
+        running['max'] = 0
+        self.assertEqual(
+            list(range(10)), internal_utils.run_in_parallel(
+                tasks, 4, semaphore=threading.Semaphore(2)))
+        self.assertTrue(running['max'] <= 2)
+        running['max'] = 0
+        internal_utils.run_in_parallel(tasks, 1)
+        self.assertEqual(1, running['max'])
+        self.assertEqual([], internal_utils.run_in_parallel([], 4))
+
+        # All tasks run, then the first error is raised
+        def fail():
+            raise KeyError()
+        done = mock.Mock()
+        self.assertRaises(KeyError, internal_utils.run_in_parallel,
+                          [fail, done, done], 2)
+        self.assertEqual(2, done.call_count)
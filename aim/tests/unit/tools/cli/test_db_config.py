@@ -34,6 +34,12 @@ class TestDBConfig(base.TestShell):
             ['1.1.1.1', '1.1.1.2', '1.1.1.3'],
             self.manager.get_option('apic_hosts', 'apic'))
 
+    def test_config_not_cached(self):
+        self.run_command('config update')
+        self.assertEqual(0, config.CONF.aim.config_cache_ttl)
+        self.manager.get_option('apic_hosts', 'apic')
+        self.assertEqual({}, config.OPTION_CACHE._entries)
+
     def test_replace_all_no_host(self):
         self.run_command('config replace')
         self.assertEqual(
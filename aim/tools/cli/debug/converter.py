@@ -0,0 +1,92 @@
+# Copyright (c) 2017 Cisco Systems
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import click
+import time
+
+from aim.agent.aid.universes.aci import converter as aci_converter
+from aim.api import resource
+from aim.tools.cli.groups import aimcli
+
+
+@aimcli.aim.group(name='converter')
+@click.pass_context
+def converter(ctx):
+    pass
+
+
+def make_objects(count):
+    """Mixed AIM objects, spread over tenants of about 1000 objects"""
+    result = []
+    tenant = 0
+    while len(result) < count:
+        tn = 'tn-bench-%s' % tenant
+        result.append(resource.Tenant(name=tn))
+        result.append(resource.VRF(tenant_name=tn, name='vrf'))
+        result.append(resource.ApplicationProfile(tenant_name=tn, name='ap'))
+        for x in range(100):
+            name = 'obj-%s' % x
+            result.extend([
+                resource.BridgeDomain(tenant_name=tn, name=name,
+                                      vrf_name='vrf',
+                                      l3out_names=['l3out']),
+                resource.Subnet(tenant_name=tn, bd_name=name,
+                                gw_ip_mask='10.%s.%s.1/28' % (x, x % 16)),
+                resource.EndpointGroup(tenant_name=tn, app_profile_name='ap',
+                                       name=name, bd_name=name,
+                                       provided_contract_names=[name],
+                                       consumed_contract_names=[name]),
+                resource.Contract(tenant_name=tn, name=name),
+                resource.ContractSubject(tenant_name=tn, contract_name=name,
+                                         name='subj', bi_filters=[name]),
+                resource.Filter(tenant_name=tn, name=name),
+                resource.FilterEntry(tenant_name=tn, filter_name=name,
+                                     name='ssh', ip_protocol='tcp',
+                                     dest_from_port='22',
+                                     dest_to_port='22'),
+                resource.SecurityGroup(tenant_name=tn, name=name),
+                resource.SecurityGroupSubject(tenant_name=tn,
+                                              security_group_name=name,
+                                              name='subj'),
+                resource.SecurityGroupRule(
+                    tenant_name=tn, security_group_name=name,
+                    security_group_subject_name='subj', name='rule',
+                    remote_ips=['10.0.0.0/8'], ip_protocol='tcp',
+                    from_port='80', to_port='80')])
+        tenant += 1
+    return result[:count]
+
+
+@converter.command(name='benchmark')
+@click.option('--objects', default=100000,
+              help='Number of AIM objects to convert')
+@click.option('--repeat', default=3, help='Number of runs')
+@click.pass_context
+def benchmark(ctx, objects, repeat):
+    """Time the conversion of AIM objects to ACI and back"""
+    aim_objects = make_objects(objects)
+    to_aci = aci_converter.AimToAciModelConverter()
+    to_aim = aci_converter.AciToAimModelConverter()
+    for run in range(repeat):
+        start = time.time()
+        aci_objects = to_aci.convert(aim_objects)
+        aci_time = time.time() - start
+        start = time.time()
+        converted = to_aim.convert(aci_objects)
+        aim_time = time.time() - start
+        click.echo('Run %s: %s AIM objects to %s ACI objects in %.2f '
+                   'seconds, back to %s AIM objects in %.2f seconds' %
+                   (run, len(aim_objects), len(aci_objects), aci_time,
+                    len(converted), aim_time))
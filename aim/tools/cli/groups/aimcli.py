@@ -60,6 +60,9 @@ def aim(ctx, config_file, fmt, debug):
                 "search paths (~/.aim/, ~/, /etc/aim/, /etc/) and "
                 "the '--config-file' option %s!" % config_file)
         ctx.obj['conf'] = config.CONF
+    # Always read the config stored in the DB, which may have been
+    # changed by other processes
+    config.CONF.set_override('config_cache_ttl', 0, 'aim')
 
     ctx.obj['fmt'] = DEFAULT_FORMAT
     if fmt in AVAILABLE_FORMATS:
@@ -16,6 +16,7 @@
 import copy
 
 from oslo_log import log as logging
+import sqlalchemy as sa
 
 from aim.agent.aid.universes.aci import converter
 from aim.api import status as aim_status
@@ -182,6 +183,15 @@ class TreeManager(object):
     def get_roots(self, context):
         return [x.root_rn for x in self._find_query(context, ROOT_TREE)]
 
+    def get_sizes(self, context, tree=CONFIG_TREE):
+        """Size in bytes of the stored trees, by root."""
+        if 'sql' in context.store.features:
+            db_type = context.store.resource_to_db_type(tree)
+            return dict(context.store.db_session.query(
+                db_type.root_rn, sa.func.length(db_type.tree)).all())
+        return dict((x.root_rn, len(x.tree or b''))
+                    for x in self._find_query(context, tree))
+
     @utils.log
     def set_needs_reset_by_root_rn(self, context, root_rn, needs_reset=True):
         db_obj = self._find_query(context, ROOT_TREE, lock_update=True,